@@ -1,10 +1,13 @@
-from fastapi import Header, HTTPException
+import math
+
+from fastapi import Depends, Header, HTTPException, Request
 from typing import Optional
 
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy import select
 
 from database.database import get_db, UserConnection
+from utils.rate_limiter import route_limiters
 
 
 async def verify_token(user_id: int, x_auth_token: Optional[str] = Header(None)):
@@ -36,4 +39,42 @@ async def verify_token(user_id: int, x_auth_token: Optional[str] = Header(None))
             raise HTTPException(
                 status_code=500,
                 detail="Database error"
-            )
\ No newline at end of file
+            )
+
+
+def client_key(request: Request) -> str:
+    return f"ip:{request.client.host if request.client else 'unknown'}"
+
+
+async def check_limit(limiter, key: str):
+    retry_after = await limiter.take(key)
+    if retry_after:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many requests",
+            headers={"Retry-After": str(math.ceil(retry_after))}
+        )
+
+
+async def limit_client(request: Request):
+    # The only limit an unauthenticated request can touch: its own address.
+    await check_limit(route_limiters["client"], client_key(request))
+
+
+def rate_limited(route_class: str, authenticated: bool = True):
+    limiter = route_limiters[route_class]
+
+    if not authenticated:
+        async def check_client_rate_limit(request: Request, _: None = Depends(limit_client)):
+            await check_limit(limiter, client_key(request))
+
+        return check_client_rate_limit
+
+    # Runs after verify_token, so only the owner of a valid token can spend a user's bucket. Each token
+    # also has its own bucket, one busy device cannot use up what the user's other devices get.
+    async def check_rate_limit(_: None = Depends(limit_client), user_id: int = Depends(verify_token),
+                               x_auth_token: Optional[str] = Header(None)):
+        await check_limit(limiter, f"token:{x_auth_token}")
+        await check_limit(limiter, f"user:{user_id}")
+
+    return check_rate_limit
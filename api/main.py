@@ -1,37 +1,101 @@
+import asyncio
+import logging
+import math
 import os
+import secrets
 import tempfile
-from datetime import datetime
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
 from pathlib import Path
-from typing import Optional, List
+from typing import Optional, List, Callable
 
 from dotenv import load_dotenv
-from fastapi import FastAPI, Depends, HTTPException, BackgroundTasks, UploadFile, Form, File
+from fastapi import FastAPI, Depends, HTTPException, BackgroundTasks, UploadFile, Form, File, Request, Header
 from pydantic import BaseModel
 from starlette.background import BackgroundTask
 from starlette.middleware.cors import CORSMiddleware
 from fastapi.responses import Response, FileResponse
+from telegram import Update
 from telegram.ext import Application
 
 import database.database_worker
-from database.database_worker import get_all_user_boards, get_board_item_count, get_all_items_by_board_id, \
+from database.database_worker import get_all_user_boards, get_board_item_counts, get_all_items_by_board_id, \
     get_board_by_id, get_all_items_by_keyword, create_user_connection, get_user_connections, create_new_item, \
     get_item_by_id, remove_item_by_id, get_connection_by_id, get_board_by_name, update_board_name, remove_board_by_id, \
-    create_new_board, get_item_by_title
+    create_new_board, get_item_by_title, get_data_version, get_item_by_file_path, set_item_content_hash
+from database.instrumentation import track_queries
+from files.blob_cache import read_file
 from files.encryption_manager import encryption_manager
-from files.file_manager import file_manager
+from files.file_manager import file_manager, content_hash
+from files.pack_maintenance import start_maintenance
+from files.storage_backend import storage
+from files.thumbnailer import VARIANTS, can_render, create_variants, schedule_variants
+from files.user_keys import user_keys
 from handler.auth_handler import send_connection_request
+from utils.metrics import registry, http_request_duration, CONTENT_TYPE
+from utils.rate_limiter import upload_limiter, OverloadedError
+from utils.send_scheduler import SendScheduler
 
-from .dependencies import verify_token
+from .dependencies import verify_token, rate_limited
 
 bot_application: Optional[Application] = None
+update_router: Optional[Callable[[dict], None]] = None
+notifier: Optional[Application] = None
+notifier_lock = asyncio.Lock()
+
+logger = logging.getLogger(__name__)
 
 load_dotenv()
 TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+WEBHOOK_PATH = os.getenv("TELEGRAM_WEBHOOK_PATH", "/telegram/webhook")
+WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET")
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+async def notification_bot() -> Optional[Application]:
+    # A bot run by the polling or webhook runner is initialized by it. Without one the API builds its own on the
+    # first notification, so startup never waits for getMe. Either way one bot's send scheduler sees every message.
+    global notifier
+    if bot_application is not None:
+        return bot_application
+    if not TOKEN:
+        return None
+    async with notifier_lock:
+        if notifier is None:
+            application = Application.builder().token(TOKEN).rate_limiter(SendScheduler()).build()
+            await application.initialize()
+            notifier = application
+    return notifier
+
+
+async def notify_connection_request(user_id: int, connect_id: str, client_name: str):
+    try:
+        application = await notification_bot()
+    except Exception as e:
+        logger.error(f"Error starting the notification bot: {e}")
+        return
+    if application is not None:
+        await send_connection_request(user_id, connect_id, client_name, application)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global notifier
+    maintenance = start_maintenance()
+    yield
+    if maintenance is not None:
+        maintenance.cancel()
+    if notifier is not None:
+        await notifier.shutdown()
+        notifier = None
+
 
 app = FastAPI(
     title="PinTag API",
     description="API для доступа к закладкам из Flutter приложения",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 app.add_middleware(
@@ -42,6 +106,73 @@ app.add_middleware(
 )
 
 
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    def route_name():
+        route = request.scope.get("route")
+        return route.path if route else "unmatched"
+
+    started_at = time.perf_counter()
+    status = 500
+    try:
+        with track_queries(lambda: f"api:{request.method} {route_name()}"):
+            response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        http_request_duration.observe(
+            time.perf_counter() - started_at,
+            method=request.method,
+            route=route_name(),
+            status=status,
+        )
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match uses weak comparison, so W/"x" and "x" are the same validator.
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return etag.removeprefix("W/") in candidates
+
+
+async def listing_not_modified(request: Request, response: Response, user_id: int) -> Optional[Response]:
+    # Every write bumps the user's data version, so one counter read decides before any listing query runs.
+    version = await get_data_version(user_id)
+    headers = {"ETag": f'W/"{user_id}.{version}"', "Cache-Control": "private, no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
+
+def file_cache_headers(item, versioned: bool, variant: Optional[str] = None) -> dict:
+    # A URL carrying the content hash (?v=) can never change, everything else is revalidated.
+    cache_control = f"private, max-age={IMMUTABLE_MAX_AGE}, immutable" if versioned else "private, no-cache"
+    headers = {"Cache-Control": cache_control}
+    if item.content_hash:
+        headers["ETag"] = f'"{item.content_hash}.{variant}"' if variant else f'"{item.content_hash}"'
+    if item.created_at:
+        headers["Last-Modified"] = format_datetime(item.created_at.replace(tzinfo=timezone.utc), usegmt=True)
+    return headers
+
+
+def file_not_modified(request: Request, headers: dict) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return "ETag" in headers and etag_matches(if_none_match, headers["ETag"])
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if not if_modified_since or "Last-Modified" not in headers:
+        return False
+    try:
+        return parsedate_to_datetime(headers["Last-Modified"]) <= parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+
+
 class BoardOut(BaseModel):
     id: int
     name: str
@@ -58,6 +189,7 @@ class ItemOut(BaseModel):
     created_at: str
     board_name: str
     board_emoji: str
+    content_hash: Optional[str] = None
 
 
 class ConnectionRequest(BaseModel):
@@ -87,7 +219,7 @@ class MoveItemRequest(BaseModel):
     new_board_id: int
 
 
-@app.post("/users/{user_id}/generate-connect")
+@app.post("/users/{user_id}/generate-connect", dependencies=[Depends(rate_limited("write", authenticated=False))])
 async def generate_connect_id(
     user_id: int,
     request: ConnectionRequest,
@@ -96,17 +228,7 @@ async def generate_connect_id(
     try:
         connection = await create_user_connection(user_id, request.client_name)
 
-        async def notify_bot():
-            application = Application.builder().token(TOKEN).build()
-            await application.initialize()
-            await application.start()
-            try:
-                await send_connection_request(user_id, connection.connect_id, request.client_name, application)
-            finally:
-                await application.stop()
-                await application.shutdown()
-
-        background_tasks.add_task(notify_bot)
+        background_tasks.add_task(notify_connection_request, user_id, connection.connect_id, request.client_name)
 
         return {
             "status": "success",
@@ -117,7 +239,7 @@ async def generate_connect_id(
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.get("/connections/{connect_id}/status")
+@app.get("/connections/{connect_id}/status", dependencies=[Depends(rate_limited("read", authenticated=False))])
 async def get_connection_status(connect_id: str):
     try:
         connection = await get_connection_by_id(connect_id)
@@ -136,7 +258,7 @@ async def get_connection_status(connect_id: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.get("/users/{user_id}/connections/pending")
+@app.get("/users/{user_id}/connections/pending", dependencies=[Depends(rate_limited("read"))])
 async def get_pending_connections(user_id: int, token: str = Depends(verify_token)):
     try:
         connections = await get_user_connections(user_id)
@@ -154,7 +276,7 @@ async def get_pending_connections(user_id: int, token: str = Depends(verify_toke
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.get("/users/{user_id}/connections")
+@app.get("/users/{user_id}/connections", dependencies=[Depends(rate_limited("read"))])
 async def get_connections(user_id: int, token: str = Depends(verify_token)):
     try:
         connections = await get_user_connections(user_id)
@@ -172,28 +294,27 @@ async def get_connections(user_id: int, token: str = Depends(verify_token)):
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.get("/users/{user_id}/boards", response_model=List[BoardOut])
-async def get_user_boards(user_id: int, token: str = Depends(verify_token)):
+@app.get("/users/{user_id}/boards", response_model=List[BoardOut],
+         dependencies=[Depends(rate_limited("read"))])
+async def get_user_boards(user_id: int, request: Request, response: Response, token: str = Depends(verify_token)):
     try:
-        boards = await get_all_user_boards(user_id)
+        not_modified = await listing_not_modified(request, response, user_id)
+        if not_modified:
+            return not_modified
 
-        result = []
-        for board in boards:
-            count = await get_board_item_count(user_id, board.id)
-            result.append(BoardOut(
-                id=board.id,
-                name=board.name,
-                emoji=board.emoji,
-                item_count=count
-            ))
+        boards = await get_all_user_boards(user_id)
+        counts = await get_board_item_counts(user_id)
 
-        return result
+        return [
+            BoardOut(id=board.id, name=board.name, emoji=board.emoji, item_count=counts.get(board.id, 0))
+            for board in boards
+        ]
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/users/{user_id}/boards")
+@app.post("/users/{user_id}/boards", dependencies=[Depends(rate_limited("write"))])
 async def create_board(user_id: int, request: CreateBoardRequest, token: str = Depends(verify_token)):
     try:
         existing_board = await get_board_by_name(user_id, request.board_name)
@@ -206,7 +327,7 @@ async def create_board(user_id: int, request: CreateBoardRequest, token: str = D
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/users/{user_id}/boards/{board_id}")
+@app.post("/users/{user_id}/boards/{board_id}", dependencies=[Depends(rate_limited("write"))])
 async def rename_board(user_id: int, board_id: int, new_board_name: str, new_board_emoji: Optional[str],
                        token: str = Depends(verify_token)):
     try:
@@ -224,7 +345,7 @@ async def rename_board(user_id: int, board_id: int, new_board_name: str, new_boa
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.delete("/users/{user_id}/boards/{board_id}")
+@app.delete("/users/{user_id}/boards/{board_id}", dependencies=[Depends(rate_limited("write"))])
 async def remove_board(user_id: int, board_id: int, token: str = Depends(verify_token)):
     try:
         board = await get_board_by_id(user_id, board_id)
@@ -237,9 +358,15 @@ async def remove_board(user_id: int, board_id: int, token: str = Depends(verify_
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.get("/users/{user_id}/boards/{board_id}/items", response_model=List[ItemOut])
-async def get_board_items(user_id: int, board_id: int, token: str = Depends(verify_token)):
+@app.get("/users/{user_id}/boards/{board_id}/items", response_model=List[ItemOut],
+         dependencies=[Depends(rate_limited("read"))])
+async def get_board_items(user_id: int, board_id: int, request: Request, response: Response,
+                          token: str = Depends(verify_token)):
     try:
+        not_modified = await listing_not_modified(request, response, user_id)
+        if not_modified:
+            return not_modified
+
         items = await get_all_items_by_board_id(user_id, board_id)
         board = await get_board_by_id(user_id, board_id)
 
@@ -251,6 +378,7 @@ async def get_board_items(user_id: int, board_id: int, token: str = Depends(veri
                 content_type=item.content_type,
                 content_data=item.content_data,
                 file_path=item.file_path,
+                content_hash=item.content_hash,
                 created_at=item.created_at.isoformat(),
                 board_name=board.name,
                 board_emoji=board.emoji
@@ -262,11 +390,42 @@ async def get_board_items(user_id: int, board_id: int, token: str = Depends(veri
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.get("/files/{user_id}/{file_path:path}")
-async def get_file(user_id: int, file_path: str, token: str = Depends(verify_token)):
+@app.get("/files/{user_id}/{file_path:path}", dependencies=[Depends(rate_limited("read"))])
+async def get_file(user_id: int, file_path: str, request: Request, v: Optional[str] = None,
+                   variant: Optional[str] = None, token: str = Depends(verify_token)):
     try:
-        file_data = file_manager.get_file(file_path)
-        decrypted_data = encryption_manager.decrypt_file(file_data)
+        if variant is not None and variant not in VARIANTS:
+            raise HTTPException(status_code=400, detail=f"Допустимые варианты: {', '.join(VARIANTS)}")
+
+        item = await get_item_by_file_path(user_id, file_path)
+        if not item:
+            raise HTTPException(status_code=404, detail="Файл не найден")
+
+        headers = file_cache_headers(item, versioned=v is not None and v == item.content_hash, variant=variant)
+        if file_not_modified(request, headers):
+            return Response(status_code=304, headers=headers)
+
+        if variant:
+            variant_path = file_manager.variant_path(file_path, variant)
+            if not await storage.exists(variant_path):
+                if not can_render(item.content_type):
+                    raise HTTPException(status_code=404, detail="Превью недоступно")
+                original_data = await read_file(user_id, file_path, item.encrypted)
+                if variant not in await create_variants(user_id, file_path, original_data, item.content_type):
+                    raise HTTPException(status_code=404, detail="Превью недоступно")
+
+            return Response(
+                content=await read_file(user_id, variant_path),
+                media_type="image/jpeg",
+                headers={"Content-Disposition": "inline", **headers},
+            )
+
+        decrypted_data = await read_file(user_id, file_path, item.encrypted)
+        if not item.content_hash:
+            # Files stored before hashes were recorded get one on first download.
+            item_hash = await asyncio.to_thread(content_hash, decrypted_data)
+            await set_item_content_hash(user_id, item.id, item_hash)
+            headers["ETag"] = f'"{item_hash}"'
 
         file_ext = Path(file_path).suffix.lower()
         mime_types = {
@@ -292,7 +451,8 @@ async def get_file(user_id: int, file_path: str, token: str = Depends(verify_tok
             return FileResponse(
                 path=tmp_path,
                 media_type=mime_type,
-                filename=Path(file_path).name,
+                filename=file_manager.display_name(file_path),
+                headers=headers,
                 background=BackgroundTask(os.unlink, tmp_path)
             )
 
@@ -302,17 +462,19 @@ async def get_file(user_id: int, file_path: str, token: str = Depends(verify_tok
                 media_type=mime_type,
                 headers={
                     "Content-Disposition": "inline",
-                    "Cache-Control": "max-age=3600"
+                    **headers
                 }
             )
 
+    except HTTPException:
+        raise
     except FileNotFoundError as e:
         raise HTTPException(status_code=404, detail="Файл не найден")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/users/{user_id}/items")
+@app.post("/users/{user_id}/items", dependencies=[Depends(rate_limited("write"))])
 async def create_item(
         user_id: int,
         request: CreateItemRequest,
@@ -347,7 +509,7 @@ async def create_item(
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/users/{user_id}/items/upload")
+@app.post("/users/{user_id}/items/upload", dependencies=[Depends(rate_limited("upload"))])
 async def upload_file(user_id: int,
         board_id: int = Form(...),
         title: str = Form(...),
@@ -370,8 +532,15 @@ async def upload_file(user_id: int,
                 else '.mp4' if content_type == 'video' else '.bin'
             original_filename += file_extension
 
-        encrypted_data = encryption_manager.encrypt_file(file_data)
-        file_path = file_manager.save_file(encrypted_data, user_id, content_type + "s", original_filename)
+        async with upload_limiter:
+            file_hash = await asyncio.to_thread(content_hash, file_data)
+            data_key = await user_keys.for_writing(user_id)
+            encrypted_data = await asyncio.to_thread(
+                encryption_manager.encrypt_file, file_data, content_type, original_filename, data_key
+            )
+            file_path = await storage.save_file(encrypted_data, user_id, content_type + "s", original_filename)
+
+        schedule_variants(user_id, file_path, file_data, content_type)
 
         new_item = await create_new_item(
             user_id=user_id,
@@ -380,8 +549,10 @@ async def upload_file(user_id: int,
             content_type=content_type,
             content_data=content_data,
             file_path = file_path,
-            file_size = file_manager.get_file_size(file_path),
-            encrypted=True
+            file_size = len(encrypted_data),
+            encrypted=True,
+            content_hash=file_hash,
+            data_key=data_key is not None
         )
 
         return {
@@ -389,14 +560,28 @@ async def upload_file(user_id: int,
             "item_id": new_item.id,
             "message": f"Элемент '{title}' создан",
         }
+    except HTTPException:
+        raise
+    except OverloadedError as oex:
+        raise HTTPException(
+            status_code=503,
+            detail="Сервер перегружен, попробуй позже",
+            headers={"Retry-After": str(math.ceil(oex.retry_after))}
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 
-@app.get("/users/{user_id}/search", response_model=List[ItemOut])
-async def search_items(user_id: int, q: str, token: str = Depends(verify_token)):
+@app.get("/users/{user_id}/search", response_model=List[ItemOut],
+         dependencies=[Depends(rate_limited("read"))])
+async def search_items(user_id: int, q: str, request: Request, response: Response,
+                       token: str = Depends(verify_token)):
     try:
+        not_modified = await listing_not_modified(request, response, user_id)
+        if not_modified:
+            return not_modified
+
         items = await get_all_items_by_keyword(user_id, q)
 
         result = []
@@ -408,6 +593,7 @@ async def search_items(user_id: int, q: str, token: str = Depends(verify_token))
                 content_type=item.content_type,
                 content_data=item.content_data,
                 file_path=item.file_path,
+                content_hash=item.content_hash,
                 created_at=item.created_at.isoformat(),
                 board_name=board.name,
                 board_emoji=board.emoji
@@ -419,7 +605,7 @@ async def search_items(user_id: int, q: str, token: str = Depends(verify_token))
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/users/{user_id}/items/{item_id}")
+@app.post("/users/{user_id}/items/{item_id}", dependencies=[Depends(rate_limited("write"))])
 async def move_item(user_id: int, item_id: int, request: MoveItemRequest, token: str = Depends(verify_token)):
     try:
         new_board_id = request.new_board_id
@@ -437,7 +623,7 @@ async def move_item(user_id: int, item_id: int, request: MoveItemRequest, token:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.delete("/users/{user_id}/items/{item_id}")
+@app.delete("/users/{user_id}/items/{item_id}", dependencies=[Depends(rate_limited("write"))])
 async def delete_item(user_id: int, item_id: int, token: str = Depends(verify_token)):
     try:
         item = await get_item_by_id(user_id, item_id)
@@ -454,9 +640,13 @@ async def delete_item(user_id: int, item_id: int, token: str = Depends(verify_to
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.get("/users/{user_id}/stats")
-async def get_user_stats(user_id: int, token: str = Depends(verify_token)):
+@app.get("/users/{user_id}/stats", dependencies=[Depends(rate_limited("read"))])
+async def get_user_stats(user_id: int, request: Request, response: Response, token: str = Depends(verify_token)):
     try:
+        not_modified = await listing_not_modified(request, response, user_id)
+        if not_modified:
+            return not_modified
+
         from database.database_worker import (
             get_all_user_board_count, get_all_user_item_count, get_item_stats
         )
@@ -474,6 +664,30 @@ async def get_user_stats(user_id: int, token: str = Depends(verify_token)):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post(WEBHOOK_PATH, include_in_schema=False)
+async def telegram_webhook(request: Request,
+                           x_telegram_bot_api_secret_token: Optional[str] = Header(None)):
+    if not WEBHOOK_SECRET or not x_telegram_bot_api_secret_token or \
+            not secrets.compare_digest(x_telegram_bot_api_secret_token, WEBHOOK_SECRET):
+        raise HTTPException(status_code=403, detail="Invalid webhook secret token")
+
+    if update_router is not None:
+        update_router(await request.json())
+        return {"ok": True}
+
+    if bot_application is None or not bot_application.running:
+        raise HTTPException(status_code=503, detail="Bot is not running")
+
+    update = Update.de_json(await request.json(), bot_application.bot)
+    await bot_application.update_queue.put(update)
+    return {"ok": True}
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return Response(content=registry.render(), media_type=CONTENT_TYPE)
+
+
 @app.get("/")
 async def root():
     return {"message": "PinTag API", "status": "running"}
\ No newline at end of file
@@ -0,0 +1,163 @@
+import argparse
+import asyncio
+import logging
+import random
+import shutil
+import sys
+import time
+from pathlib import Path
+
+from benchmarks.common import summarize, write_report, print_results, gate
+from benchmarks.data_generator import prepare_environment, generate, parse_sizes, token_for, WORDS
+
+logger = logging.getLogger(__name__)
+
+SCENARIOS = ["boards", "board_items", "search", "upload", "file_download", "stats"]
+
+
+class ApiBenchmark:
+    def __init__(self, client, users: list[int], rng: random.Random, upload_size: int):
+        self.client = client
+        self.users = users
+        self.rng = rng
+        self.upload_data = rng.randbytes(upload_size)
+        self.user_boards: dict[int, list[int]] = {}
+        self.user_files: dict[int, list[str]] = {}
+
+
+    def headers(self, user_id: int) -> dict:
+        return {"X-Auth-Token": token_for(user_id)}
+
+
+    async def load_fixtures(self):
+        from sqlalchemy import select
+        from database.database import AsyncSessionLocal, Board, Item
+
+        async with AsyncSessionLocal() as db:
+            for board_id, user_id in (await db.execute(select(Board.id, Board.user_id))).all():
+                self.user_boards.setdefault(user_id, []).append(board_id)
+            for file_path, user_id in (await db.execute(
+                    select(Item.file_path, Item.user_id).filter(Item.file_path.isnot(None)))).all():
+                self.user_files.setdefault(user_id, []).append(file_path)
+
+
+    async def boards(self, user_id: int):
+        return await self.client.get(f"/users/{user_id}/boards", headers=self.headers(user_id))
+
+
+    async def board_items(self, user_id: int):
+        board_id = self.rng.choice(self.user_boards[user_id])
+        return await self.client.get(f"/users/{user_id}/boards/{board_id}/items", headers=self.headers(user_id))
+
+
+    async def search(self, user_id: int):
+        return await self.client.get(f"/users/{user_id}/search", params={"q": self.rng.choice(WORDS)},
+                                     headers=self.headers(user_id))
+
+
+    async def upload(self, user_id: int):
+        return await self.client.post(
+            f"/users/{user_id}/items/upload",
+            data={"board_id": self.rng.choice(self.user_boards[user_id]), "title": f"bench upload {time.time_ns()}",
+                  "content_type": "photo"},
+            files={"file": ("bench.jpg", self.upload_data, "image/jpeg")},
+            headers=self.headers(user_id),
+        )
+
+
+    async def file_download(self, user_id: int):
+        if not self.user_files.get(user_id):
+            return None
+        file_path = self.rng.choice(self.user_files[user_id])
+        return await self.client.get(f"/files/{user_id}/{file_path}", headers=self.headers(user_id))
+
+
+    async def stats(self, user_id: int):
+        return await self.client.get(f"/users/{user_id}/stats", headers=self.headers(user_id))
+
+
+    async def run_scenario(self, name: str, requests: int, concurrency: int) -> dict:
+        scenario = getattr(self, name)
+        latencies = []
+        errors = 0
+        remaining = iter(range(requests))
+
+        async def worker():
+            nonlocal errors
+            for _ in remaining:
+                user_id = self.rng.choice(self.users)
+                started_at = time.perf_counter()
+                response = await scenario(user_id)
+                if response is None:
+                    continue
+                latencies.append(time.perf_counter() - started_at)
+                if response.status_code >= 400:
+                    errors += 1
+
+        started_at = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return summarize(latencies, time.perf_counter() - started_at, errors)
+
+
+async def run(args) -> dict:
+    import httpx
+    from database.database import init_db
+    from api.main import app
+
+    if args.generate:
+        await generate(args.users, args.boards, args.items, parse_sizes(args.file_sizes), args.file_ratio, args.seed)
+    await init_db()
+
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+        benchmark = ApiBenchmark(client, [], random.Random(args.seed), parse_sizes(args.upload_size)[0])
+        await benchmark.load_fixtures()
+        benchmark.users = sorted(benchmark.user_boards)
+        if not benchmark.users:
+            raise SystemExit("No benchmark data found, run with --generate or benchmarks.data_generator first")
+
+        for name in args.scenarios:
+            await benchmark.run_scenario(name, args.warmup, args.concurrency)
+            results[name] = await benchmark.run_scenario(name, args.requests, args.concurrency)
+            logger.info(f"{name}: {results[name]}")
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="In-process load benchmark for the PinTag API")
+    parser.add_argument("--workdir", default="bench_data")
+    parser.add_argument("--generate", action="store_true", help="Regenerate synthetic data before the run")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--boards", type=int, default=10)
+    parser.add_argument("--items", type=int, default=200)
+    parser.add_argument("--file-sizes", default="16k,256k,2m")
+    parser.add_argument("--file-ratio", type=float, default=0.3)
+    parser.add_argument("--upload-size", default="256k")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--requests", type=int, default=500, help="Requests per scenario")
+    parser.add_argument("--warmup", type=int, default=20, help="Warm-up requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--output", default="bench_results/api.json")
+    parser.add_argument("--compare", help="Baseline report to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Allowed regression, 0.10 = 10%%")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.generate and Path(args.workdir).exists():
+        shutil.rmtree(args.workdir)
+    prepare_environment(args.workdir)
+
+    results = asyncio.run(run(args))
+    config = {key: value for key, value in vars(args).items() if key not in ("compare", "output")}
+    report = write_report(args.output, "api", config, results)
+    print_results(results)
+
+    if args.compare:
+        sys.exit(gate(args.compare, report, args.threshold))
+
+
+if __name__ == "__main__":
+    main()
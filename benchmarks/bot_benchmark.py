@@ -0,0 +1,163 @@
+import argparse
+import asyncio
+import logging
+import shutil
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+
+from benchmarks.common import summarize, write_report, print_results, gate
+from benchmarks.data_generator import prepare_environment
+from benchmarks.fake_telegram import FakeTelegramServer
+
+logger = logging.getLogger(__name__)
+
+BENCH_TOKEN = "123456:BENCHMARK"
+SCENARIOS = ["add_item", "boards", "view", "stats"]
+
+
+class SimulatedUser:
+    def __init__(self, server: FakeTelegramServer, user_id: int, latencies: dict, timeout: float):
+        self.server = server
+        self.user_id = user_id
+        self.latencies = latencies
+        self.timeout = timeout
+        self.titles = []
+
+
+    async def step(self, name: str, push, expected_replies: int = 1) -> list[dict]:
+        started_at = time.perf_counter()
+        push()
+        try:
+            replies = [await self.server.next_reply(self.user_id, self.timeout) for _ in range(expected_replies)]
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"user {self.user_id} got no reply to '{name}' within {self.timeout}s")
+        self.latencies[name].append(time.perf_counter() - started_at)
+        return replies
+
+
+    async def start(self):
+        await self.step("start", lambda: self.server.push_text(self.user_id, "/start"))
+
+
+    async def add_item(self):
+        title = f"bench photo {self.user_id} {len(self.titles)}"
+        await self.step("add_item.content", lambda: self.server.push_photo(self.user_id))
+        _, selection = await self.step("add_item.title", lambda: self.server.push_text(self.user_id, title),
+                                       expected_replies=2)
+
+        keyboard = selection["params"]["reply_markup"]["inline_keyboard"]
+        board_data = keyboard[0][0]["callback_data"]
+        await self.step("add_item.board",
+                        lambda: self.server.push_callback(self.user_id, selection["message"], board_data))
+        self.titles.append(title)
+
+
+    async def boards(self):
+        await self.step("boards", lambda: self.server.push_text(self.user_id, "/boards"))
+
+
+    async def view(self):
+        if self.titles:
+            await self.step("view", lambda: self.server.push_text(self.user_id, f"/view {self.titles[-1]}"))
+
+
+    async def stats(self):
+        await self.step("stats", lambda: self.server.push_text(self.user_id, "/stats"))
+
+
+    async def run(self, scenarios: list[str], rounds: int):
+        await self.start()
+        for _ in range(rounds):
+            for scenario in scenarios:
+                await getattr(self, scenario)()
+
+
+def handler_latencies() -> dict:
+    from utils.metrics import bot_handler_duration
+
+    results = {}
+    for (handler, outcome), (_, total, count) in bot_handler_duration.series.items():
+        results[f"handler.{handler}.{outcome}"] = {
+            "count": count,
+            "mean_ms": round(total / count * 1000, 3) if count else 0.0,
+        }
+    return results
+
+
+async def run(args) -> dict:
+    from bot_core import build_bot_application, start_polling_bot
+
+    server = FakeTelegramServer(file_size=args.file_size, latency=args.latency / 1000)
+    await server.start(port=args.port)
+
+    base = f"http://127.0.0.1:{args.port}"
+    application = build_bot_application(BENCH_TOKEN, f"{base}/bot", f"{base}/file/bot")
+    bot_task = asyncio.create_task(start_polling_bot(application))
+
+    latencies = defaultdict(list)
+    errors = 0
+    try:
+        while not (application.running and application.updater.running):
+            await asyncio.sleep(0.05)
+
+        users = [SimulatedUser(server, 10_000 + index, latencies, args.timeout) for index in range(args.users)]
+        started_at = time.perf_counter()
+        outcomes = await asyncio.gather(*(user.run(args.scenarios, args.rounds) for user in users),
+                                        return_exceptions=True)
+        elapsed = time.perf_counter() - started_at
+
+        for outcome in outcomes:
+            if isinstance(outcome, Exception):
+                errors += 1
+                logger.warning(f"Simulated user failed: {outcome!r}")
+    finally:
+        bot_task.cancel()
+        await asyncio.gather(bot_task, return_exceptions=True)
+        await server.stop()
+
+    updates = next(server.update_ids) - 1
+    results = {name: summarize(samples, elapsed) for name, samples in sorted(latencies.items())}
+    results["total"] = {
+        "updates": updates,
+        "elapsed_s": round(elapsed, 3),
+        "updates_per_s": round(updates / elapsed, 3) if elapsed else 0.0,
+        "failed_users": errors,
+    }
+    results.update(handler_latencies())
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end bot throughput against a fake Telegram Bot API")
+    parser.add_argument("--workdir", default="bench_data_bot")
+    parser.add_argument("--users", type=int, default=1000, help="Concurrently simulated Telegram users")
+    parser.add_argument("--rounds", type=int, default=1, help="Scenario rounds per user")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--file-size", type=int, default=256 * 1024, help="Size of downloaded media in bytes")
+    parser.add_argument("--latency", type=float, default=0.0, help="Simulated Bot API round trip in ms")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--timeout", type=float, default=120, help="Seconds to wait for a single bot reply")
+    parser.add_argument("--output", default="bench_results/bot.json")
+    parser.add_argument("--compare", help="Baseline report to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Allowed regression, 0.10 = 10%%")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    if Path(args.workdir).exists():
+        shutil.rmtree(args.workdir)
+    prepare_environment(args.workdir)
+
+    results = asyncio.run(run(args))
+    config = {key: value for key, value in vars(args).items() if key not in ("compare", "output")}
+    report = write_report(args.output, "bot", config, results)
+    print_results(results)
+
+    if args.compare:
+        sys.exit(gate(args.compare, report, args.threshold))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+import json
+import logging
+import math
+import platform
+import statistics
+from datetime import datetime, timezone
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+def percentile(samples: list[float], fraction: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(latencies: list[float], elapsed: float, errors: int = 0) -> dict:
+    return {
+        "count": len(latencies),
+        "errors": errors,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 3) if latencies else 0.0,
+        "throughput_per_s": round(len(latencies) / elapsed, 3) if elapsed else 0.0,
+    }
+
+
+def write_report(path: str, suite: str, config: dict, results: dict):
+    report = {
+        "suite": suite,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": config,
+        "results": results,
+    }
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    logger.info(f"Benchmark report written to {path}")
+    return report
+
+
+def load_report(path: str) -> dict:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def compare_reports(baseline: dict, current: dict, threshold: float,
+                    latency_keys=("p50_ms", "p95_ms", "p99_ms"),
+                    throughput_keys=("throughput_per_s", "updates_per_s")) -> list[str]:
+    regressions = []
+    for name, old in baseline["results"].items():
+        new = current["results"].get(name)
+        if new is None:
+            regressions.append(f"{name}: missing from current run")
+            continue
+
+        for key in latency_keys:
+            if key in old and old[key] and new.get(key, 0) > old[key] * (1 + threshold):
+                regressions.append(f"{name}.{key}: {old[key]} -> {new[key]} (+{new[key] / old[key] - 1:.1%})")
+
+        for key in throughput_keys:
+            if key in old and old[key] and new.get(key, 0) < old[key] * (1 - threshold):
+                regressions.append(f"{name}.{key}: {old[key]} -> {new[key]} ({new[key] / old[key] - 1:.1%})")
+
+    return regressions
+
+
+def print_results(results: dict):
+    for name, stats in results.items():
+        details = ", ".join(f"{key}={value}" for key, value in stats.items())
+        print(f"{name:<24} {details}")
+
+
+def gate(baseline_path: str, report: dict, threshold: float, **keys) -> int:
+    regressions = compare_reports(load_report(baseline_path), report, threshold, **keys)
+    if regressions:
+        print(f"Regressions beyond {threshold:.0%}:")
+        for regression in regressions:
+            print(f"  - {regression}")
+        return 1
+
+    print(f"No regressions beyond {threshold:.0%} against {baseline_path}")
+    return 0
@@ -0,0 +1,150 @@
+import argparse
+import logging
+import os
+import random
+import time
+from pathlib import Path
+
+from benchmarks.common import write_report, print_results
+from benchmarks.data_generator import WORDS, parse_sizes
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONFIGS = ["zlib:1", "zlib:6", "zlib:9", "zstd:1", "zstd:3", "zstd:9", "zstd:19"]
+
+
+def load_corpus(files_path: str, limit: int) -> dict[str, list[bytes]]:
+    from files.encryption_manager import encryption_manager
+
+    corpus: dict[str, list[bytes]] = {}
+    for path in sorted(Path(files_path).glob("*/*/*")):
+        content_type = path.parent.name.rstrip("s")
+        # Thumbnails and previews are JPEGs produced by us, they say nothing about what users upload.
+        if path.parts[-3] == "temp" or path.name.endswith((".thumb.jpg", ".preview.jpg")):
+            continue
+        if len(corpus.get(content_type, [])) >= limit:
+            continue
+        try:
+            corpus.setdefault(content_type, []).append(encryption_manager.decrypt_file(path.read_bytes()))
+        except Exception as e:
+            logger.warning(f"Skipping {path}: {e}")
+    return corpus
+
+
+def synthetic_corpus(count: int, size: int, seed: int) -> dict[str, list[bytes]]:
+    rng = random.Random(seed)
+
+    def text() -> bytes:
+        words = []
+        while sum(len(word) + 1 for word in words) < size // 2:
+            words.append(rng.choice(WORDS))
+        return " ".join(words).encode()[:size]
+
+    return {
+        "document": [text() for _ in range(count)],
+        "photo": [rng.randbytes(size) for _ in range(count)],
+    }
+
+
+def measure(samples: list[bytes], algorithm: str, level: int, repeat: int) -> dict:
+    from files.encryption_manager import compress, decompress
+
+    original = sum(len(sample) for sample in samples)
+    stored = 0
+    compress_seconds = decompress_seconds = 0.0
+    for sample in samples:
+        for _ in range(repeat):
+            started_at = time.perf_counter()
+            compressed, flags = compress(sample, algorithm, level)
+            compress_seconds += time.perf_counter() - started_at
+
+            started_at = time.perf_counter()
+            decompress(compressed, flags)
+            decompress_seconds += time.perf_counter() - started_at
+        stored += len(compressed)
+
+    megabytes = original * repeat / 1024 ** 2
+    return {
+        "files": len(samples),
+        "original_bytes": original,
+        "stored_bytes": stored,
+        "ratio": round(stored / original, 4) if original else 0.0,
+        "compress_mb_per_s": round(megabytes / compress_seconds, 1) if compress_seconds else 0.0,
+        "decompress_mb_per_s": round(megabytes / decompress_seconds, 1) if decompress_seconds else 0.0,
+    }
+
+
+def at_rest(corpus: dict[str, list[bytes]]) -> dict:
+    from files.encryption_manager import encryption_manager
+
+    results = {}
+    for content_type, samples in sorted(corpus.items()):
+        original = sum(len(sample) for sample in samples)
+        # What the files took before the header existed: a base64 Fernet token of the raw data.
+        legacy = sum(len(encryption_manager.fernet.encrypt(sample)) for sample in samples)
+
+        started_at = time.perf_counter()
+        stored = sum(len(encryption_manager.encrypt_file(sample, content_type)) for sample in samples)
+        elapsed = time.perf_counter() - started_at
+        results[f"{content_type}.at_rest"] = {
+            "files": len(samples),
+            "original_bytes": original,
+            "legacy_bytes": legacy,
+            "stored_bytes": stored,
+            "saved": round(1 - stored / legacy, 4) if legacy else 0.0,
+            "encrypt_mb_per_s": round(original / 1024 ** 2 / elapsed, 1) if elapsed else 0.0,
+        }
+    return results
+
+
+def run(corpus: dict[str, list[bytes]], configs: list[str], repeat: int) -> dict:
+    from files.encryption_manager import zstandard
+
+    results = at_rest(corpus)
+    for content_type, samples in sorted(corpus.items()):
+        for config in configs:
+            algorithm, level = config.split(":")
+            if algorithm == "zstd" and zstandard is None:
+                logger.warning(f"Skipping {config}, the 'zstandard' package is not installed")
+                continue
+            name = f"{content_type}.{config}"
+            results[name] = measure(samples, algorithm, int(level), repeat)
+            logger.info(f"{name}: {results[name]}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Size and CPU cost of compressing files before encryption")
+    parser.add_argument("--files-path", help="users_files directory to sample, e.g. a copy of production")
+    parser.add_argument("--key-path", default="encryption.key", help="Key that decrypts --files-path")
+    parser.add_argument("--limit", type=int, default=200, help="Files sampled per content type")
+    parser.add_argument("--synthetic", type=int, default=20,
+                        help="Generated files per content type when --files-path is not given")
+    parser.add_argument("--synthetic-size", default="256k")
+    parser.add_argument("--configs", nargs="+", default=DEFAULT_CONFIGS, help="algorithm:level pairs")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed passes over every file")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="bench_results/compression.json")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    # Synthetic runs encrypt with a throwaway key next to the report instead of the one in the working directory.
+    key_path = Path(args.key_path if args.files_path else Path(args.output).with_suffix(".key")).resolve()
+    key_path.parent.mkdir(parents=True, exist_ok=True)
+    os.environ["ENCRYPTION_KEY_PATH"] = str(key_path)
+
+    if args.files_path:
+        corpus = load_corpus(args.files_path, args.limit)
+    else:
+        corpus = synthetic_corpus(args.synthetic, parse_sizes(args.synthetic_size)[0], args.seed)
+    if not corpus:
+        raise SystemExit(f"No files found under {args.files_path}")
+
+    results = run(corpus, args.configs, args.repeat)
+    config = {key: value for key, value in vars(args).items() if key != "output"}
+    write_report(args.output, "compression", config, results)
+    print_results(results)
+
+
+if __name__ == "__main__":
+    main()
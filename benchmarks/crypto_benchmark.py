@@ -0,0 +1,187 @@
+import argparse
+import asyncio
+import logging
+import random
+import resource
+import statistics
+import sys
+import time
+import tracemalloc
+
+from benchmarks.common import summarize, write_report, print_results, gate
+from benchmarks.data_generator import WORDS, parse_sizes, prepare_environment
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SIZES = "1k,64k,1m,16m,128m,500m"
+FORMATS = ["fernet", "master", "data_key", "compressed"]
+# Large sizes are timed fewer times, so a full run stays within minutes.
+REPEAT_BUDGET = 256 * 1024 * 1024
+LOOP_TICK = 0.001
+GATED_LATENCY_KEYS = ("p50_ms", "p95_ms", "peak_memory_mb")
+GATED_THROUGHPUT_KEYS = ("mb_per_s",)
+
+
+def payload(size: int, compressible: bool, rng: random.Random) -> bytes:
+    if not compressible:
+        # randbytes overflows above 256 MB in one call.
+        chunk = 64 * 1024 * 1024
+        return b"".join(rng.randbytes(min(chunk, size - start)) for start in range(0, size, chunk))
+    # Text is generated for the first megabyte and repeated after that, word by word generation of
+    # hundreds of megabytes would take longer than the benchmark itself.
+    words = []
+    length = 0
+    while length < min(size, 1024 * 1024):
+        words.append(rng.choice(WORDS))
+        length += len(words[-1]) + 1
+    text = " ".join(words).encode()
+    return (text * (size // len(text) + 1))[:size]
+
+
+def operations(file_format: str, data: bytes, data_key) -> dict:
+    from files.encryption_manager import encryption_manager
+
+    if file_format == "fernet":
+        # The layout files had before the header existed: a base64 token of the master key.
+        encrypted = encryption_manager.fernet.encrypt(data)
+        return {
+            "encrypt": lambda: encryption_manager.fernet.encrypt(data),
+            "decrypt": lambda: encryption_manager.decrypt_file(encrypted),
+        }
+
+    content_type = "document" if file_format == "compressed" else "photo"
+    key = data_key if file_format == "data_key" else None
+    encrypted = encryption_manager.encrypt_file(data, content_type, "file.txt", key)
+    return {
+        "encrypt": lambda: encryption_manager.encrypt_file(data, content_type, "file.txt", key),
+        "decrypt": lambda: encryption_manager.decrypt_file(encrypted, key),
+    }
+
+
+async def watch_loop(lags: list[float], stop: asyncio.Event):
+    # How late a 1 ms timer fires while the operation runs in a worker thread, as the bot and the API
+    # run it: anything above zero is time other requests could not be served.
+    while not stop.is_set():
+        started_at = time.perf_counter()
+        await asyncio.sleep(LOOP_TICK)
+        lags.append(max(0.0, time.perf_counter() - started_at - LOOP_TICK))
+
+
+async def timed(operation, repeat: int) -> tuple[list[float], list[float], float]:
+    latencies = []
+    lags = []
+    stop = asyncio.Event()
+    watcher = asyncio.create_task(watch_loop(lags, stop))
+    started_at = time.perf_counter()
+    for _ in range(repeat):
+        operation_started_at = time.perf_counter()
+        await asyncio.to_thread(operation)
+        latencies.append(time.perf_counter() - operation_started_at)
+    elapsed = time.perf_counter() - started_at
+    stop.set()
+    await watcher
+    return latencies, lags, elapsed
+
+
+def peak_memory(operation) -> tuple[float, float]:
+    # tracemalloc slows allocations down, so memory is measured in a separate untimed call.
+    tracemalloc.start()
+    try:
+        operation()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    # ru_maxrss is the process high-water mark in KB, it shows what the largest size needs from the OS.
+    return peak / 1024 ** 2, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def result(size: int, latencies: list[float], lags: list[float], elapsed: float, memory: tuple[float, float]) -> dict:
+    stats = summarize(latencies, elapsed)
+    total = statistics.fmean(latencies) if latencies else 0.0
+    stats.update({
+        "size_bytes": size,
+        "mb_per_s": round(size / 1024 ** 2 / total, 1) if total else 0.0,
+        "peak_memory_mb": round(memory[0], 2),
+        "rss_max_mb": round(memory[1], 1),
+        "loop_max_lag_ms": round(max(lags, default=0.0) * 1000, 3),
+        "loop_lag_ms": round(sum(lags) * 1000, 3),
+    })
+    return stats
+
+
+async def measure(name: str, size: int, operation, repeat: int, results: dict):
+    latencies, lags, elapsed = await timed(operation, repeat)
+    results[name] = result(size, latencies, lags, elapsed, peak_memory(operation))
+    logger.info(f"{name}: {results[name]}")
+
+
+def size_label(size: int) -> str:
+    for unit, multiplier in (("m", 1024 ** 2), ("k", 1024)):
+        if size >= multiplier and size % multiplier == 0:
+            return f"{size // multiplier}{unit}"
+    return str(size)
+
+
+async def run(sizes: list[int], formats: list[str], repeat: int, seed: int) -> dict:
+    from cryptography.fernet import Fernet
+
+    from files.encryption_manager import encryption_manager, FileKey
+    from files.file_manager import file_manager
+
+    rng = random.Random(seed)
+    data_key = FileKey(Fernet.generate_key())
+    results = {}
+    for size in sizes:
+        label = size_label(size)
+        size_repeat = max(1, min(repeat, REPEAT_BUDGET // size))
+        for file_format in formats:
+            data = payload(size, file_format == "compressed", rng)
+            for operation_name, operation in operations(file_format, data, data_key).items():
+                await measure(f"{operation_name}.{file_format}.{label}", size, operation, size_repeat, results)
+            del data
+
+        # The storage half of the pipeline: what a stored blob costs on disk, independent of its format.
+        blob = encryption_manager.encrypt_file(payload(size, False, rng), "photo", "file.bin")
+        saved = []
+
+        def save():
+            saved.append(file_manager.save_file(blob, 0, "photos", "file.bin"))
+
+        await measure(f"save_file.{label}", len(blob), save, size_repeat, results)
+        await measure(f"get_file.{label}", len(blob), lambda: file_manager.get_file(saved[0]), size_repeat, results)
+        for path in saved:
+            file_manager.delete_file(path)
+        del blob
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Throughput, peak memory and event loop blocking of file encryption and storage"
+    )
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="Comma separated file sizes, e.g. 1k,1m,500m")
+    parser.add_argument("--formats", nargs="+", default=FORMATS, choices=FORMATS)
+    parser.add_argument("--repeat", type=int, default=5, help="Timed calls per size, fewer for large sizes")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workdir", default="bench_data/crypto", help="Throwaway key and users_files")
+    parser.add_argument("--output", default="bench_results/crypto.json")
+    parser.add_argument("--compare", help="Baseline report to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Allowed regression, 0.10 = 10%%")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    # The managers read their paths on import, so the run never touches the real key or files.
+    prepare_environment(args.workdir)
+
+    results = asyncio.run(run(parse_sizes(args.sizes), args.formats, args.repeat, args.seed))
+    config = {key: value for key, value in vars(args).items() if key not in ("compare", "output")}
+    report = write_report(args.output, "crypto", config, results)
+    print_results(results)
+
+    if args.compare:
+        sys.exit(gate(args.compare, report, args.threshold,
+                      latency_keys=GATED_LATENCY_KEYS, throughput_keys=GATED_THROUGHPUT_KEYS))
+
+
+if __name__ == "__main__":
+    main()
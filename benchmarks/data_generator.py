@@ -0,0 +1,130 @@
+import argparse
+import asyncio
+import logging
+import os
+import random
+import shutil
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+WORDS = [
+    "python", "рецепт", "статья", "отпуск", "музыка", "flutter", "договор", "фото", "видео", "заметка",
+    "sqlalchemy", "telegram", "книга", "скриншот", "счёт", "презентация", "доклад", "курс", "план", "идея",
+]
+BOARD_EMOJIS = ["📁", "🐍", "📚", "🎵", "🖼️", "🎬", "📝", "💼"]
+FILE_TYPES = {"photo": ".jpg", "document": ".pdf", "video": ".mp4"}
+
+
+def prepare_environment(workdir: str):
+    workdir = Path(workdir).resolve()
+    workdir.mkdir(parents=True, exist_ok=True)
+
+    os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{workdir / 'pintag_bench.db'}"
+    os.environ["USERS_FILES_PATH"] = str(workdir / "users_files")
+    os.environ["ENCRYPTION_KEY_PATH"] = str(workdir / "encryption.key")
+    os.environ["DATABASE_ECHO"] = "false"
+    for route_class in ("READ", "WRITE", "UPLOAD", "CLIENT"):
+        os.environ[f"RATE_LIMIT_{route_class}"] = "1000000000/1"
+    for bot_class in ("MESSAGE", "MEDIA"):
+        os.environ[f"BOT_RATE_LIMIT_{bot_class}"] = "1000000000/1"
+    for send_class in ("", "_PRIVATE_CHAT", "_GROUP_CHAT"):
+        os.environ[f"TELEGRAM_SEND_RATE{send_class}"] = "1000000000/1"
+    os.environ["UPLOAD_MAX_QUEUE"] = "1000000"
+    os.environ["UPLOAD_QUEUE_TIMEOUT"] = "600"
+    return workdir
+
+
+def parse_sizes(value: str) -> list[int]:
+    units = {"k": 1024, "m": 1024 ** 2, "g": 1024 ** 3}
+    sizes = []
+    for part in value.split(","):
+        part = part.strip().lower().rstrip("b")
+        multiplier = units.get(part[-1:], 1)
+        sizes.append(int(float(part.rstrip("kmg")) * multiplier))
+    return sizes
+
+
+def token_for(user_id: int) -> str:
+    return f"bench-token-{user_id}"
+
+
+async def generate(users: int, boards: int, items: int, file_sizes: list[int], file_ratio: float, seed: int):
+    from database.database import init_db, AsyncSessionLocal, User, Board, Item, UserConnection
+    from files.encryption_manager import encryption_manager
+    from files.file_manager import file_manager
+
+    rng = random.Random(seed)
+    await init_db()
+
+    created_files = 0
+    async with AsyncSessionLocal() as db:
+        for user_index in range(users):
+            user_id = 1_000_000 + user_index
+            db.add(User(id=user_id, username=f"bench_{user_index}", first_name="Bench"))
+            db.add(UserConnection(user_id=user_id, connect_id=token_for(user_id), client_name="benchmark",
+                                  status="accepted"))
+
+            user_boards = []
+            for board_index in range(boards):
+                board = Board(user_id=user_id, name=f"{rng.choice(WORDS)}-{board_index}",
+                              emoji=rng.choice(BOARD_EMOJIS))
+                db.add(board)
+                user_boards.append(board)
+            await db.flush()
+
+            for item_index in range(items):
+                board = rng.choice(user_boards)
+                title = f"{rng.choice(WORDS)} {rng.choice(WORDS)} {item_index}"
+
+                if rng.random() < file_ratio:
+                    content_type = rng.choice(list(FILE_TYPES))
+                    file_data = rng.randbytes(rng.choice(file_sizes))
+                    filename = f"{content_type}_{item_index}{FILE_TYPES[content_type]}"
+                    file_path = file_manager.save_file(
+                        encryption_manager.encrypt_file(file_data, content_type, filename),
+                        user_id,
+                        content_type + "s",
+                        filename,
+                    )
+                    created_files += 1
+                    db.add(Item(user_id=user_id, board_id=board.id, title=title, content_type=content_type,
+                                content_data=None, file_path=file_path,
+                                file_size=file_manager.get_file_size(file_path), encrypted=True))
+                else:
+                    db.add(Item(user_id=user_id, board_id=board.id, title=title, content_type="link",
+                                content_data=f"https://example.com/{rng.choice(WORDS)}/{item_index}",
+                                file_path=None, file_size=0, encrypted=False))
+
+            await db.commit()
+            logger.info(f"Generated user {user_index + 1}/{users}")
+
+    return {"users": users, "boards": users * boards, "items": users * items, "files": created_files}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fill a PinTag database and users_files with synthetic data")
+    parser.add_argument("--workdir", default="bench_data", help="Directory for the database, key and files")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--boards", type=int, default=10, help="Boards per user")
+    parser.add_argument("--items", type=int, default=200, help="Items per user")
+    parser.add_argument("--file-sizes", default="16k,256k,2m", help="Comma separated sizes, e.g. 16k,256k,2m")
+    parser.add_argument("--file-ratio", type=float, default=0.3, help="Share of items backed by a file")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--force", action="store_true", help="Remove an existing workdir first")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if Path(args.workdir).exists():
+        if not args.force:
+            parser.error(f"{args.workdir} already exists, pass --force to regenerate it")
+        shutil.rmtree(args.workdir)
+
+    prepare_environment(args.workdir)
+    summary = asyncio.run(generate(args.users, args.boards, args.items, parse_sizes(args.file_sizes),
+                                   args.file_ratio, args.seed))
+    print(summary)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+import asyncio
+import io
+import itertools
+import json
+import logging
+import time
+from collections import defaultdict
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "PinTag", "username": "PinTagBenchBot"}
+
+
+def sample_photo(file_size: int) -> bytes:
+    # A decodable photo keeps thumbnail rendering in the measured path, padding after EOI sets the size.
+    if Image is None:
+        return b"\xff\xd8" + b"\x00" * max(0, file_size - 2)
+    output = io.BytesIO()
+    Image.effect_noise((640, 480), 40).convert("RGB").save(output, "JPEG", quality=85)
+    photo = output.getvalue()
+    return photo + b"\x00" * max(0, file_size - len(photo))
+
+
+class FakeTelegramServer:
+    def __init__(self, file_size: int = 256 * 1024, latency: float = 0.0):
+        self.latency = latency
+        self.file_data = sample_photo(file_size)
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1)
+        self.pending_updates: list[dict] = []
+        self.updates_available = asyncio.Event()
+        self.replies: dict[int, asyncio.Queue] = defaultdict(asyncio.Queue)
+        self.calls: dict[str, int] = defaultdict(int)
+        self.app = self.build_app()
+        self.server = None
+        self.task = None
+
+
+    def build_app(self) -> FastAPI:
+        app = FastAPI(title="Fake Telegram Bot API")
+
+        @app.post("/bot{token}/{method}")
+        async def bot_method(token: str, method: str, request: Request):
+            params = await self.read_params(request)
+            self.calls[method] += 1
+            if self.latency and method != "getUpdates":
+                await asyncio.sleep(self.latency)
+            handler = getattr(self, f"method_{method.lower()}", None)
+            result = await handler(params) if handler else True
+            return JSONResponse({"ok": True, "result": result})
+
+        @app.get("/file/bot{token}/{file_path:path}")
+        async def download_file(token: str, file_path: str):
+            self.calls["downloadFile"] += 1
+            return Response(content=self.file_data, media_type="application/octet-stream")
+
+        return app
+
+
+    async def read_params(self, request: Request) -> dict:
+        if request.headers.get("content-type", "").startswith("application/json"):
+            return await request.json()
+
+        params = {}
+        for key, value in (await request.form()).items():
+            if isinstance(value, str):
+                try:
+                    params[key] = json.loads(value)
+                except ValueError:
+                    params[key] = value
+            else:
+                params[key] = value.filename
+        return params
+
+
+    def message(self, chat_id: int, **fields) -> dict:
+        return {
+            "message_id": next(self.message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+            **fields,
+        }
+
+
+    async def reply(self, method: str, params: dict, **fields) -> dict:
+        chat_id = int(params["chat_id"])
+        message = self.message(chat_id, **fields)
+        await self.replies[chat_id].put({"method": method, "params": params, "message": message,
+                                         "received_at": time.perf_counter()})
+        return message
+
+
+    async def method_getme(self, params: dict):
+        return BOT_USER
+
+
+    async def method_getupdates(self, params: dict):
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        timeout = float(params.get("timeout") or 0)
+
+        self.pending_updates = [update for update in self.pending_updates if update["update_id"] >= offset]
+        if not self.pending_updates and timeout:
+            self.updates_available.clear()
+            try:
+                await asyncio.wait_for(self.updates_available.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+        return self.pending_updates[:limit]
+
+
+    async def method_getfile(self, params: dict):
+        file_id = params["file_id"]
+        return {"file_id": file_id, "file_unique_id": file_id, "file_size": len(self.file_data),
+                "file_path": f"photos/{file_id}.jpg"}
+
+
+    async def method_sendmessage(self, params: dict):
+        return await self.reply("sendMessage", params, text=params.get("text", ""))
+
+
+    async def method_sendphoto(self, params: dict):
+        return await self.reply("sendPhoto", params, caption=params.get("caption"), photo=[
+            {"file_id": "sent-photo", "file_unique_id": "sent-photo", "width": 1, "height": 1}
+        ])
+
+
+    async def method_senddocument(self, params: dict):
+        return await self.reply("sendDocument", params, caption=params.get("caption"),
+                                document={"file_id": "sent-document", "file_unique_id": "sent-document"})
+
+
+    async def method_sendvideo(self, params: dict):
+        return await self.reply("sendVideo", params, caption=params.get("caption"), video={
+            "file_id": "sent-video", "file_unique_id": "sent-video", "width": 1, "height": 1, "duration": 1
+        })
+
+
+    async def method_editmessagetext(self, params: dict):
+        return await self.reply("editMessageText", params, text=params.get("text", ""))
+
+
+    def push_update(self, **payload) -> int:
+        update_id = next(self.update_ids)
+        self.pending_updates.append({"update_id": update_id, **payload})
+        self.updates_available.set()
+        return update_id
+
+
+    def user(self, user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"user{user_id}"}
+
+
+    def push_text(self, user_id: int, text: str) -> int:
+        entities = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}] \
+            if text.startswith("/") else []
+        return self.push_update(message={
+            "message_id": next(self.message_ids), "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"}, "from": self.user(user_id),
+            "text": text, "entities": entities,
+        })
+
+
+    def push_photo(self, user_id: int, media_group_id: str = None) -> int:
+        file_id = f"photo-{user_id}-{next(self.message_ids)}"
+        message = {
+            "message_id": next(self.message_ids), "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"}, "from": self.user(user_id),
+            "photo": [{"file_id": file_id, "file_unique_id": file_id, "width": 800, "height": 600,
+                       "file_size": len(self.file_data)}],
+        }
+        if media_group_id:
+            message["media_group_id"] = media_group_id
+        return self.push_update(message=message)
+
+
+    def push_callback(self, user_id: int, message: dict, data: str) -> int:
+        return self.push_update(callback_query={
+            "id": str(next(self.update_ids)), "from": self.user(user_id), "chat_instance": str(user_id),
+            "message": message, "data": data,
+        })
+
+
+    async def next_reply(self, user_id: int, timeout: float = 30) -> dict:
+        return await asyncio.wait_for(self.replies[user_id].get(), timeout=timeout)
+
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8081):
+        config = uvicorn.Config(self.app, host=host, port=port, log_level="warning", access_log=False)
+        self.server = uvicorn.Server(config)
+        self.task = asyncio.create_task(self.server.serve())
+        while not self.server.started:
+            await asyncio.sleep(0.01)
+        logger.info(f"Fake Telegram Bot API listening on http://{host}:{port}")
+
+
+    async def stop(self):
+        if self.server:
+            self.server.should_exit = True
+            await self.task
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Local stand-in for the Telegram Bot API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    uvicorn.run(FakeTelegramServer().app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
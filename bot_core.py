@@ -1,21 +1,50 @@
 import asyncio
+import logging
+import os
 
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ConversationHandler, CallbackQueryHandler
+from telegram import Update
+from telegram.ext import Application, CommandHandler, MessageHandler, filters, ConversationHandler, CallbackQueryHandler, \
+    InlineQueryHandler
 from database.database import init_db
+from database.instrumentation import tracked_handler
+from database.persistence import DatabasePersistence
+from utils.metrics import timed_handler
+from utils.update_processor import PerUserUpdateProcessor
+from utils.send_scheduler import SendScheduler
 from handler.auth_handler import handle_connection_approval, list_connections_command
 from handler.handlers import start_command, help_command, get_my_id_command
+from handler.throttle_handler import throttled_user, drop_throttled_update
+from handler.inline_handler import inline_search
 
 from handler.database_handler import (
     create_new_board_command, boards_command, cancel_add_item,
-    add_item_conservation, GET_TITLE, get_title, SELECT_BOARD, inline_board_selection,
+    add_item_conservation, collect_album_part, GET_TITLE, get_title, SELECT_BOARD, inline_board_selection,
     show_command, view_command, remove_command, move_command, stats_command,
-    inline_board_item, rename_board_command, inline_item_selection, remove_board_command
+    inline_board_item, rename_board_command, inline_item_selection, remove_board_command, inline_show_page
 )
 
+logger = logging.getLogger(__name__)
 
-def build_bot_application(token: str) -> Application:
+BOT_MAX_CONCURRENT_UPDATES = int(os.getenv("BOT_MAX_CONCURRENT_UPDATES", 64))
+BOT_MAX_PENDING_UPDATES = int(os.getenv("BOT_MAX_PENDING_UPDATES", 1024))
 
-    application = Application.builder().token(token).build()
+
+def build_bot_application(token: str, base_url: str = None, base_file_url: str = None,
+                          polling: bool = True) -> Application:
+
+    builder = Application.builder().token(token).concurrent_updates(
+        PerUserUpdateProcessor(BOT_MAX_CONCURRENT_UPDATES, BOT_MAX_PENDING_UPDATES)
+    ).rate_limiter(SendScheduler()).persistence(DatabasePersistence())
+    if base_url:
+        builder = builder.base_url(base_url)
+    if base_file_url:
+        builder = builder.base_file_url(base_file_url)
+    if not polling:
+        builder = builder.updater(None)
+    application = builder.build()
+
+    # --- Rate limiting ---
+    application.add_handler(MessageHandler(throttled_user, drop_throttled_update), group=-1)
 
     # --- Conversation handler ---
     application.add_handler(ConversationHandler(
@@ -29,12 +58,19 @@ def build_bot_application(token: str) -> Application:
             MessageHandler(filters.PHOTO | filters.ATTACHMENT | filters.VIDEO, add_item_conservation)
         ],
         states={
-            GET_TITLE: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_title)],
-            SELECT_BOARD: [CallbackQueryHandler(inline_board_selection)]
+            GET_TITLE: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, get_title),
+                MessageHandler(filters.PHOTO | filters.ATTACHMENT | filters.VIDEO, collect_album_part),
+            ],
+            SELECT_BOARD: [CallbackQueryHandler(
+                inline_board_selection, pattern="^(board:|boards_page:|create_new_board|cancel_add_item)"
+            )]
         },
         fallbacks=[CommandHandler("cancel", cancel_add_item)],
         per_message=False,
         per_chat=False,
+        name="add_item",
+        persistent=True,
     ))
 
     # --- Command Handlers ---
@@ -67,11 +103,33 @@ def build_bot_application(token: str) -> Application:
         inline_board_item,
         pattern="^remove_item:"
     ))
+    application.add_handler(CallbackQueryHandler(inline_show_page, pattern="^show:"))
     application.add_handler(CallbackQueryHandler(handle_connection_approval, pattern="^auth_"))
 
+    # --- Inline Query Handlers ---
+    application.add_handler(InlineQueryHandler(inline_search))
+
+    instrument_handlers(application)
+
     return application
 
 
+def instrument_handlers(application: Application):
+    def instrument(handler):
+        if isinstance(handler, ConversationHandler):
+            for nested in handler.entry_points + handler.fallbacks:
+                instrument(nested)
+            for state_handlers in handler.states.values():
+                for nested in state_handlers:
+                    instrument(nested)
+        else:
+            handler.callback = timed_handler(tracked_handler(handler.callback))
+
+    for group_handlers in application.handlers.values():
+        for handler in group_handlers:
+            instrument(handler)
+
+
 async def start_polling_bot(application):
     try:
         await init_db()
@@ -88,4 +146,23 @@ async def start_polling_bot(application):
     finally:
         await application.updater.stop()
         await application.stop()
-        await application.shutdown()
\ No newline at end of file
+        await application.shutdown()
+
+async def start_webhook_bot(application, webhook_url: str, secret_token: str, max_connections: int = 40):
+    await init_db()
+    await application.initialize()
+    await application.start()
+    await application.bot.set_webhook(
+        url=webhook_url,
+        secret_token=secret_token,
+        allowed_updates=Update.ALL_TYPES,
+        max_connections=max_connections,
+    )
+    logger.info(f"Webhook set to {webhook_url}")
+
+
+async def stop_webhook_bot(application):
+    try:
+        await application.stop()
+    finally:
+        await application.shutdown()
@@ -1,14 +1,25 @@
 import datetime
 import logging
+import os
 
-from sqlalchemy import Integer, String, DateTime, Text, Boolean, BigInteger
+from dotenv import load_dotenv
+from sqlalchemy import Integer, String, DateTime, Text, Boolean, BigInteger, Index, event, table, column, update, \
+    inspect
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.orm import declarative_base, relationship
 from sqlalchemy.sql.schema import Column, ForeignKey
 
+from database.instrumentation import attach_query_instrumentation
+from utils.cache import boards_cache
+from utils.user_cache import keyboard_cache
+
 logger = logging.getLogger(__name__)
 
-DATABASE_URL = "sqlite+aiosqlite:///pintag_data.db"
+load_dotenv()
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///pintag_data.db")
+DATABASE_ECHO = os.getenv("DATABASE_ECHO", "true").lower() in ("1", "true", "yes")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", 30000))
 
 Base = declarative_base()
 
@@ -40,6 +51,10 @@ class Board(Base):
     user = relationship("User", back_populates="boards")
     items = relationship("Item", back_populates="board", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        Index("ix_boards_user_name", "user_id", "name", "id"),
+    )
+
     def __repr__(self):
         return f"<Board(name='{self.name}', user_id={self.user_id})>"
 
@@ -56,11 +71,19 @@ class Item(Base):
     file_path = Column(String(500))
     file_size = Column(Integer)
     encrypted = Column(Boolean, default=False)
-    created_at = Column(DateTime, default=datetime.datetime.now(datetime.timezone.utc))
+    # Whether the file is on the owner's data key, None for items stored before this column existed.
+    data_key = Column(Boolean, nullable=True)
+    content_hash = Column(String(64), nullable=True)
+    created_at = Column(DateTime, default=lambda: datetime.datetime.now(datetime.timezone.utc))
 
     user = relationship("User", back_populates="items")
     board = relationship("Board", back_populates="items")
 
+    __table_args__ = (
+        Index("ix_items_user_board_title", "user_id", "board_id", "title", "id"),
+        Index("ix_items_user_file_path", "user_id", "file_path"),
+    )
+
     def __repr__(self):
         return f"<Item(title='{self.title}', type='{self.content_type}')>"
 
@@ -78,12 +101,105 @@ class UserConnection(Base):
 
     user = relationship("User", back_populates="connections")
 
-engine = create_async_engine(DATABASE_URL, echo=True)
+
+class BotState(Base):
+    __tablename__ = 'bot_state'
+
+    namespace = Column(String(100), primary_key=True)
+    key = Column(String(100), primary_key=True)
+    data = Column(Text, nullable=False)
+    updated_at = Column(DateTime, default=lambda: datetime.datetime.now(datetime.timezone.utc))
+
+class DataVersion(Base):
+    __tablename__ = 'data_versions'
+
+    user_id = Column(BigInteger, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+
+class UserKey(Base):
+    __tablename__ = 'user_keys'
+
+    # The user's file data key, encrypted with master key master_key_id. Deleting the row makes every
+    # file of the user unreadable without touching the files.
+    user_id = Column(BigInteger, primary_key=True)
+    master_key_id = Column(Integer, nullable=False)
+    wrapped_key = Column(Text, nullable=False)
+    created_at = Column(DateTime, default=lambda: datetime.datetime.now(datetime.timezone.utc))
+
+engine = create_async_engine(DATABASE_URL, echo=DATABASE_ECHO)
+attach_query_instrumentation(engine)
+
+
+@event.listens_for(engine.sync_engine, "connect")
+def configure_sqlite_connection(dbapi_connection, connection_record):
+    if engine.dialect.name != "sqlite":
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.close()
+
 AsyncSessionLocal = async_sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+items_fts = table("items_fts", column("rowid"), column("rank"))
+
+SEARCH_INDEX_DDL = [
+    "CREATE VIRTUAL TABLE items_fts USING fts5(title, content='items', content_rowid='id')",
+    "CREATE TRIGGER IF NOT EXISTS items_fts_insert AFTER INSERT ON items BEGIN "
+    "INSERT INTO items_fts(rowid, title) VALUES (new.id, new.title); END",
+    "CREATE TRIGGER IF NOT EXISTS items_fts_delete AFTER DELETE ON items BEGIN "
+    "INSERT INTO items_fts(items_fts, rowid, title) VALUES ('delete', old.id, old.title); END",
+    "CREATE TRIGGER IF NOT EXISTS items_fts_update AFTER UPDATE OF title ON items BEGIN "
+    "INSERT INTO items_fts(items_fts, rowid, title) VALUES ('delete', old.id, old.title); "
+    "INSERT INTO items_fts(rowid, title) VALUES (new.id, new.title); END",
+    "INSERT INTO items_fts(items_fts) VALUES ('rebuild')",
+]
+
+
+def create_search_index(connection):
+    if connection.dialect.name != "sqlite":
+        return
+    exists = connection.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'items_fts'"
+    ).first()
+    if exists:
+        return
+
+    try:
+        for statement in SEARCH_INDEX_DDL:
+            connection.exec_driver_sql(statement)
+        logger.info("Created full-text search index for item titles")
+    except OperationalError as e:
+        logger.warning(f"Full-text search is unavailable, falling back to LIKE: {e}")
+
+
+def add_missing_columns(connection):
+    # create_all skips tables that already exist, so nullable columns added later are created here.
+    inspector = inspect(connection)
+    for table in Base.metadata.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing and column.nullable:
+                column_type = column.type.compile(dialect=connection.dialect)
+                connection.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}")
+                logger.info(f"Added column {table.name}.{column.name}")
+
+
+def create_missing_indexes(connection):
+    # create_all skips tables that already exist, so indexes added later are created here.
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+
 async def init_db():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(add_missing_columns)
+        await conn.run_sync(create_missing_indexes)
+        await conn.run_sync(create_search_index)
 
 async def get_db():
     async with AsyncSessionLocal() as session:
@@ -93,6 +209,15 @@ async def get_db():
             await session.close()
 
 
+async def bump_data_version(db: AsyncSession, user_id: int):
+    # Runs inside the caller's transaction, so the version changes exactly when the data does.
+    result = await db.execute(
+        update(DataVersion).where(DataVersion.user_id == user_id).values(version=DataVersion.version + 1)
+    )
+    if result.rowcount == 0:
+        db.add(DataVersion(user_id=user_id, version=1))
+
+
 async def create_default_board(user_id: int, db: AsyncSession):
     default_board = Board(
         user_id=user_id,
@@ -100,6 +225,9 @@ async def create_default_board(user_id: int, db: AsyncSession):
         emoji="📥"
     )
     db.add(default_board)
+    await bump_data_version(db, user_id)
     await db.commit()
+    keyboard_cache.invalidate(user_id)
+    await boards_cache.invalidate(user_id)
     await db.refresh(default_board)
     return default_board
\ No newline at end of file
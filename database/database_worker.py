@@ -1,16 +1,30 @@
 import datetime
 import logging
+import re
 import secrets
 
-from sqlalchemy import func, select, update
-from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy import func, select, update, delete, and_, or_, text
+from sqlalchemy.exc import SQLAlchemyError, DBAPIError, IntegrityError
 
-from database.database import get_db, Item, Board, UserConnection
+from database.database import get_db, User, Item, Board, UserConnection, DataVersion, BotState, UserKey, items_fts, \
+    bump_data_version
+from database.persistence import USER_DATA
 from utils.item_searcher import find_item_by_id, find_item_by_title
+from utils.cache import cached, boards_cache, items_cache
+from utils.user_cache import keyboard_cache, search_cache
+from utils.metrics import timed_query
 
 logger = logging.getLogger()
 
+fts_search_available = True
+# Only these mean the index is missing for good, anything else (a busy database, a bad MATCH) is per query.
+FTS_MISSING_ERRORS = ("no such module: fts5", "no such table: items_fts")
 
+# Progress of resumable maintenance jobs, kept next to the bot state.
+JOBS_NAMESPACE = "jobs"
+
+
+@timed_query
 async def get_all_items_by_keyword(user_id: int, keyword: str):
     async for db in get_db():
         try:
@@ -37,6 +51,58 @@ async def get_all_items_by_keyword(user_id: int, keyword: str):
             raise sqlex
 
 
+def title_match_expression(query: str) -> str | None:
+    tokens = re.findall(r"\w+", query.lower())
+    return " ".join(f'"{token}"*' for token in tokens) or None
+
+
+def title_matches(title: str, tokens: list[str]) -> bool:
+    words = re.findall(r"\w+", title.lower())
+    return all(any(word.startswith(token) for word in words) for token in tokens)
+
+
+@timed_query
+async def search_items_by_title(user_id: int, query: str, limit: int):
+    global fts_search_available
+    async for db in get_db():
+        try:
+            match = title_match_expression(query)
+            if match is None:
+                return []
+
+            if fts_search_available:
+                try:
+                    result = await db.execute(
+                        select(Item)
+                        .join(items_fts, items_fts.c.rowid == Item.id)
+                        .filter(Item.user_id == user_id, text("items_fts MATCH :match").bindparams(match=match))
+                        .order_by(items_fts.c.rank, Item.id)
+                        .limit(limit)
+                    )
+                    return result.scalars().all()
+                except DBAPIError as e:
+                    if any(error in str(e.orig) for error in FTS_MISSING_ERRORS):
+                        logger.warning(f"Full-text search is not available, using LIKE from now on: {e}")
+                        fts_search_available = False
+                    else:
+                        logger.warning(f"Full-text search failed, falling back to LIKE: {e}")
+                    await db.rollback()
+
+            # LIKE only narrows the rows down, the result follows the FTS rule: every token starts a word.
+            # SQLite folds the case of ASCII letters only, other tokens are left to title_matches.
+            tokens = re.findall(r"\w+", query.lower())
+            result = await db.execute(
+                select(Item).filter(
+                    Item.user_id == user_id,
+                    *(func.lower(Item.title).like(f"%{token}%") for token in tokens if token.isascii())
+                ).order_by(Item.title, Item.id)
+            )
+            return [item for item in result.scalars() if title_matches(item.title, tokens)][:limit]
+        except SQLAlchemyError as sqlex:
+            raise sqlex
+
+
+@timed_query
 async def get_item_by_title(user_id: int, item_title: str):
     async for db in get_db():
         try:
@@ -44,6 +110,139 @@ async def get_item_by_title(user_id: int, item_title: str):
         except SQLAlchemyError as sqlex:
             raise sqlex
 
+@timed_query
+async def get_data_version(user_id: int) -> int:
+    async for db in get_db():
+        try:
+            result = await db.execute(select(DataVersion.version).filter(DataVersion.user_id == user_id))
+            return result.scalar() or 0
+        except SQLAlchemyError as sqlex:
+            raise sqlex
+
+
+@cached(items_cache, lambda file_path: f"file:{file_path}", Item)
+@timed_query
+async def get_item_by_file_path(user_id: int, file_path: str):
+    async for db in get_db():
+        try:
+            result = await db.execute(
+                select(Item).filter(Item.user_id == user_id, Item.file_path == file_path).order_by(Item.id.desc())
+            )
+            return result.scalars().first()
+        except SQLAlchemyError as sqlex:
+            raise sqlex
+
+
+@timed_query
+async def get_file_items_after(after_id: int, limit: int):
+    async for db in get_db():
+        try:
+            result = await db.execute(
+                select(Item.id, Item.user_id, Item.content_type, Item.file_path, Item.encrypted)
+                .filter(Item.id > after_id, Item.file_path.isnot(None))
+                .order_by(Item.id)
+                .limit(limit)
+            )
+            return result.all()
+        except SQLAlchemyError as sqlex:
+            raise sqlex
+
+
+@timed_query
+async def file_path_in_use(user_id: int, file_path: str) -> bool:
+    async for db in get_db():
+        try:
+            result = await db.execute(
+                select(Item.id).filter(Item.user_id == user_id, Item.file_path == file_path).limit(1)
+            )
+            return result.scalar() is not None
+        except SQLAlchemyError as sqlex:
+            raise sqlex
+
+
+@timed_query
+async def get_job_checkpoint(name: str) -> str | None:
+    async for db in get_db():
+        try:
+            result = await db.execute(
+                select(BotState.data).filter(BotState.namespace == JOBS_NAMESPACE, BotState.key == name)
+            )
+            return result.scalar()
+        except SQLAlchemyError as sqlex:
+            raise sqlex
+
+
+@timed_query
+async def save_job_checkpoint(name: str, data: str | None):
+    async for db in get_db():
+        try:
+            await db.execute(delete(BotState).where(BotState.namespace == JOBS_NAMESPACE, BotState.key == name))
+            if data is not None:
+                db.add(BotState(namespace=JOBS_NAMESPACE, key=name, data=data,
+                                updated_at=datetime.datetime.now(datetime.timezone.utc)))
+            await db.commit()
+        except SQLAlchemyError as sqlex:
+            await db.rollback()
+            raise sqlex
+
+
+@timed_query
+async def set_item_file_paths(file_paths: dict[int, tuple[int, str]]):
+    user_ids = {user_id for user_id, _ in file_paths.values()}
+    async for db in get_db():
+        try:
+            await db.execute(
+                update(Item),
+                [{"id": item_id, "file_path": file_path} for item_id, (_, file_path) in file_paths.items()]
+            )
+            for user_id in user_ids:
+                await bump_data_version(db, user_id)
+            await db.commit()
+            for user_id in user_ids:
+                search_cache.invalidate(user_id)
+                await items_cache.invalidate(user_id)
+        except SQLAlchemyError as sqlex:
+            await db.rollback()
+            raise sqlex
+
+
+@timed_query
+async def mark_data_key_files(file_paths: dict[int, list[str]]):
+    # Maps user id to files the re-encryption job moved to that user's data key.
+    async for db in get_db():
+        try:
+            for user_id, paths in file_paths.items():
+                await db.execute(
+                    update(Item).where(Item.user_id == user_id, Item.file_path.in_(paths)).values(data_key=True)
+                )
+            await db.commit()
+            # Clients never see the flag, so the version stays, only the cached rows go.
+            for user_id in file_paths:
+                await items_cache.invalidate(user_id)
+        except SQLAlchemyError as sqlex:
+            await db.rollback()
+            raise sqlex
+
+
+@timed_query
+async def set_item_content_hash(user_id: int, item_id: int, content_hash: str):
+    async for db in get_db():
+        try:
+            await db.execute(
+                update(Item).filter(Item.id == item_id, Item.user_id == user_id).values(content_hash=content_hash)
+            )
+            # The list ETag is built from the version, clients must see the hash change too.
+            await bump_data_version(db, user_id)
+            await db.commit()
+            search_cache.invalidate(user_id)
+            await items_cache.invalidate(user_id)
+        except SQLAlchemyError as sqlex:
+            await db.rollback()
+            raise sqlex
+
+
+@cached(items_cache, lambda item_id: f"id:{item_id}", Item)
+@timed_query
 async def get_item_by_id(user_id: int, item_id: int):
     async for db in get_db():
         try:
@@ -52,6 +251,8 @@ async def get_item_by_id(user_id: int, item_id: int):
             raise sqlex
 
 
+@cached(boards_cache, lambda: "all", Board)
+@timed_query
 async def get_all_user_boards(user_id: int):
     async for db in get_db():
         try:
@@ -63,6 +264,45 @@ async def get_all_user_boards(user_id: int):
             raise sqlex
 
 
+def keyset_page_query(query, sort_column, id_column, after_id: int = None, before_id: int = None):
+    cursor_id = after_id if after_id is not None else before_id
+    if cursor_id is None:
+        return query.order_by(sort_column, id_column)
+
+    cursor_value = select(sort_column).filter(id_column == cursor_id).scalar_subquery()
+    if after_id is not None:
+        return query.filter(or_(
+            sort_column > cursor_value, and_(sort_column == cursor_value, id_column > cursor_id)
+        )).order_by(sort_column, id_column)
+
+    return query.filter(or_(
+        sort_column < cursor_value, and_(sort_column == cursor_value, id_column < cursor_id)
+    )).order_by(sort_column.desc(), id_column.desc())
+
+
+async def fetch_page(db, query, limit: int, backwards: bool):
+    result = await db.execute(query.limit(limit + 1))
+    rows = list(result.scalars().all())
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if backwards:
+        rows.reverse()
+    return rows, has_more
+
+
+@timed_query
+async def get_user_boards_page(user_id: int, limit: int, after_id: int = None, before_id: int = None):
+    async for db in get_db():
+        try:
+            query = keyset_page_query(
+                select(Board).filter(Board.user_id == user_id), Board.name, Board.id, after_id, before_id
+            )
+            return await fetch_page(db, query, limit, before_id is not None)
+        except SQLAlchemyError as sqlex:
+            raise sqlex
+
+
+@timed_query
 async def get_all_user_items(user_id: int):
     async for db in get_db():
         try:
@@ -72,6 +312,7 @@ async def get_all_user_items(user_id: int):
             raise sqlex
 
 
+@timed_query
 async def get_all_user_board_count(user_id: int) -> int:
     async for db in get_db():
         try:
@@ -83,6 +324,7 @@ async def get_all_user_board_count(user_id: int) -> int:
             raise sqlex
 
 
+@timed_query
 async def get_all_user_item_count(user_id: int):
     async for db in get_db():
         try:
@@ -94,6 +336,7 @@ async def get_all_user_item_count(user_id: int):
             raise sqlex
 
 
+@timed_query
 async def get_board_item_count(user_id: int, board_id: int) -> int:
     async for db in get_db():
         try:
@@ -108,6 +351,20 @@ async def get_board_item_count(user_id: int, board_id: int) -> int:
             raise sqlex
 
 
+@timed_query
+async def get_board_item_counts(user_id: int) -> dict[int, int]:
+    async for db in get_db():
+        try:
+            result = await db.execute(
+                select(Item.board_id, func.count(Item.id)).filter(Item.user_id == user_id).group_by(Item.board_id)
+            )
+            return dict(result.all())
+        except SQLAlchemyError as sqlex:
+            raise sqlex
+
+
+@cached(boards_cache, lambda board_name: f"name:{board_name}", Board)
+@timed_query
 async def get_board_by_name(user_id: int, board_name: str):
     async for db in get_db():
         try:
@@ -122,6 +379,8 @@ async def get_board_by_name(user_id: int, board_name: str):
             raise sqlex
 
 
+@cached(boards_cache, lambda board_id: f"id:{board_id}", Board)
+@timed_query
 async def get_board_by_id(user_id: int, board_id: int):
     async for db in get_db():
         try:
@@ -136,6 +395,7 @@ async def get_board_by_id(user_id: int, board_id: int):
             raise sqlex
 
 
+@timed_query
 async def update_board_name(user_id: int, board_id: int, new_name: str, new_emoji: str = None):
     async for db in get_db():
         try:
@@ -155,7 +415,12 @@ async def update_board_name(user_id: int, board_id: int, new_name: str, new_emoj
             board.name = new_name
             board.emoji = final_emoji
 
+            await bump_data_version(db, user_id)
             await db.commit()
+            keyboard_cache.invalidate(user_id)
+            search_cache.invalidate(user_id)
+            await boards_cache.invalidate(user_id)
+            await items_cache.invalidate(user_id)
 
             return (old_name, old_emoji, new_name, final_emoji)
         except SQLAlchemyError as sqlex:
@@ -163,6 +428,7 @@ async def update_board_name(user_id: int, board_id: int, new_name: str, new_emoj
             raise sqlex
 
 
+@timed_query
 async def create_new_board(user_id: int, board_name: str, board_emoji: str):
     async for db in get_db():
         try:
@@ -172,7 +438,10 @@ async def create_new_board(user_id: int, board_name: str, board_emoji: str):
                 user_id=user_id,
             )
             db.add(new_board)
+            await bump_data_version(db, user_id)
             await db.commit()
+            keyboard_cache.invalidate(user_id)
+            await boards_cache.invalidate(user_id)
             await db.refresh(new_board)
             return new_board
         except SQLAlchemyError as sqlex:
@@ -180,6 +449,7 @@ async def create_new_board(user_id: int, board_name: str, board_emoji: str):
             raise sqlex
 
 
+@timed_query
 async def remove_board_by_id(user_id: int, board_id: int):
     async for db in get_db():
         try:
@@ -192,7 +462,12 @@ async def remove_board_by_id(user_id: int, board_id: int):
                 raise ValueError("Board not found")
 
             await db.delete(board)
+            await bump_data_version(db, user_id)
             await db.commit()
+            keyboard_cache.invalidate(user_id)
+            search_cache.invalidate(user_id)
+            await boards_cache.invalidate(user_id)
+            await items_cache.invalidate(user_id)
             return True
         except SQLAlchemyError as sqlex:
             await db.rollback()
@@ -200,6 +475,7 @@ async def remove_board_by_id(user_id: int, board_id: int):
 
 
 
+@timed_query
 async def get_all_items_by_board_id(user_id: int, board_id: int):
     async for db in get_db():
         try:
@@ -214,8 +490,23 @@ async def get_all_items_by_board_id(user_id: int, board_id: int):
             raise sqlex
 
 
+@timed_query
+async def get_board_items_page(user_id: int, board_id: int, limit: int, after_id: int = None,
+                               before_id: int = None):
+    async for db in get_db():
+        try:
+            query = keyset_page_query(
+                select(Item).filter(Item.user_id == user_id, Item.board_id == board_id),
+                Item.title, Item.id, after_id, before_id
+            )
+            return await fetch_page(db, query, limit, before_id is not None)
+        except SQLAlchemyError as sqlex:
+            raise sqlex
+
+
+@timed_query
 async def create_new_item(user_id: int, board_id: int, title: str, content_type: str, content_data: str,
-    file_path: str, file_size: int, encrypted: bool):
+    file_path: str, file_size: int, encrypted: bool, content_hash: str = None, data_key: bool = False):
     async for db in get_db():
         try:
             new_item = Item(
@@ -227,9 +518,14 @@ async def create_new_item(user_id: int, board_id: int, title: str, content_type:
                 file_path=file_path,
                 file_size=file_size,
                 encrypted=encrypted,
+                content_hash=content_hash,
+                data_key=data_key,
             )
             db.add(new_item)
+            await bump_data_version(db, user_id)
             await db.commit()
+            search_cache.invalidate(user_id)
+            await items_cache.invalidate(user_id)
             await db.refresh(new_item)
             return new_item
         except SQLAlchemyError as sqlex:
@@ -237,6 +533,23 @@ async def create_new_item(user_id: int, board_id: int, title: str, content_type:
             raise sqlex
 
 
+@timed_query
+async def create_new_items(user_id: int, board_id: int, items: list[dict]):
+    async for db in get_db():
+        try:
+            new_items = [Item(user_id=user_id, board_id=board_id, **item) for item in items]
+            db.add_all(new_items)
+            await bump_data_version(db, user_id)
+            await db.commit()
+            search_cache.invalidate(user_id)
+            await items_cache.invalidate(user_id)
+            return new_items
+        except SQLAlchemyError as sqlex:
+            await db.rollback()
+            raise sqlex
+
+
+@timed_query
 async def remove_item_by_id(user_id: int, item_id: int):
     async for db in get_db():
         try:
@@ -249,13 +562,17 @@ async def remove_item_by_id(user_id: int, item_id: int):
                 raise ValueError("Item not found")
 
             await db.delete(item)
+            await bump_data_version(db, user_id)
             await db.commit()
+            search_cache.invalidate(user_id)
+            await items_cache.invalidate(user_id)
             return True
         except SQLAlchemyError as sqlex:
             await db.rollback()
             raise sqlex
 
 
+@timed_query
 async def move_item(user_id: int, item_id: int, new_board_id: int):
     async for db in get_db():
         try:
@@ -271,13 +588,17 @@ async def move_item(user_id: int, item_id: int, new_board_id: int):
                 raise ValueError("Item not found")
 
             item.board_id = new_board_id
+            await bump_data_version(db, user_id)
             await db.commit()
+            search_cache.invalidate(user_id)
+            await items_cache.invalidate(user_id)
 
         except SQLAlchemyError as sqlex:
             await db.rollback()
             raise sqlex
 
 
+@timed_query
 async def get_item_stats(user_id: int):
     async for db in get_db():
         try:
@@ -291,6 +612,7 @@ async def get_item_stats(user_id: int):
             raise sqlex
 
 
+@timed_query
 async def create_user_connection(user_id: int, client_name: str):
     async for db in get_db():
         try:
@@ -313,6 +635,7 @@ async def create_user_connection(user_id: int, client_name: str):
             raise sqlex
 
 
+@timed_query
 async def get_connection_by_id(connection_id: str):
     async for db in get_db():
         try:
@@ -330,6 +653,7 @@ async def get_connection_by_id(connection_id: str):
             raise sqlex
 
 
+@timed_query
 async def update_connection_status(connect_id: str, status: str):
     async for db in get_db():
         try:
@@ -354,6 +678,7 @@ async def update_connection_status(connect_id: str, status: str):
             raise sqlex
 
 
+@timed_query
 async def get_user_connections(user_id: int):
     async for db in get_db():
         try:
@@ -364,4 +689,115 @@ async def get_user_connections(user_id: int):
             )
             return result.scalars().all()
         except SQLAlchemyError as sqlex:
-            raise sqlex
\ No newline at end of file
+            raise sqlex
+
+@timed_query
+async def get_user_key(user_id: int):
+    async for db in get_db():
+        try:
+            result = await db.execute(
+                select(UserKey.master_key_id, UserKey.wrapped_key).filter(UserKey.user_id == user_id)
+            )
+            return result.first()
+        except SQLAlchemyError as sqlex:
+            raise sqlex
+
+
+@timed_query
+async def create_user_key(user_id: int, master_key_id: int, wrapped_key: str):
+    async for db in get_db():
+        try:
+            db.add(UserKey(user_id=user_id, master_key_id=master_key_id, wrapped_key=wrapped_key))
+            await db.commit()
+            return master_key_id, wrapped_key
+        except IntegrityError:
+            # Another process created the key first, every process must use that one.
+            await db.rollback()
+            result = await db.execute(
+                select(UserKey.master_key_id, UserKey.wrapped_key).filter(UserKey.user_id == user_id)
+            )
+            return result.first()
+        except SQLAlchemyError as sqlex:
+            await db.rollback()
+            raise sqlex
+
+
+@timed_query
+async def get_user_keys_after(after_user_id: int, limit: int):
+    async for db in get_db():
+        try:
+            result = await db.execute(
+                select(UserKey.user_id, UserKey.master_key_id, UserKey.wrapped_key)
+                .filter(UserKey.user_id > after_user_id)
+                .order_by(UserKey.user_id)
+                .limit(limit)
+            )
+            return result.all()
+        except SQLAlchemyError as sqlex:
+            raise sqlex
+
+
+@timed_query
+async def rewrap_user_keys(wrapped_keys: dict[int, tuple[int, int, str]]):
+    # Maps user id to (expected master key id, new master key id, new wrapped key), a key that was shredded
+    # or rewrapped by someone else in the meantime is left alone.
+    async for db in get_db():
+        try:
+            for user_id, (old_key_id, key_id, wrapped_key) in wrapped_keys.items():
+                await db.execute(
+                    update(UserKey)
+                    .filter(UserKey.user_id == user_id, UserKey.master_key_id == old_key_id)
+                    .values(master_key_id=key_id, wrapped_key=wrapped_key)
+                )
+            await db.commit()
+        except SQLAlchemyError as sqlex:
+            await db.rollback()
+            raise sqlex
+
+
+@timed_query
+@timed_query
+async def delete_users(user_ids: list[int]) -> list[str]:
+    # Plain bulk deletes: files on the data keys are unreadable once the keys are gone. Returns the files
+    # that are not, the caller deletes them after the commit, see UserKeyCache.delete_users.
+    async for db in get_db():
+        sqlite = db.bind.dialect.name == "sqlite"
+        try:
+            result = await db.execute(
+                select(Item.file_path)
+                .filter(Item.user_id.in_(user_ids), Item.file_path.isnot(None), Item.data_key.isnot(True))
+                .distinct()
+            )
+            file_paths = list(result.scalars())
+            if sqlite:
+                # Zeroes the deleted rows in their pages instead of only unlinking them, the checkpoint
+                # below then moves those pages out of the WAL. Copies in backups are out of reach.
+                await db.execute(text("PRAGMA secure_delete = ON"))
+            await db.execute(delete(UserKey).where(UserKey.user_id.in_(user_ids)))
+            await db.execute(delete(Item).where(Item.user_id.in_(user_ids)))
+            await db.execute(delete(Board).where(Board.user_id.in_(user_ids)))
+            await db.execute(delete(UserConnection).where(UserConnection.user_id.in_(user_ids)))
+            await db.execute(delete(BotState).where(
+                BotState.namespace == USER_DATA, BotState.key.in_([str(user_id) for user_id in user_ids])
+            ))
+            await db.execute(delete(User).where(User.id.in_(user_ids)))
+            for user_id in user_ids:
+                await bump_data_version(db, user_id)
+            if sqlite:
+                await db.execute(text("PRAGMA secure_delete = OFF"))
+            await db.commit()
+            for user_id in user_ids:
+                keyboard_cache.invalidate(user_id)
+                search_cache.invalidate(user_id)
+                await boards_cache.invalidate(user_id)
+                await items_cache.invalidate(user_id)
+
+            if sqlite:
+                busy, _, _ = (await db.execute(text("PRAGMA wal_checkpoint(TRUNCATE)"))).one()
+                if busy:
+                    logger.warning("The WAL checkpoint after deleting users was blocked by readers, the deleted "
+                                   "keys stay in the WAL until the next checkpoint")
+            return file_paths
+        except SQLAlchemyError as sqlex:
+            await db.rollback()
+            raise sqlex
@@ -0,0 +1,157 @@
+import contextvars
+import functools
+import json
+import logging
+import os
+import time
+from collections import Counter as ShapeCounter
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+from sqlalchemy import event
+
+from utils.metrics import registry
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+slow_query_logger = logging.getLogger("pintag.slow_queries")
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", 100))
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", 5))
+
+current_tracker = contextvars.ContextVar("current_query_tracker", default=None)
+
+slow_queries_total = registry.counter(
+    "pintag_db_slow_queries_total", "Statements slower than SLOW_QUERY_MS", ("caller",)
+)
+repeated_statements_total = registry.counter(
+    "pintag_db_repeated_statements_total", "Requests that ran one statement shape too many times", ("caller",)
+)
+statements_per_request = registry.histogram(
+    "pintag_db_statements_per_request", "Statements executed per API request or bot update", ("caller",),
+    buckets=(1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+)
+
+
+class TooManyQueriesError(AssertionError):
+    pass
+
+
+class QueryTracker:
+    def __init__(self, caller):
+        self.caller = caller
+        # A request tracked inside assert_max_queries also counts towards the test's budget.
+        self.parent = current_tracker.get()
+        self.statements = ShapeCounter()
+        self.total = 0
+        self.duration = 0.0
+
+
+    @property
+    def caller_name(self) -> str:
+        return self.caller() if callable(self.caller) else self.caller
+
+
+    def record(self, statement: str, duration: float):
+        self.statements[statement] += 1
+        self.total += 1
+        self.duration += duration
+        if self.parent is not None:
+            self.parent.record(statement, duration)
+
+
+    def repeated_statements(self, threshold: int = N_PLUS_ONE_THRESHOLD) -> list[tuple[str, int]]:
+        return [(statement, count) for statement, count in self.statements.items() if count > threshold]
+
+
+def params_shape(parameters) -> str:
+    if isinstance(parameters, (list, tuple)):
+        if parameters and isinstance(parameters[0], (list, tuple, dict)):
+            return f"{len(parameters)}x{params_shape(parameters[0])}"
+        return "(" + ", ".join(type(value).__name__ for value in parameters) + ")"
+    if isinstance(parameters, dict):
+        return "{" + ", ".join(f"{key}: {type(value).__name__}" for key, value in parameters.items()) + "}"
+    return type(parameters).__name__
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started_at", []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    duration = time.perf_counter() - conn.info["query_started_at"].pop()
+    tracker = current_tracker.get()
+    if tracker is not None:
+        tracker.record(statement, duration)
+
+    if duration * 1000 >= SLOW_QUERY_MS:
+        caller = tracker.caller_name if tracker else "unknown"
+        slow_queries_total.inc(caller=caller)
+        slow_query_logger.warning(json.dumps({
+            "event": "slow_query",
+            "duration_ms": round(duration * 1000, 3),
+            "caller": caller,
+            "statement": " ".join(statement.split()),
+            "params_shape": params_shape(parameters),
+            "executemany": executemany,
+        }, ensure_ascii=False))
+
+
+def attach_query_instrumentation(engine):
+    sync_engine = getattr(engine, "sync_engine", engine)
+    if not event.contains(sync_engine, "before_cursor_execute", before_cursor_execute):
+        event.listen(sync_engine, "before_cursor_execute", before_cursor_execute)
+        event.listen(sync_engine, "after_cursor_execute", after_cursor_execute)
+
+
+def report_repeated_statements(tracker: QueryTracker):
+    caller = tracker.caller_name
+    statements_per_request.observe(tracker.total, caller=caller)
+
+    repeated = tracker.repeated_statements()
+    if not repeated:
+        return
+
+    repeated_statements_total.inc(caller=caller)
+    for statement, count in repeated:
+        logger.warning(json.dumps({
+            "event": "repeated_statement",
+            "caller": caller,
+            "count": count,
+            "threshold": N_PLUS_ONE_THRESHOLD,
+            "statement": " ".join(statement.split()),
+        }, ensure_ascii=False))
+
+
+@contextmanager
+def track_queries(caller, max_queries: int = None):
+    tracker = QueryTracker(caller)
+    token = current_tracker.set(tracker)
+    try:
+        yield tracker
+    finally:
+        current_tracker.reset(token)
+        report_repeated_statements(tracker)
+
+    if max_queries is not None and tracker.total > max_queries:
+        details = "\n".join(f"{count}x {statement}" for statement, count in tracker.statements.most_common())
+        raise TooManyQueriesError(
+            f"{tracker.caller_name} executed {tracker.total} statements, expected at most {max_queries}:\n{details}"
+        )
+
+
+def assert_max_queries(max_queries: int, caller: str = "test"):
+    # Only for tests: production requests are measured and logged, never failed for their query count.
+    return track_queries(caller, max_queries)
+
+
+def tracked_handler(callback, name: str = None):
+    handler_name = name or getattr(callback, "__name__", repr(callback))
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        with track_queries(f"bot:{handler_name}"):
+            return await callback(update, context)
+
+    return wrapper
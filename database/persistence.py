@@ -0,0 +1,204 @@
+import asyncio
+import json
+import logging
+import os
+
+from dotenv import load_dotenv
+from sqlalchemy import select, delete, insert
+from sqlalchemy.exc import SQLAlchemyError
+from telegram.ext import BasePersistence, PersistenceInput
+
+from database.database import AsyncSessionLocal, BotState
+from utils.metrics import registry
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+PERSISTENCE_FLUSH_MS = int(os.getenv("PERSISTENCE_FLUSH_MS", 500))
+PERSISTENCE_RETRY_MAX_S = float(os.getenv("PERSISTENCE_RETRY_MAX_S", 60))
+
+USER_DATA = "user_data"
+CONVERSATION_PREFIX = "conversation:"
+
+persistence_writes_total = registry.counter(
+    "pintag_persistence_writes_total", "Bot state rows written to the database", ("operation",)
+)
+persistence_flush_seconds = registry.histogram(
+    "pintag_persistence_flush_seconds", "Time spent writing one batch of bot state"
+)
+
+
+class DatabasePersistence(BasePersistence):
+    def __init__(self, flush_interval_ms: int = PERSISTENCE_FLUSH_MS, max_retry_delay: float = PERSISTENCE_RETRY_MAX_S):
+        # The application calls update_* once per interval for everything touched since the last run,
+        # so handlers never wait for the database and each run becomes a single transaction.
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=flush_interval_ms / 1000,
+        )
+        self.pending: dict[tuple[str, str], str | None] = {}
+        self.written: dict[tuple[str, str], str] = {}
+        self.write_task = None
+        # One batch is written at a time, so an older batch can never overwrite a newer one.
+        self.write_lock = asyncio.Lock()
+        self.retry_task = None
+        self.retry_delay = 0.0
+        self.min_retry_delay = flush_interval_ms / 1000
+        self.max_retry_delay = max_retry_delay
+
+
+    async def load(self, namespace: str) -> dict[str, str]:
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(BotState.key, BotState.data).filter(BotState.namespace == namespace)
+            )
+            rows = dict(result.all())
+        self.written.update({(namespace, key): data for key, data in rows.items()})
+        return rows
+
+
+    async def get_user_data(self) -> dict:
+        return {int(key): json.loads(data) for key, data in (await self.load(USER_DATA)).items()}
+
+
+    async def get_chat_data(self) -> dict:
+        return {}
+
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+
+    async def get_callback_data(self):
+        return None
+
+
+    async def get_conversations(self, name: str) -> dict:
+        rows = await self.load(CONVERSATION_PREFIX + name)
+        return {tuple(json.loads(key)): json.loads(data) for key, data in rows.items()}
+
+
+    async def queue(self, namespace: str, key: str, data: str | None):
+        if self.written.get((namespace, key)) == data:
+            return
+        self.pending[(namespace, key)] = data
+
+        if self.write_task is None:
+            self.write_task = asyncio.create_task(self.write_pending())
+        await asyncio.shield(self.write_task)
+
+
+    async def write_pending(self):
+        # Yield once so every update_* call of the current run lands in the same batch.
+        await asyncio.sleep(0)
+        self.write_task = None
+        async with self.write_lock:
+            await self.write_batch()
+
+
+    async def write_batch(self):
+        pending, self.pending = self.pending, {}
+        if not pending:
+            return
+
+        namespaces: dict[str, list[str]] = {}
+        for namespace, key in pending:
+            namespaces.setdefault(namespace, []).append(key)
+        rows = [
+            {"namespace": namespace, "key": key, "data": data}
+            for (namespace, key), data in pending.items() if data is not None
+        ]
+
+        with persistence_flush_seconds.time():
+            async with AsyncSessionLocal() as db:
+                try:
+                    for namespace, keys in namespaces.items():
+                        await db.execute(
+                            delete(BotState).where(BotState.namespace == namespace, BotState.key.in_(keys))
+                        )
+                    if rows:
+                        await db.execute(insert(BotState), rows)
+                    await db.commit()
+                except SQLAlchemyError as sqlex:
+                    await db.rollback()
+                    # Keep the batch for the retry, unless newer state has been queued since.
+                    self.pending = {**pending, **self.pending}
+                    self.schedule_retry()
+                    logger.error(f"Failed to persist {len(pending)} bot state rows, retrying in "
+                                 f"{self.retry_delay:.1f}s: {sqlex}")
+                    return
+
+        self.retry_delay = 0.0
+
+        for entry, data in pending.items():
+            if data is None:
+                self.written.pop(entry, None)
+            else:
+                self.written[entry] = data
+        persistence_writes_total.inc(len(rows), operation="upsert")
+        persistence_writes_total.inc(len(pending) - len(rows), operation="delete")
+
+
+    def schedule_retry(self):
+        # Failed state is written again even if the user never sends another update.
+        self.retry_delay = min(max(self.retry_delay * 2, self.min_retry_delay), self.max_retry_delay)
+        if self.retry_task is None:
+            self.retry_task = asyncio.create_task(self.retry_later(self.retry_delay))
+
+
+    async def retry_later(self, delay: float):
+        await asyncio.sleep(delay)
+        self.retry_task = None
+        await self.write_pending()
+
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        await self.queue(USER_DATA, str(user_id), json.dumps(data, ensure_ascii=False) if data else None)
+
+
+    async def drop_user_data(self, user_id: int) -> None:
+        await self.queue(USER_DATA, str(user_id), None)
+
+
+    async def update_conversation(self, name: str, key, new_state) -> None:
+        await self.queue(CONVERSATION_PREFIX + name, json.dumps(list(key)),
+                         None if new_state is None else json.dumps(new_state))
+
+
+    async def update_chat_data(self, chat_id: int, data) -> None:
+        pass
+
+
+    async def update_bot_data(self, data) -> None:
+        pass
+
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+
+    async def refresh_user_data(self, user_id: int, user_data) -> None:
+        pass
+
+
+    async def refresh_chat_data(self, chat_id: int, chat_data) -> None:
+        pass
+
+
+    async def refresh_bot_data(self, bot_data) -> None:
+        pass
+
+
+    async def flush(self) -> None:
+        if self.retry_task is not None:
+            self.retry_task.cancel()
+            self.retry_task = None
+        if self.write_task is not None:
+            await asyncio.shield(self.write_task)
+        async with self.write_lock:
+            await self.write_batch()
@@ -0,0 +1,108 @@
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+from files.encryption_manager import encryption_manager
+from files.file_manager import file_manager
+from files.storage_backend import storage
+from files.user_keys import user_keys, USER_KEY_CACHE_TTL
+from utils.metrics import registry
+
+load_dotenv()
+
+BLOB_CACHE_MAX_BYTES = int(os.getenv("BLOB_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+BLOB_CACHE_MAX_ENTRY_BYTES = int(os.getenv("BLOB_CACHE_MAX_ENTRY_BYTES", 2 * 1024 * 1024))
+BLOB_CACHE_MAX_USER_BYTES = int(os.getenv("BLOB_CACHE_MAX_USER_BYTES", 16 * 1024 * 1024))
+# A decrypted copy must not outlive the key it was decrypted with, or a deleted user's files stay
+# readable from another process's memory.
+BLOB_CACHE_TTL = float(os.getenv("BLOB_CACHE_TTL", USER_KEY_CACHE_TTL))
+
+blob_cache_requests_total = registry.counter(
+    "pintag_blob_cache_requests_total", "Decrypted file cache lookups", ("result",)
+)
+
+
+class BlobCache:
+    def __init__(self, max_bytes: int = BLOB_CACHE_MAX_BYTES, max_entry_bytes: int = BLOB_CACHE_MAX_ENTRY_BYTES,
+                 max_user_bytes: int = BLOB_CACHE_MAX_USER_BYTES, ttl: float = BLOB_CACHE_TTL):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.max_user_bytes = max_user_bytes
+        self.ttl = ttl
+        self.entries: OrderedDict[str, tuple[int, float, bytes]] = OrderedDict()
+        self.user_bytes: dict[int, int] = {}
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+        registry.gauge("pintag_blob_cache_bytes", "Decrypted bytes held in memory").callback = lambda: self.bytes
+        registry.gauge("pintag_blob_cache_entries", "Decrypted files held in memory").callback = \
+            lambda: len(self.entries)
+
+
+    def get(self, user_id: int, file_path: str) -> bytes | None:
+        with self.lock:
+            entry = self.entries.get(file_path)
+            # An entry is only ever served to the user it was read for.
+            if entry is None or entry[0] != user_id or entry[1] < time.monotonic():
+                blob_cache_requests_total.inc(result="miss")
+                return None
+            self.entries.move_to_end(file_path)
+        blob_cache_requests_total.inc(result="hit")
+        return entry[2]
+
+
+    def put(self, user_id: int, file_path: str, data: bytes):
+        size = len(data)
+        if size > self.max_entry_bytes or size > self.max_user_bytes:
+            blob_cache_requests_total.inc(result="too_large")
+            return
+
+        with self.lock:
+            self.remove(file_path)
+            self.entries[file_path] = (user_id, time.monotonic() + self.ttl, data)
+            self.bytes += size
+            self.user_bytes[user_id] = self.user_bytes.get(user_id, 0) + size
+
+            # One user's large gallery evicts their own older files before anyone else's.
+            if self.user_bytes[user_id] > self.max_user_bytes:
+                for path in [path for path, (owner, _, _) in self.entries.items() if owner == user_id]:
+                    if self.user_bytes.get(user_id, 0) <= self.max_user_bytes:
+                        break
+                    self.remove(path)
+            while self.bytes > self.max_bytes:
+                self.remove(next(iter(self.entries)))
+
+
+    def remove(self, file_path: str):
+        entry = self.entries.pop(file_path, None)
+        if entry is None:
+            return
+        user_id, _, data = entry
+        self.bytes -= len(data)
+        self.user_bytes[user_id] -= len(data)
+        if not self.user_bytes[user_id]:
+            del self.user_bytes[user_id]
+
+
+    def invalidate(self, file_path: str):
+        with self.lock:
+            self.remove(str(file_path))
+
+
+blob_cache = BlobCache()
+file_manager.change_listeners.append(blob_cache.invalidate)
+
+
+async def read_file(user_id: int, file_path: str, encrypted: bool = True) -> bytes:
+    data = blob_cache.get(user_id, file_path)
+    if data is None:
+        data = await storage.get(file_path)
+        if encrypted:
+            data_key = await user_keys.for_reading(user_id, data)
+            data = await asyncio.to_thread(encryption_manager.decrypt_file, data, data_key)
+        blob_cache.put(user_id, file_path, data)
+    return data
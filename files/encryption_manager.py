@@ -1,32 +1,303 @@
+import base64
+import os
+import struct
+import threading
+import time
+import zlib
 from pathlib import Path
 
-from cryptography.fernet import Fernet
+from cryptography.exceptions import InvalidSignature
+from cryptography.fernet import Fernet, InvalidToken
+from cryptography.hazmat.primitives import hashes, hmac
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from dotenv import load_dotenv
+
+from utils.metrics import registry, timed_crypto
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+load_dotenv()
+
+COMPRESSION_ALGORITHM = os.getenv("COMPRESSION_ALGORITHM", "zstd" if zstandard else "zlib").lower()
+COMPRESSION_LEVEL = int(os.getenv("COMPRESSION_LEVEL", 3 if COMPRESSION_ALGORITHM == "zstd" else 6))
+COMPRESSED_CONTENT_TYPES = {
+    content_type.strip() for content_type in os.getenv("COMPRESSED_CONTENT_TYPES", "document").split(",")
+    if content_type.strip()
+}
+COMPRESSION_MIN_SAVING = float(os.getenv("COMPRESSION_MIN_SAVING", 0.05))
+
+# Formats that are compressed already, a second pass only costs CPU.
+PRECOMPRESSED_EXTENSIONS = {
+    ".jpg", ".jpeg", ".png", ".gif", ".webp", ".heic", ".mp4", ".mov", ".mkv", ".webm", ".mp3", ".ogg",
+    ".oga", ".m4a", ".zip", ".gz", ".tgz", ".bz2", ".xz", ".zst", ".7z", ".rar", ".apk",
+}
+
+# Blob layout: magic, format version, flags, key id, then the Fernet token in raw bytes instead of base64,
+# see FileKey. The token's HMAC covers the header as well, so flags and key id cannot be changed unnoticed.
+# Version 2 had the same layout with an HMAC over the token only. Version 1 had no key id and was always
+# written with key 0. Blobs written before the header existed are plain base64 tokens of key 0 and always
+# start with "gAAAAA".
+HEADER = struct.Struct(">2sBBI")
+HEADER_V1 = struct.Struct(">2sBB")
+MAGIC = b"PT"
+FORMAT_VERSION = 3
+KEY_RELOAD_INTERVAL = float(os.getenv("KEY_RELOAD_INTERVAL", 5))
+FLAG_ZLIB = 0x01
+FLAG_ZSTD = 0x02
+# Encrypted with the owner's data key from the user_keys table instead of a master key, the key id is then 0.
+FLAG_DATA_KEY = 0x04
+# Fernet token: version byte, timestamp, IV, AES-128-CBC ciphertext, HMAC-SHA256 of everything before it.
+TOKEN_HEAD = struct.Struct(">BQ16s")
+TOKEN_VERSION = 0x80
+BLOCK_SIZE = 16
+SIGNATURE_SIZE = 32
+
+compression_bytes = registry.counter(
+    "pintag_compression_bytes_total", "File bytes before and after compression at rest", ("algorithm", "stage")
+)
+
+
+def compress(file_data: bytes, algorithm: str, level: int = COMPRESSION_LEVEL) -> tuple[bytes, int]:
+    with timed_crypto("compress", len(file_data)):
+        if algorithm == "zstd":
+            if zstandard is None:
+                raise RuntimeError("COMPRESSION_ALGORITHM=zstd requires the 'zstandard' package")
+            return zstandard.ZstdCompressor(level=level).compress(file_data), FLAG_ZSTD
+        return zlib.compress(file_data, level), FLAG_ZLIB
+
+
+def decompress(data: bytes, flags: int) -> bytes:
+    with timed_crypto("decompress", len(data)):
+        if flags & FLAG_ZSTD:
+            if zstandard is None:
+                raise RuntimeError("File is zstd compressed, install the 'zstandard' package to read it")
+            return zstandard.ZstdDecompressor().decompress(data)
+        if flags & FLAG_ZLIB:
+            return zlib.decompress(data)
+        return data
+
+
+def compression_for(content_type: str | None, filename: str | None = None) -> str | None:
+    if COMPRESSION_ALGORITHM == "none" or content_type not in COMPRESSED_CONTENT_TYPES:
+        return None
+    if filename and Path(filename).suffix.lower() in PRECOMPRESSED_EXTENSIONS:
+        return None
+    return COMPRESSION_ALGORITHM
+
+
+def parse_header(encrypted_data: bytes) -> tuple[int, int, int]:
+    if encrypted_data[:len(MAGIC)] != MAGIC:
+        return 0, 0, 0
+    version = encrypted_data[len(MAGIC)]
+    if version == 1:
+        _, _, flags = HEADER_V1.unpack_from(encrypted_data)
+        return HEADER_V1.size, flags, 0
+    if version in (2, FORMAT_VERSION):
+        _, _, flags, key_id = HEADER.unpack_from(encrypted_data)
+        return HEADER.size, flags, key_id
+    raise ValueError(f"Unsupported encrypted file format version {version}")
+
+
+def format_version_of(encrypted_data: bytes) -> int:
+    return encrypted_data[len(MAGIC)] if encrypted_data[:len(MAGIC)] == MAGIC else 0
+
+
+def key_id_of(encrypted_data: bytes) -> int:
+    return parse_header(encrypted_data)[2]
+
+
+def uses_data_key(encrypted_data: bytes) -> bool:
+    return bool(parse_header(encrypted_data)[1] & FLAG_DATA_KEY)
+
+
+class FileKey(Fernet):
+    def __init__(self, key: bytes | str):
+        # Writes and reads the same tokens as Fernet, only as raw bytes: going through base64 and back
+        # cost more than the encryption itself on large files.
+        super().__init__(key)
+        raw_key = base64.urlsafe_b64decode(key)
+        self.signing_key, self.encryption_key = raw_key[:16], raw_key[16:]
+
+
+    def encrypt_raw(self, payload: bytes, prefix: bytes = b"") -> bytes:
+        iv = os.urandom(BLOCK_SIZE)
+        head = TOKEN_HEAD.pack(TOKEN_VERSION, int(time.time()), iv)
+        aligned = len(payload) - len(payload) % BLOCK_SIZE
+        padding = BLOCK_SIZE - len(payload) % BLOCK_SIZE
+        encryptor = Cipher(algorithms.AES(self.encryption_key), modes.CBC(iv)).encryptor()
+        # Only the last block is padded, the rest is encrypted straight from the caller's buffer.
+        body = encryptor.update(memoryview(payload)[:aligned])
+        tail = encryptor.update(payload[aligned:] + bytes([padding]) * padding) + encryptor.finalize()
+        # The prefix is signed along with the token, with an empty prefix this is exactly a Fernet token.
+        signature = hmac.HMAC(self.signing_key, hashes.SHA256())
+        for part in (prefix, head, body, tail):
+            signature.update(part)
+        return b"".join((prefix, head, body, tail, signature.finalize()))
+
+
+    def decrypt_raw(self, data: bytes, offset: int = 0, signed_prefix: bool = True) -> bytes:
+        token = memoryview(data)[offset:]
+        if len(token) < TOKEN_HEAD.size + BLOCK_SIZE + SIGNATURE_SIZE or token[0] != TOKEN_VERSION:
+            raise InvalidToken
+        signature = hmac.HMAC(self.signing_key, hashes.SHA256())
+        signature.update(memoryview(data)[:-SIGNATURE_SIZE] if signed_prefix else token[:-SIGNATURE_SIZE])
+        try:
+            signature.verify(bytes(token[-SIGNATURE_SIZE:]))
+        except InvalidSignature:
+            raise InvalidToken
+
+        iv = bytes(token[TOKEN_HEAD.size - BLOCK_SIZE:TOKEN_HEAD.size])
+        decryptor = Cipher(algorithms.AES(self.encryption_key), modes.CBC(iv)).decryptor()
+        ciphertext = token[TOKEN_HEAD.size:-SIGNATURE_SIZE]
+        if len(ciphertext) % BLOCK_SIZE:
+            raise InvalidToken
+        body = decryptor.update(ciphertext[:-BLOCK_SIZE])
+        tail = decryptor.update(ciphertext[-BLOCK_SIZE:]) + decryptor.finalize()
+        padding = tail[-1]
+        if not 1 <= padding <= BLOCK_SIZE or tail[-padding:] != bytes([padding]) * padding:
+            raise InvalidToken
+        return body + tail[:-padding]
 
 
 class EncryptionManager:
     def __init__(self, key_path: str = "encryption.key"):
+        # The key file holds one "<id>:<key>" line per key, the highest id encrypts new files and the
+        # older ones stay for reading until the re-encryption job has moved everything off them.
+        # A file with a bare key, as written before rotation existed, is key 0.
         self.key_path = Path(key_path)
-        self.key = self.load_or_generate_key()
-        self.fernet = Fernet(self.key)
+        self.keys: dict[int, FileKey] = {}
+        self.active_key_id = 0
+        self.loaded_mtime = None
+        self.checked_at = 0.0
+        self.lock = threading.Lock()
+        self.load_keys()
+
+
+    @property
+    def fernet(self) -> FileKey:
+        return self.keys[self.active_key_id]
+
+
+    def read_keyring(self) -> dict[int, bytes]:
+        keys = {}
+        for line in self.key_path.read_bytes().split():
+            key_id, _, key = line.rpartition(b":")
+            keys[int(key_id or 0)] = key
+        return keys
+
+
+    def write_keyring(self, keys: dict[int, bytes]):
+        temp_path = self.key_path.with_name(self.key_path.name + ".tmp")
+        with open(os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "wb") as key_file:
+            key_file.write(b"".join(b"%d:%s\n" % (key_id, key) for key_id, key in sorted(keys.items())))
+            key_file.flush()
+            os.fsync(key_file.fileno())
+        os.replace(temp_path, self.key_path)
+
+
+    def load_keys(self):
+        with self.lock:
+            if not self.key_path.exists():
+                self.write_keyring({0: Fernet.generate_key()})
+            mtime = self.key_path.stat().st_mtime_ns
+            keys = self.read_keyring()
+            self.keys = {key_id: FileKey(key) for key_id, key in keys.items()}
+            self.active_key_id = max(keys)
+            self.loaded_mtime = mtime
+            self.checked_at = time.monotonic()
+
+
+    def refresh_keys(self, force: bool = False):
+        # Every process picks up a rotation within KEY_RELOAD_INTERVAL, without a restart.
+        if not force and time.monotonic() - self.checked_at < KEY_RELOAD_INTERVAL:
+            return
+        self.checked_at = time.monotonic()
+        if self.key_path.stat().st_mtime_ns != self.loaded_mtime:
+            self.load_keys()
+
 
+    def rotate_key(self) -> int:
+        with self.lock:
+            keys = self.read_keyring()
+            key_id = max(keys) + 1
+            keys[key_id] = Fernet.generate_key()
+            self.write_keyring(keys)
+        self.load_keys()
+        return key_id
 
-    def load_or_generate_key(self) -> bytes:
-        if self.key_path.exists():
-            with open(self.key_path, "rb") as key_file:
-                return key_file.read()
+
+    def key_for(self, key_id: int) -> FileKey:
+        if key_id not in self.keys:
+            self.refresh_keys(force=True)
+        if key_id not in self.keys:
+            raise ValueError(f"Encryption key {key_id} is not in {self.key_path}")
+        return self.keys[key_id]
+
+
+    def encrypt_file(self, file_data: bytes, content_type: str = None, filename: str = None,
+                     data_key: FileKey = None) -> bytes:
+        flags = 0
+        algorithm = compression_for(content_type, filename)
+        if algorithm is not None:
+            compressed, compressed_flag = compress(file_data, algorithm)
+            # Documents such as docx or pdf are often zipped inside, those are kept as they are.
+            if len(compressed) <= len(file_data) * (1 - COMPRESSION_MIN_SAVING):
+                compression_bytes.inc(len(file_data), algorithm=algorithm, stage="original")
+                compression_bytes.inc(len(compressed), algorithm=algorithm, stage="stored")
+                file_data, flags = compressed, compressed_flag
+        return self.seal(file_data, flags, data_key)
+
+
+    def seal(self, payload: bytes, flags: int, data_key: FileKey = None) -> bytes:
+        if data_key is None:
+            self.refresh_keys()
+            key_id = self.active_key_id
+            fernet = self.keys[key_id]
+        else:
+            key_id, fernet, flags = 0, data_key, flags | FLAG_DATA_KEY
+        with timed_crypto("encrypt", len(payload)):
+            return fernet.encrypt_raw(payload, HEADER.pack(MAGIC, FORMAT_VERSION, flags, key_id))
+
+
+    def unseal(self, encrypted_data: bytes, data_key: FileKey = None) -> tuple[bytes, int]:
+        header_size, flags, key_id = parse_header(encrypted_data)
+        if flags & FLAG_DATA_KEY:
+            if data_key is None:
+                raise ValueError("File is encrypted with a user data key that was not given")
+            fernet = data_key
         else:
-            key = Fernet.generate_key()
-            with open(self.key_path, "wb") as key_file:
-                key_file.write(key)
-            return key
+            fernet = self.key_for(key_id)
+        with timed_crypto("decrypt", len(encrypted_data)):
+            if header_size:
+                signed_prefix = format_version_of(encrypted_data) == FORMAT_VERSION
+                payload = fernet.decrypt_raw(encrypted_data, header_size, signed_prefix)
+            else:
+                payload = fernet.decrypt(encrypted_data)
+        return payload, flags & ~FLAG_DATA_KEY
+
+
+    def decrypt_file(self, encrypted_data: bytes, data_key: FileKey = None) -> bytes:
+        payload, flags = self.unseal(encrypted_data, data_key)
+        return decompress(payload, flags)
+
+
+    def reencrypt(self, encrypted_data: bytes, data_key: FileKey = None, new_data_key: FileKey = None) -> bytes:
+        # Moves a blob to the active key, or to new_data_key, without decompressing and compressing it again.
+        payload, flags = self.unseal(encrypted_data, data_key)
+        return self.seal(payload, flags, new_data_key)
 
 
-    def encrypt_file(self, file_data: bytes) -> bytes:
-        return self.fernet.encrypt(file_data)
+    def wrap_key(self, data_key: bytes) -> tuple[int, str]:
+        self.refresh_keys()
+        key_id = self.active_key_id
+        return key_id, self.keys[key_id].encrypt(data_key).decode()
 
 
-    def decrypt_file(self, encrypted_data: bytes) -> bytes:
-        return self.fernet.decrypt(encrypted_data)
+    def unwrap_key(self, key_id: int, wrapped_key: str) -> bytes:
+        return self.key_for(key_id).decrypt(wrapped_key.encode())
 
 
-encryption_manager = EncryptionManager()
\ No newline at end of file
+encryption_manager = EncryptionManager(os.getenv("ENCRYPTION_KEY_PATH", "encryption.key"))
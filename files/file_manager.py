@@ -1,12 +1,39 @@
+import contextlib
+import glob
 import hashlib
 import os
-from datetime import datetime
+import re
+import sqlite3
+import threading
+import time
+import uuid
 from pathlib import Path
 
+from dotenv import load_dotenv
+
+from files.pack_store import PackStore
+from utils.metrics import file_io_bytes
+
+load_dotenv()
+
+FILE_SHARD_DEPTH = int(os.getenv("FILE_SHARD_DEPTH", 1))
+PACK_MAX_BLOB_BYTES = int(os.getenv("PACK_MAX_BLOB_BYTES", 64 * 1024))
+PACK_COLD_DAYS = float(os.getenv("PACK_COLD_DAYS", 30))
+ARCHIVE_BATCH = 1000
+MAX_NAME_LENGTH = 120
+# Stored names are "<32 hex token>_<original name>", the token also picks the shard directories.
+STORED_NAME = re.compile(r"^([0-9a-f]{32})_(.+)$")
+
+
 class FileManager:
-    def __init__(self, base_path="users_files"):
+    def __init__(self, base_path="users_files", shard_depth: int = FILE_SHARD_DEPTH):
         self.base_path = Path(base_path)
         self.temp_path = self.base_path / "temp"
+        self.shard_depth = shard_depth
+        self.packs = PackStore(self.base_path / "packs")
+        self.change_listeners = []
+        self.known_folders: set[Path] = set()
+        self.folders_lock = threading.Lock()
         self.setup_directories()
 
 
@@ -15,52 +42,274 @@ class FileManager:
         self.temp_path.mkdir(parents=True, exist_ok=True)
 
 
-    def get_user_folder(self, user_id: int, file_type: str) -> Path:
-        user_path = self.base_path / str(user_id) / file_type
-        user_path.mkdir(parents=True, exist_ok=True)
-        return user_path
+    def ensure_folder(self, folder: Path) -> Path:
+        if folder not in self.known_folders:
+            folder.mkdir(parents=True, exist_ok=True)
+            with self.folders_lock:
+                self.known_folders.add(folder)
+        return folder
+
+
+    def shards(self, token: str) -> list[str]:
+        # 256 shards per level keep directories small even for users with tens of thousands of files.
+        return [token[level * 2:level * 2 + 2] for level in range(self.shard_depth)]
+
+
+    def get_user_folder(self, user_id: int, file_type: str, token: str) -> Path:
+        return self.ensure_folder(self.base_path.joinpath(str(user_id), file_type, *self.shards(token)))
+
+
+    def generate_filename(self, original_filename: str | None) -> str:
+        name = Path(original_filename).name if original_filename else ""
+        if not name or name in (".", ".."):
+            name = "file.bin"
+        if len(name) > MAX_NAME_LENGTH:
+            suffix = Path(name).suffix[:16]
+            name = name[:MAX_NAME_LENGTH - len(suffix)] + suffix
+        return f"{uuid.uuid4().hex}_{name}"
+
 
+    def new_file_path(self, user_id: int, file_type: str, original_filename: str = None) -> Path:
+        filename = self.generate_filename(original_filename)
+        return self.get_user_folder(user_id, file_type, filename) / filename
 
-    def generate_filename(self, original_filename: str, user_id: int) -> str:
-        timestamp = int(datetime.now().timestamp())
-        file_ext = Path(original_filename).suffix if original_filename else '.bin'
-        return f"{user_id}_{timestamp}_{hashlib.md5(original_filename.encode()).hexdigest()[:8]}{file_ext}"
+
+    def new_file_key(self, user_id: int, file_type: str, original_filename: str = None) -> str:
+        # The same name as new_file_path, without touching the disk, for object storage.
+        filename = self.generate_filename(original_filename)
+        return str(self.base_path.joinpath(str(user_id), file_type, *self.shards(filename), filename))
 
 
     def save_file(self, file_data: bytes, user_id: int, file_type: str, original_filename: str = None) -> str:
-        if original_filename is None:
-            original_filename = self.generate_filename(original_filename, user_id)
+        while True:
+            try:
+                return self.write_file(self.new_file_path(user_id, file_type, original_filename), file_data,
+                                       exclusive=True)
+            except FileExistsError:
+                continue
+
+
+    def display_name(self, file_path: str) -> str:
+        name = Path(file_path).name
+        match = STORED_NAME.match(name)
+        return match.group(2) if match else name
+
+
+    def is_sharded(self, file_path: str) -> bool:
+        path = Path(file_path)
+        match = STORED_NAME.match(path.name)
+        if not match:
+            return False
+        shards = path.parent.parts[len(path.parent.parts) - self.shard_depth:] if self.shard_depth else ()
+        return list(shards) == self.shards(match.group(1))
+
+
+    def relocate(self, file_path: str, user_id: int, file_type: str) -> str:
+        # Links first and leaves the old names to remove_relocated, so a crash before the database
+        # is updated never loses a file.
+        old_path = Path(file_path)
+        if not self.exists(file_path):
+            raise FileNotFoundError(f"File not found: {old_path}")
+        while True:
+            new_path = self.new_file_path(user_id, file_type, old_path.name)
+            try:
+                if old_path.is_file():
+                    os.link(old_path, new_path)
+                elif not self.packs.link(str(old_path), str(new_path)):
+                    raise FileNotFoundError(f"File not found: {old_path}")
+                break
+            except (FileExistsError, sqlite3.IntegrityError):
+                continue
+        for variant in self.variant_paths(file_path):
+            new_variant = new_path.with_name(new_path.name + Path(variant).name[len(old_path.name):])
+            if Path(variant).is_file():
+                os.link(variant, new_variant)
+            else:
+                self.packs.link(variant, str(new_variant))
+        return str(new_path)
+
+
+    def remove_relocated(self, file_path: str):
+        for path in [*self.variant_paths(file_path), file_path]:
+            with contextlib.suppress(FileNotFoundError):
+                self.remove(path)
+
+
+    def variant_path(self, file_path: str, variant: str) -> str:
+        path = Path(file_path)
+        return str(path.with_name(f"{path.name}.{variant}.jpg"))
 
-        user_folder = self.get_user_folder(user_id, file_type)
-        file_path = user_folder / original_filename
 
-        with open(file_path, "wb") as f:
+    def save_variant(self, file_data: bytes, file_path: str, variant: str) -> str:
+        return self.write_file(Path(self.variant_path(file_path, variant)), file_data)
+
+
+    def write_file(self, file_path: Path, file_data: bytes, exclusive: bool = False) -> str:
+        # Overwrites go through a temporary name and a rename, so readers see either the old or the
+        # new contents and never a half-written file.
+        target = file_path if exclusive else file_path.with_name(f".{file_path.name}.{uuid.uuid4().hex[:8]}.tmp")
+        try:
+            f = open(target, "xb")
+        except FileNotFoundError:
+            # The folder was removed behind the cache's back.
+            with self.folders_lock:
+                self.known_folders.discard(file_path.parent)
+            f = open(self.ensure_folder(file_path.parent) / target.name, "xb")
+        with f:
             f.write(file_data)
+        if not exclusive:
+            os.replace(target, file_path)
+            # A packed copy of the old contents must not come back once this file is archived or removed.
+            self.packs.discard(str(file_path))
+        file_io_bytes.inc(len(file_data), operation="write")
+        self.notify_change(str(file_path))
 
         return str(file_path)
 
 
+    def list_paths(self, prefix: str) -> list[str]:
+        path = Path(prefix)
+        loose = {str(match) for match in path.parent.glob(glob.escape(path.name) + "*") if match.is_file()}
+        return sorted(loose | set(self.packs.paths_with_prefix(str(path))))
+
+
+    def variant_paths(self, file_path: str) -> list[str]:
+        # Thumbnails and previews are named after the full original name, see variant_path.
+        return [path for path in self.list_paths(str(Path(file_path)) + ".") if path.endswith(".jpg")]
+
+
+    def stat(self, file_path: str) -> tuple[int, float] | None:
+        try:
+            stat = os.stat(file_path)
+            return stat.st_size, stat.st_mtime
+        except FileNotFoundError:
+            location = self.packs.locate(str(Path(file_path)))
+            if location is None:
+                return None
+            return location[2], self.packs.pack_file(location[0]).stat().st_mtime
+
+
+    def exists(self, file_path: str) -> bool:
+        return Path(file_path).is_file() or self.packs.locate(str(Path(file_path))) is not None
+
+
     def get_file(self, file_path: str) -> bytes:
         path_to_file = Path(file_path)
-        if path_to_file.exists():
-            if path_to_file.is_file():
-                with open(path_to_file, "rb") as f:
-                    return f.read()
+        try:
+            with open(path_to_file, "rb") as f:
+                file_data = f.read()
+        except (FileNotFoundError, IsADirectoryError):
+            # Cold small files live in pack files, see archive_cold_files.
+            file_data = self.packs.read(str(path_to_file))
+            if file_data is None:
+                raise FileNotFoundError(f"File not found: {path_to_file}")
+        file_io_bytes.inc(len(file_data), operation="read")
+        return file_data
 
-        raise FileNotFoundError(f"File not found: {path_to_file}")
 
+    def get_range(self, file_path: str, start: int, length: int) -> bytes:
+        try:
+            fd = os.open(file_path, os.O_RDONLY)
+        except FileNotFoundError:
+            file_data = self.packs.read(str(Path(file_path)), start, length)
+            if file_data is None:
+                raise FileNotFoundError(f"File not found: {file_path}")
+        else:
+            try:
+                file_data = os.pread(fd, length, start)
+            finally:
+                os.close(fd)
+        file_io_bytes.inc(len(file_data), operation="read")
+        return file_data
 
-    def delete_file(self, file_path: str):
+
+    def remove(self, file_path: str):
         path_to_file = Path(file_path)
-        if path_to_file.exists():
-            if path_to_file.is_file():
-                os.remove(path_to_file)
-                return
-        raise FileNotFoundError(f"File not found: {path_to_file}")
+        try:
+            os.remove(path_to_file)
+            removed = True
+        except (FileNotFoundError, IsADirectoryError):
+            removed = False
+        # Always dropped from the index: archiving can pack the file between a check and the remove.
+        if not self.packs.discard(str(path_to_file)) and not removed:
+            raise FileNotFoundError(f"File not found: {path_to_file}")
+        self.notify_change(file_path)
+
+
+    def delete_file(self, file_path: str):
+        variants = self.variant_paths(file_path)
+        self.remove(file_path)
+        for variant in variants:
+            with contextlib.suppress(FileNotFoundError):
+                self.remove(variant)
+
+
+    def archive_cold_files(self, max_blob_bytes: int = PACK_MAX_BLOB_BYTES,
+                           min_age_seconds: float = PACK_COLD_DAYS * 86400) -> int:
+        # Moves small files nobody has written for a while into append-only pack files: one inode and
+        # one sequential file for backups instead of thousands. Must run inside packs.writer().
+        cutoff = time.time() - min_age_seconds
+        archived = 0
+        batch: dict[str, os.stat_result] = {}
+        skip = {self.temp_path, self.packs.path}
+
+        def flush():
+            blobs = []
+            for path, stat in batch.items():
+                try:
+                    with open(path, "rb") as f:
+                        blobs.append((path, f.read()))
+                except FileNotFoundError:
+                    continue
+            self.packs.append(blobs)
+            for path, stat in batch.items():
+                try:
+                    current = os.stat(path)
+                except FileNotFoundError:
+                    # Deleted while it was being packed, the index entry must not outlive it.
+                    self.packs.discard(path)
+                    continue
+                if (current.st_mtime_ns, current.st_size) != (stat.st_mtime_ns, stat.st_size):
+                    self.packs.discard(path)
+                    continue
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    self.packs.discard(path)
+            batch.clear()
+            return len(blobs)
+
+        for folder, folders, files in os.walk(self.base_path):
+            folders[:] = [name for name in folders if Path(folder, name) not in skip]
+            for name in files:
+                path = os.path.join(folder, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if stat.st_size <= max_blob_bytes and stat.st_mtime < cutoff:
+                    batch[path] = stat
+                if len(batch) >= ARCHIVE_BATCH:
+                    archived += flush()
+        if batch:
+            archived += flush()
+        return archived
+
+
+    def notify_change(self, file_path: str):
+        for listener in self.change_listeners:
+            listener(file_path)
 
 
     def get_file_size(self, file_path: str) -> int:
-        return Path(file_path).stat().st_size
+        stat = self.stat(file_path)
+        if stat is None:
+            raise FileNotFoundError(f"File not found: {file_path}")
+        return stat[0]
+
+
+def content_hash(file_data: bytes) -> str:
+    return hashlib.sha256(file_data).hexdigest()
 
 
-file_manager = FileManager()
\ No newline at end of file
+file_manager = FileManager(os.getenv("USERS_FILES_PATH", "users_files"))
\ No newline at end of file
@@ -0,0 +1,192 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+
+from dotenv import load_dotenv
+
+from database.database import init_db
+from database.database_worker import (
+    get_file_items_after, file_path_in_use, get_job_checkpoint, save_job_checkpoint, get_user_keys_after,
+    rewrap_user_keys, mark_data_key_files
+)
+from files.encryption_manager import encryption_manager, key_id_of, uses_data_key, format_version_of, HEADER, \
+    FORMAT_VERSION
+from files.storage_backend import storage
+from files.user_keys import user_keys, USER_DATA_KEYS
+from utils.metrics import registry
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+KEY_ROTATION_BATCH = int(os.getenv("KEY_ROTATION_BATCH", 200))
+KEY_ROTATION_MAX_MB_PER_S = float(os.getenv("KEY_ROTATION_MAX_MB_PER_S", 20))
+KEY_ROTATION_MAX_CPU = float(os.getenv("KEY_ROTATION_MAX_CPU", 0.25))
+
+reencrypted_blobs_total = registry.counter(
+    "pintag_reencrypted_blobs_total", "Stored blobs checked by the re-encryption job", ("result",)
+)
+
+
+class Throttle:
+    def __init__(self, max_bytes_per_second: float, max_cpu: float):
+        # Keeps the job's average disk traffic and the share of one core it spends on crypto under the
+        # limits, measured from the start of the run so short bursts are paid back by longer pauses.
+        self.max_bytes_per_second = max_bytes_per_second
+        self.max_cpu = max_cpu
+        self.started = time.monotonic()
+        self.bytes = 0
+        self.busy = 0.0
+
+
+    async def pace(self, transferred: int, busy: float):
+        self.bytes += transferred
+        self.busy += busy
+        elapsed = time.monotonic() - self.started
+        wait = 0.0
+        if self.max_bytes_per_second > 0:
+            wait = max(wait, self.bytes / self.max_bytes_per_second - elapsed)
+        if 0 < self.max_cpu < 1:
+            wait = max(wait, self.busy / self.max_cpu - elapsed)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+def checkpoint_name(key_id: int) -> str:
+    return f"reencrypt:{key_id}"
+
+
+async def rewrap_all(key_id: int, batch_size: int) -> int:
+    # Data keys follow a master key rotation by being wrapped again, the files they encrypt stay as they are.
+    rewrapped = 0
+    after_user_id = 0
+    while rows := await get_user_keys_after(after_user_id, batch_size):
+        after_user_id = rows[-1].user_id
+        wrapped_keys = {}
+        for row in rows:
+            if row.master_key_id != key_id:
+                data_key = encryption_manager.unwrap_key(row.master_key_id, row.wrapped_key)
+                wrapped_keys[row.user_id] = (row.master_key_id, *encryption_manager.wrap_key(data_key))
+        if wrapped_keys:
+            await rewrap_user_keys(wrapped_keys)
+            rewrapped += len(wrapped_keys)
+    return rewrapped
+
+
+async def reencrypt_blob(path: str, user_id: int, key_id: int, throttle: Throttle) -> str:
+    try:
+        # The key id sits in the header, a blob that is already done costs one small read.
+        header = await storage.get_range(path, 0, HEADER.size)
+        if format_version_of(header) == FORMAT_VERSION and (
+                uses_data_key(header) or not USER_DATA_KEYS and key_id_of(header) == key_id):
+            return "current"
+        encrypted_data = await storage.get(path)
+        read_key = await user_keys.for_reading(user_id, encrypted_data)
+    except FileNotFoundError:
+        return "missing"
+    # With per-user keys on, files still on a master key move to their owner's data key. Blobs of an older
+    # format are written again under the key they already use, so their header gets signed.
+    data_key = await user_keys.for_writing(user_id) or read_key
+    started = time.perf_counter()
+    reencrypted = await asyncio.to_thread(encryption_manager.reencrypt, encrypted_data, read_key, data_key)
+    busy = time.perf_counter() - started
+    await storage.put(path, reencrypted)
+    await throttle.pace(len(encrypted_data) + len(reencrypted), busy)
+    return "reencrypted"
+
+
+async def reencrypt_all(batch_size: int = KEY_ROTATION_BATCH, max_mb_per_s: float = KEY_ROTATION_MAX_MB_PER_S,
+                        max_cpu: float = KEY_ROTATION_MAX_CPU, restart: bool = False) -> dict:
+    # Files stay readable the whole time: old keys are kept in the key file and every blob names its
+    # key, so the job can be stopped at any point and continues from the last finished batch.
+    encryption_manager.refresh_keys(force=True)
+    key_id = encryption_manager.active_key_id
+    name = checkpoint_name(key_id)
+    checkpoint = None if restart else await get_job_checkpoint(name)
+    state = json.loads(checkpoint) if checkpoint else {
+        "after_id": 0, "rewrapped": 0, "reencrypted": 0, "current": 0, "missing": 0, "orphaned": 0, "done": False
+    }
+    if state["done"]:
+        logger.info(f"All files are already encrypted with key {key_id}")
+        return state
+    if not state["after_id"]:
+        state["rewrapped"] = await rewrap_all(key_id, batch_size)
+        logger.info(f"Wrapped {state['rewrapped']} user data keys with key {key_id}")
+    throttle = Throttle(max_mb_per_s * 1024 * 1024, max_cpu)
+
+    while True:
+        rows = await get_file_items_after(state["after_id"], batch_size)
+        if not rows:
+            break
+
+        seen = set()
+        data_key_files = {}
+        for row in rows:
+            if not row.encrypted or row.file_path in seen:
+                continue
+            seen.add(row.file_path)
+            for path in [row.file_path, *await storage.variant_paths(row.file_path)]:
+                result = await reencrypt_blob(path, row.user_id, key_id, throttle)
+                reencrypted_blobs_total.inc(result=result)
+                state[result] += 1
+                # A delete that ran between the read and the write above has been undone by the write.
+                if result == "reencrypted" and not await file_path_in_use(row.user_id, row.file_path):
+                    await storage.delete_file(row.file_path)
+                    state["orphaned"] += 1
+                    break
+                # With per-user keys on, every file that is current or was just rewritten is on a data key.
+                if path == row.file_path and result != "missing" and USER_DATA_KEYS:
+                    data_key_files.setdefault(row.user_id, []).append(row.file_path)
+        if data_key_files:
+            await mark_data_key_files(data_key_files)
+
+        state["after_id"] = rows[-1].id
+        await save_job_checkpoint(name, json.dumps(state))
+        logger.info(f"Re-encrypted files up to item {state['after_id']} with key {key_id}: {state}")
+
+    state["done"] = True
+    await save_job_checkpoint(name, json.dumps(state))
+    return state
+
+
+async def run(command: str, args) -> dict:
+    if command == "rotate":
+        previous = encryption_manager.active_key_id
+        key_id = encryption_manager.rotate_key()
+        logger.info(f"New files are encrypted with key {key_id}, key {previous} stays for reading")
+        return {"active_key": key_id, "keys": sorted(encryption_manager.keys)}
+
+    await init_db()
+    if command == "reencrypt":
+        return await reencrypt_all(args.batch_size, args.max_mb_per_s, args.max_cpu, args.restart)
+
+    encryption_manager.refresh_keys(force=True)
+    key_id = encryption_manager.active_key_id
+    checkpoint = await get_job_checkpoint(checkpoint_name(key_id))
+    return {"active_key": key_id, "keys": sorted(encryption_manager.keys),
+            "reencrypt": json.loads(checkpoint) if checkpoint else None}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rotate the file encryption key and re-encrypt stored files")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("rotate", help="Add a new key for writes, old keys stay for reading")
+    reencrypt = commands.add_parser("reencrypt", help="Move stored files to the active key")
+    reencrypt.add_argument("--batch-size", type=int, default=KEY_ROTATION_BATCH, help="Items per checkpoint")
+    reencrypt.add_argument("--max-mb-per-s", type=float, default=KEY_ROTATION_MAX_MB_PER_S,
+                           help="Read plus write bandwidth limit, 0 disables it")
+    reencrypt.add_argument("--max-cpu", type=float, default=KEY_ROTATION_MAX_CPU,
+                           help="Share of one core spent on crypto, 1 disables the limit")
+    reencrypt.add_argument("--restart", action="store_true", help="Ignore the saved checkpoint")
+    commands.add_parser("status", help="Show the keys and the re-encryption progress")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    print(asyncio.run(run(args.command, args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+
+from dotenv import load_dotenv
+from sqlalchemy.exc import SQLAlchemyError
+
+from database.database import init_db
+from database.database_worker import (
+    get_file_items_after, set_item_file_paths, get_job_checkpoint, save_job_checkpoint
+)
+from files.file_manager import file_manager
+from files.storage_backend import storage, LocalStorageBackend
+from utils.cache import CACHE_TTL
+from utils.user_cache import search_cache
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+FILE_MIGRATION_BATCH = int(os.getenv("FILE_MIGRATION_BATCH", 500))
+# Running bot and API processes keep items, and with them the old paths, cached for up to this long.
+FILE_MIGRATION_REMOVE_DELAY = float(os.getenv("FILE_MIGRATION_REMOVE_DELAY", max(CACHE_TTL, search_cache.ttl)))
+CHECKPOINT_NAME = "layout_migration"
+
+
+async def remove_due(removals: list[list], stats: dict, wait: bool = False):
+    # Removals are [deadline, old path] pairs in deadline order.
+    while removals:
+        delay = removals[0][0] - time.time()
+        if delay > 0:
+            if not wait:
+                return
+            logger.info(f"Waiting {delay:.0f}s for cached paths to expire before removing old names")
+            await asyncio.sleep(delay)
+        await asyncio.to_thread(file_manager.remove_relocated, removals.pop(0)[1])
+        stats["removed"] += 1
+
+
+async def migrate_layout(batch_size: int = FILE_MIGRATION_BATCH, pause: float = 0.0,
+                         remove_delay: float = FILE_MIGRATION_REMOVE_DELAY) -> dict:
+    # Files are linked into the sharded layout and the batch is committed. The old names stay until
+    # remove_delay has passed, so other processes serving a cached old path still find the file while
+    # the services keep running. Pending removals are checkpointed, an interrupted run can simply be
+    # started again.
+    stats = {"moved": 0, "skipped": 0, "missing": 0, "removed": 0}
+    relocated: dict[str, str] = {}
+    removals = json.loads(await get_job_checkpoint(CHECKPOINT_NAME) or "[]")
+    after_id = 0
+
+    while True:
+        rows = await get_file_items_after(after_id, batch_size)
+        if not rows:
+            break
+        after_id = rows[-1].id
+
+        file_paths = {}
+        linked = []
+        for row in rows:
+            if file_manager.is_sharded(row.file_path):
+                stats["skipped"] += 1
+                continue
+            # Documents with the same name used to overwrite each other, so several items can share a file.
+            if row.file_path not in relocated:
+                try:
+                    relocated[row.file_path] = await asyncio.to_thread(
+                        file_manager.relocate, row.file_path, row.user_id, row.content_type + "s"
+                    )
+                except FileNotFoundError:
+                    logger.warning(f"Item {row.id}: file {row.file_path} is missing, leaving it as is")
+                    stats["missing"] += 1
+                    continue
+                linked.append(row.file_path)
+            file_paths[row.id] = (row.user_id, relocated[row.file_path])
+
+        if file_paths:
+            try:
+                await set_item_file_paths(file_paths)
+            except SQLAlchemyError:
+                for old_path in linked:
+                    await asyncio.to_thread(file_manager.remove_relocated, relocated.pop(old_path))
+                raise
+            deadline = time.time() + remove_delay
+            removals.extend([deadline, old_path] for old_path in linked)
+            stats["moved"] += len(file_paths)
+
+        await remove_due(removals, stats)
+        await save_job_checkpoint(CHECKPOINT_NAME, json.dumps(removals))
+
+        logger.info(f"Relocated files up to item {after_id}: {stats}")
+        if pause:
+            await asyncio.sleep(pause)
+
+    await remove_due(removals, stats, wait=True)
+    await save_job_checkpoint(CHECKPOINT_NAME, None)
+    return stats
+
+
+async def run(batch_size: int, pause: float, remove_delay: float) -> dict:
+    if not isinstance(storage, LocalStorageBackend):
+        raise SystemExit("The sharded layout migration only applies to STORAGE_BACKEND=local")
+    await init_db()
+    return await migrate_layout(batch_size, pause, remove_delay)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move stored files into the sharded users_files layout")
+    parser.add_argument("--batch-size", type=int, default=FILE_MIGRATION_BATCH, help="Items per transaction")
+    parser.add_argument("--pause", type=float, default=0.0, help="Seconds to sleep between batches")
+    parser.add_argument("--remove-delay", type=float, default=FILE_MIGRATION_REMOVE_DELAY,
+                        help="Seconds the old names stay after the move, 0 when the services are stopped")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    print(asyncio.run(run(args.batch_size, args.pause, args.remove_delay)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+import argparse
+import asyncio
+import logging
+import os
+
+from dotenv import load_dotenv
+
+from files.file_manager import file_manager, PACK_MAX_BLOB_BYTES, PACK_COLD_DAYS
+from files.storage_backend import storage, LocalStorageBackend
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+PACK_MAINTENANCE_INTERVAL = float(os.getenv("PACK_MAINTENANCE_INTERVAL", 3600))
+PACK_COMPACT_RATIO = float(os.getenv("PACK_COMPACT_RATIO", 0.5))
+
+
+def run_maintenance(blocking: bool = False, max_blob_bytes: int = PACK_MAX_BLOB_BYTES,
+                    cold_days: float = PACK_COLD_DAYS, compact_ratio: float = PACK_COMPACT_RATIO) -> dict | None:
+    with file_manager.packs.writer(blocking) as acquired:
+        # Every API/bot process runs the loop, the lock lets only one of them work at a time.
+        if not acquired:
+            return None
+        archived = file_manager.archive_cold_files(max_blob_bytes, cold_days * 86400)
+        return {"archived": archived, **file_manager.packs.compact(compact_ratio)}
+
+
+async def maintenance_loop(interval: float = PACK_MAINTENANCE_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            stats = await asyncio.to_thread(run_maintenance)
+        except Exception as e:
+            logger.error(f"Pack maintenance failed: {e}")
+            continue
+        if stats:
+            logger.info(f"Pack maintenance: {stats}")
+
+
+def start_maintenance(interval: float = PACK_MAINTENANCE_INTERVAL):
+    # Object storage has no inodes to save, packs are a local disk tier only.
+    if interval <= 0 or not isinstance(storage, LocalStorageBackend):
+        return None
+    return asyncio.create_task(maintenance_loop(interval))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pack cold small files and compact pack files")
+    parser.add_argument("--max-blob-bytes", type=int, default=PACK_MAX_BLOB_BYTES)
+    parser.add_argument("--cold-days", type=float, default=PACK_COLD_DAYS,
+                        help="Only files not written for this many days are packed")
+    parser.add_argument("--compact-ratio", type=float, default=PACK_COMPACT_RATIO,
+                        help="Rewrite packs whose live data is below this share of their size")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    print(run_maintenance(True, args.max_blob_bytes, args.cold_days, args.compact_ratio))
+
+
+if __name__ == "__main__":
+    main()
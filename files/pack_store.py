@@ -0,0 +1,197 @@
+import fcntl
+import logging
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+from utils.metrics import registry
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+PACK_MAX_BYTES = int(os.getenv("PACK_MAX_BYTES", 256 * 1024 * 1024))
+COMPACT_BATCH = 1024
+
+pack_blobs_total = registry.counter(
+    "pintag_pack_blobs_total", "Blobs written to, read from and dropped from pack files", ("operation",)
+)
+
+
+class PackStore:
+    def __init__(self, path: Path, max_pack_bytes: int = PACK_MAX_BYTES):
+        self.path = Path(path)
+        self.max_pack_bytes = max_pack_bytes
+        self.local = threading.local()
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.connection().executescript("""
+            CREATE TABLE IF NOT EXISTS packs (id INTEGER PRIMARY KEY, size INTEGER NOT NULL DEFAULT 0);
+            CREATE TABLE IF NOT EXISTS blobs (
+                path TEXT PRIMARY KEY, pack INTEGER NOT NULL, offset INTEGER NOT NULL, length INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS ix_blobs_pack ON blobs (pack);
+        """)
+
+
+    def connection(self) -> sqlite3.Connection:
+        # sqlite connections may neither be shared between threads nor survive a fork.
+        if getattr(self.local, "pid", None) != os.getpid():
+            connection = sqlite3.connect(self.path / "index.sqlite3", timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+        return self.local.connection
+
+
+    def pack_file(self, pack_id: int) -> Path:
+        return self.path / f"pack-{pack_id:06d}.pack"
+
+
+    @contextmanager
+    def writer(self, blocking: bool = True):
+        # Appends and compaction run in one process at a time, readers and deletes never wait for it.
+        with open(self.path / "writer.lock", "wb") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+    def writable_pack(self) -> int:
+        row = self.connection().execute("SELECT id, size FROM packs ORDER BY id DESC LIMIT 1").fetchone()
+        if row is not None and row[1] < self.max_pack_bytes:
+            return row[0]
+        return self.connection().execute("INSERT INTO packs (size) VALUES (0)").lastrowid
+
+
+    def append(self, blobs: list[tuple[str, bytes]], expected: dict[str, tuple[int, int]] = None) -> list[str]:
+        # Must be called inside writer(). With expected, a row is only moved if it still points to the
+        # location the data was copied from, so concurrent deletes and relinks win over compaction.
+        if not blobs:
+            return []
+        pack_id = self.writable_pack()
+        rows = []
+        with open(self.pack_file(pack_id), "ab") as f:
+            offset = f.seek(0, os.SEEK_END)
+            for path, data in blobs:
+                f.write(data)
+                rows.append((path, pack_id, offset, len(data)))
+                offset += len(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+        connection = self.connection()
+        written = []
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            for path, pack, row_offset, length in rows:
+                if expected is None:
+                    connection.execute("INSERT OR REPLACE INTO blobs VALUES (?, ?, ?, ?)",
+                                       (path, pack, row_offset, length))
+                elif not connection.execute(
+                        "UPDATE blobs SET pack = ?, offset = ? WHERE path = ? AND pack = ? AND offset = ?",
+                        (pack, row_offset, path, *expected[path])).rowcount:
+                    continue
+                written.append(path)
+            connection.execute("UPDATE packs SET size = ? WHERE id = ?", (offset, pack_id))
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        pack_blobs_total.inc(len(written), operation="compacted" if expected else "archived")
+        return written
+
+
+    def locate(self, path: str) -> tuple[int, int, int] | None:
+        return self.connection().execute(
+            "SELECT pack, offset, length FROM blobs WHERE path = ?", (path,)
+        ).fetchone()
+
+
+    def read(self, path: str, start: int = 0, length: int = None) -> bytes | None:
+        for _ in range(2):
+            location = self.locate(path)
+            if location is None:
+                return None
+            pack_id, offset, blob_length = location
+            skip = min(start, blob_length)
+            size = blob_length - skip if length is None else min(length, blob_length - skip)
+            try:
+                fd = os.open(self.pack_file(pack_id), os.O_RDONLY)
+            except FileNotFoundError:
+                # Compaction moved the blob between the lookup and the open, the second lookup finds it.
+                continue
+            try:
+                pack_blobs_total.inc(operation="read")
+                return os.pread(fd, size, offset + skip)
+            finally:
+                os.close(fd)
+        return None
+
+
+    def length(self, path: str) -> int | None:
+        location = self.locate(path)
+        return location[2] if location else None
+
+
+    def paths_with_prefix(self, prefix: str) -> list[str]:
+        # A range scan on the primary key, LIKE would need every "%" and "_" in file names escaped.
+        rows = self.connection().execute(
+            "SELECT path FROM blobs WHERE path >= ? AND path < ?", (prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1))
+        )
+        return [row[0] for row in rows]
+
+
+    def discard(self, path: str) -> bool:
+        removed = self.connection().execute("DELETE FROM blobs WHERE path = ?", (path,)).rowcount > 0
+        if removed:
+            pack_blobs_total.inc(operation="discarded")
+        return removed
+
+
+    def link(self, path: str, new_path: str) -> bool:
+        return self.connection().execute(
+            "INSERT INTO blobs SELECT ?, pack, offset, length FROM blobs WHERE path = ?", (new_path, path)
+        ).rowcount > 0
+
+
+    def compact(self, min_live_ratio: float) -> dict:
+        stats = {"packs": 0, "moved": 0, "reclaimed_bytes": 0}
+        connection = self.connection()
+        writable = self.writable_pack()
+        candidates = connection.execute("""
+            SELECT packs.id, packs.size, COALESCE(SUM(blobs.length), 0) FROM packs
+            LEFT JOIN blobs ON blobs.pack = packs.id
+            WHERE packs.id != ? GROUP BY packs.id
+        """, (writable,)).fetchall()
+
+        for pack_id, size, live in candidates:
+            if size and live / size >= min_live_ratio:
+                continue
+            rows = connection.execute("SELECT path, offset, length FROM blobs WHERE pack = ?", (pack_id,)).fetchall()
+            with open(self.pack_file(pack_id), "rb") as f:
+                for start in range(0, len(rows), COMPACT_BATCH):
+                    batch = rows[start:start + COMPACT_BATCH]
+                    blobs = [(path, os.pread(f.fileno(), length, offset)) for path, offset, length in batch]
+                    stats["moved"] += len(self.append(
+                        blobs, expected={path: (pack_id, offset) for path, offset, _ in batch}
+                    ))
+
+            # A relink made while the pack was being copied keeps it alive until the next run.
+            if connection.execute("SELECT 1 FROM blobs WHERE pack = ? LIMIT 1", (pack_id,)).fetchone():
+                continue
+            connection.execute("DELETE FROM packs WHERE id = ?", (pack_id,))
+            self.pack_file(pack_id).unlink(missing_ok=True)
+            stats["packs"] += 1
+            stats["reclaimed_bytes"] += size - live
+        return stats
@@ -0,0 +1,341 @@
+import abc
+import asyncio
+import contextlib
+import logging
+import os
+import uuid
+from pathlib import Path
+from typing import AsyncIterator
+
+from dotenv import load_dotenv
+
+from files.file_manager import file_manager
+from utils.metrics import registry
+
+try:
+    import boto3
+    from botocore.config import Config
+    from botocore.exceptions import ClientError
+except ImportError:
+    boto3 = None
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local").lower()
+S3_BUCKET = os.getenv("S3_BUCKET", "pintag")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL")
+S3_REGION = os.getenv("S3_REGION", "us-east-1")
+S3_MAX_CONNECTIONS = int(os.getenv("S3_MAX_CONNECTIONS", 32))
+S3_MULTIPART_THRESHOLD = int(os.getenv("S3_MULTIPART_THRESHOLD", 16 * 1024 * 1024))
+S3_MULTIPART_CHUNK = max(int(os.getenv("S3_MULTIPART_CHUNK", 8 * 1024 * 1024)), 5 * 1024 * 1024)
+STREAM_CHUNK = 1024 * 1024
+
+storage_requests_total = registry.counter(
+    "pintag_storage_requests_total", "Storage backend operations", ("backend", "operation")
+)
+
+
+class StorageBackend(abc.ABC):
+    name = "base"
+
+    def __init__(self):
+        # One listener list for every backend, so the decrypted-file cache hears about all writes.
+        self.change_listeners = file_manager.change_listeners
+
+
+    @abc.abstractmethod
+    async def put(self, key: str, data: bytes):
+        ...
+
+
+    @abc.abstractmethod
+    async def put_stream(self, key: str, chunks: AsyncIterator[bytes]):
+        ...
+
+
+    @abc.abstractmethod
+    async def get(self, key: str) -> bytes:
+        ...
+
+
+    @abc.abstractmethod
+    async def get_range(self, key: str, start: int, length: int) -> bytes:
+        ...
+
+
+    async def stream(self, key: str, chunk_size: int = STREAM_CHUNK) -> AsyncIterator[bytes]:
+        stat = await self.stat(key)
+        if stat is None:
+            raise FileNotFoundError(f"File not found: {key}")
+        for start in range(0, stat[0], chunk_size):
+            yield await self.get_range(key, start, chunk_size)
+
+
+    @abc.abstractmethod
+    async def delete(self, key: str):
+        ...
+
+
+    @abc.abstractmethod
+    async def stat(self, key: str) -> tuple[int, float] | None:
+        ...
+
+
+    @abc.abstractmethod
+    async def list_keys(self, prefix: str) -> list[str]:
+        ...
+
+
+    def notify_change(self, key: str):
+        for listener in self.change_listeners:
+            listener(key)
+
+
+    async def save_file(self, file_data: bytes, user_id: int, file_type: str, original_filename: str = None) -> str:
+        key = file_manager.new_file_key(user_id, file_type, original_filename)
+        await self.put(key, file_data)
+        return key
+
+
+    async def save_variant(self, file_data: bytes, key: str, variant: str) -> str:
+        variant_key = file_manager.variant_path(key, variant)
+        await self.put(variant_key, file_data)
+        return variant_key
+
+
+    async def variant_paths(self, key: str) -> list[str]:
+        return [path for path in await self.list_keys(key + ".") if path.endswith(".jpg")]
+
+
+    async def delete_file(self, key: str):
+        variants = await self.variant_paths(key)
+        await self.delete(key)
+        for variant in variants:
+            await self.delete(variant)
+
+
+    async def exists(self, key: str) -> bool:
+        return await self.stat(key) is not None
+
+
+    async def get_file_size(self, key: str) -> int:
+        stat = await self.stat(key)
+        if stat is None:
+            raise FileNotFoundError(f"File not found: {key}")
+        return stat[0]
+
+
+class LocalStorageBackend(StorageBackend):
+    name = "local"
+
+    def __init__(self, manager=file_manager):
+        super().__init__()
+        self.manager = manager
+
+
+    async def put(self, key: str, data: bytes):
+        storage_requests_total.inc(backend=self.name, operation="put")
+        await asyncio.to_thread(self.manager.write_file, Path(key), data)
+
+
+    async def put_stream(self, key: str, chunks: AsyncIterator[bytes]):
+        storage_requests_total.inc(backend=self.name, operation="put")
+        path = self.manager.ensure_folder(Path(key).parent) / Path(key).name
+        # Same temporary name and rename as FileManager.write_file, readers never see a partial upload.
+        temp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex[:8]}.tmp")
+        f = await asyncio.to_thread(open, temp_path, "xb")
+        try:
+            try:
+                async for chunk in chunks:
+                    await asyncio.to_thread(f.write, chunk)
+            finally:
+                await asyncio.to_thread(f.close)
+            await asyncio.to_thread(os.replace, temp_path, path)
+        except BaseException:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(temp_path)
+            raise
+        self.manager.packs.discard(str(path))
+        self.manager.notify_change(key)
+
+
+    async def get(self, key: str) -> bytes:
+        storage_requests_total.inc(backend=self.name, operation="get")
+        return await asyncio.to_thread(self.manager.get_file, key)
+
+
+    async def get_range(self, key: str, start: int, length: int) -> bytes:
+        storage_requests_total.inc(backend=self.name, operation="get_range")
+        return await asyncio.to_thread(self.manager.get_range, key, start, length)
+
+
+    async def delete(self, key: str):
+        storage_requests_total.inc(backend=self.name, operation="delete")
+        await asyncio.to_thread(self.manager.remove, key)
+
+
+    async def stat(self, key: str) -> tuple[int, float] | None:
+        return await asyncio.to_thread(self.manager.stat, key)
+
+
+    async def list_keys(self, prefix: str) -> list[str]:
+        return await asyncio.to_thread(self.manager.list_paths, prefix)
+
+
+    async def save_file(self, file_data: bytes, user_id: int, file_type: str, original_filename: str = None) -> str:
+        # Keeps the exclusive create of FileManager.save_file.
+        storage_requests_total.inc(backend=self.name, operation="put")
+        return await asyncio.to_thread(self.manager.save_file, file_data, user_id, file_type, original_filename)
+
+
+    async def delete_file(self, key: str):
+        storage_requests_total.inc(backend=self.name, operation="delete")
+        await asyncio.to_thread(self.manager.delete_file, key)
+
+
+class S3StorageBackend(StorageBackend):
+    name = "s3"
+
+    def __init__(self, bucket: str = S3_BUCKET, endpoint_url: str = S3_ENDPOINT_URL, region: str = S3_REGION,
+                 max_connections: int = S3_MAX_CONNECTIONS, multipart_threshold: int = S3_MULTIPART_THRESHOLD,
+                 multipart_chunk: int = S3_MULTIPART_CHUNK):
+        if boto3 is None:
+            raise RuntimeError("STORAGE_BACKEND=s3 requires the 'boto3' package")
+        super().__init__()
+        self.bucket = bucket
+        self.endpoint_url = endpoint_url
+        self.region = region
+        self.max_connections = max_connections
+        self.multipart_threshold = multipart_threshold
+        self.multipart_chunk = multipart_chunk
+        self.client = None
+        self.pid = None
+
+
+    def connection(self):
+        # The client keeps a pool of up to max_connections keep-alive connections shared by all threads;
+        # pools must not cross a fork, so every worker process builds its own.
+        if self.pid != os.getpid():
+            self.client = boto3.session.Session().client(
+                "s3",
+                endpoint_url=self.endpoint_url,
+                region_name=self.region,
+                config=Config(max_pool_connections=self.max_connections, retries={"mode": "standard"}),
+            )
+            self.pid = os.getpid()
+        return self.client
+
+
+    async def call(self, operation: str, **kwargs):
+        storage_requests_total.inc(backend=self.name, operation=operation)
+        try:
+            return await asyncio.to_thread(getattr(self.connection(), operation), Bucket=self.bucket, **kwargs)
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("NoSuchKey", "404", "NotFound"):
+                raise FileNotFoundError(f"File not found: {kwargs.get('Key')}") from e
+            raise
+
+
+    async def put(self, key: str, data: bytes):
+        if len(data) >= self.multipart_threshold:
+            view = memoryview(data)
+
+            async def parts():
+                for start in range(0, len(view), self.multipart_chunk):
+                    yield bytes(view[start:start + self.multipart_chunk])
+
+            await self.put_stream(key, parts())
+            return
+        await self.call("put_object", Key=key, Body=data)
+        self.notify_change(key)
+
+
+    async def put_stream(self, key: str, chunks: AsyncIterator[bytes]):
+        upload_id = None
+        parts = []
+        buffer = bytearray()
+        try:
+            async for chunk in chunks:
+                buffer += chunk
+                while len(buffer) >= self.multipart_chunk:
+                    if upload_id is None:
+                        upload_id = (await self.call("create_multipart_upload", Key=key))["UploadId"]
+                    part, buffer = bytes(buffer[:self.multipart_chunk]), buffer[self.multipart_chunk:]
+                    response = await self.call("upload_part", Key=key, UploadId=upload_id,
+                                               PartNumber=len(parts) + 1, Body=part)
+                    parts.append({"ETag": response["ETag"], "PartNumber": len(parts) + 1})
+
+            if upload_id is None:
+                await self.call("put_object", Key=key, Body=bytes(buffer))
+                return
+            if buffer:
+                response = await self.call("upload_part", Key=key, UploadId=upload_id,
+                                           PartNumber=len(parts) + 1, Body=bytes(buffer))
+                parts.append({"ETag": response["ETag"], "PartNumber": len(parts) + 1})
+            await self.call("complete_multipart_upload", Key=key, UploadId=upload_id,
+                            MultipartUpload={"Parts": parts})
+        except BaseException:
+            # An abandoned multipart upload keeps its parts billed until it is aborted.
+            if upload_id is not None:
+                await self.call("abort_multipart_upload", Key=key, UploadId=upload_id)
+            raise
+        finally:
+            self.notify_change(key)
+
+
+    async def get(self, key: str) -> bytes:
+        response = await self.call("get_object", Key=key)
+        return await asyncio.to_thread(response["Body"].read)
+
+
+    async def get_range(self, key: str, start: int, length: int) -> bytes:
+        response = await self.call("get_object", Key=key, Range=f"bytes={start}-{start + length - 1}")
+        return await asyncio.to_thread(response["Body"].read)
+
+
+    async def stream(self, key: str, chunk_size: int = STREAM_CHUNK) -> AsyncIterator[bytes]:
+        body = (await self.call("get_object", Key=key))["Body"]
+        try:
+            while chunk := await asyncio.to_thread(body.read, chunk_size):
+                yield chunk
+        finally:
+            body.close()
+
+
+    async def delete(self, key: str):
+        await self.call("delete_object", Key=key)
+        self.notify_change(key)
+
+
+    async def stat(self, key: str) -> tuple[int, float] | None:
+        try:
+            response = await self.call("head_object", Key=key)
+        except FileNotFoundError:
+            return None
+        return response["ContentLength"], response["LastModified"].timestamp()
+
+
+    async def list_keys(self, prefix: str) -> list[str]:
+        keys = []
+        token = {}
+        while True:
+            response = await self.call("list_objects_v2", Prefix=prefix, **token)
+            keys.extend(entry["Key"] for entry in response.get("Contents", []))
+            if not response.get("IsTruncated"):
+                return keys
+            token = {"ContinuationToken": response["NextContinuationToken"]}
+
+
+def configure_storage(name: str = STORAGE_BACKEND, **kwargs) -> StorageBackend:
+    global storage
+    if name == "s3":
+        storage = S3StorageBackend(**kwargs)
+        logger.info(f"Files stored in bucket {storage.bucket} at {storage.endpoint_url or 'AWS S3'}")
+    else:
+        storage = LocalStorageBackend(**kwargs)
+    return storage
+
+
+storage = configure_storage()
@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+from dotenv import load_dotenv
+
+from files.encryption_manager import encryption_manager
+from files.storage_backend import storage
+from files.user_keys import user_keys
+from utils.metrics import registry
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_WORKERS = int(os.getenv("THUMBNAIL_WORKERS", 2))
+THUMBNAIL_QUALITY = int(os.getenv("THUMBNAIL_QUALITY", 80))
+VARIANTS = {"thumb": 320, "preview": 1280}
+FFMPEG = shutil.which("ffmpeg")
+
+thumbnails_total = registry.counter(
+    "pintag_thumbnails_total", "Thumbnail and preview generation attempts", ("content_type", "outcome")
+)
+
+executor = None
+executor_pid = None
+pending_tasks = set()
+
+
+def can_render(content_type: str) -> bool:
+    if Image is None:
+        return False
+    return content_type == "photo" or (content_type == "video" and FFMPEG is not None)
+
+
+def video_frame(data: bytes) -> bytes:
+    with tempfile.NamedTemporaryFile(suffix=".mp4") as video:
+        video.write(data)
+        video.flush()
+        for offset in ("1", "0"):
+            frame = subprocess.run(
+                [FFMPEG, "-loglevel", "error", "-ss", offset, "-i", video.name, "-frames:v", "1",
+                 "-f", "image2pipe", "-vcodec", "png", "-"],
+                capture_output=True, timeout=30,
+            ).stdout
+            if frame:
+                return frame
+    raise ValueError("ffmpeg could not extract a frame")
+
+
+def render_variants(data: bytes, content_type: str) -> dict[str, bytes]:
+    if content_type == "video":
+        data = video_frame(data)
+
+    results = {}
+    with Image.open(BytesIO(data)) as image:
+        largest = max(VARIANTS.values())
+        # Lets the JPEG decoder skip detail the largest variant would throw away anyway.
+        image.draft("RGB", (largest, largest))
+        image = ImageOps.exif_transpose(image).convert("RGB")
+        for variant, size in sorted(VARIANTS.items(), key=lambda variant: -variant[1]):
+            image.thumbnail((size, size))
+            output = BytesIO()
+            image.save(output, "JPEG", quality=THUMBNAIL_QUALITY, optimize=True)
+            results[variant] = output.getvalue()
+    return results
+
+
+def get_executor() -> ProcessPoolExecutor:
+    global executor, executor_pid
+    # A pool inherited through fork has no live workers, so each process starts its own.
+    if executor is None or executor_pid != os.getpid():
+        executor = ProcessPoolExecutor(max_workers=THUMBNAIL_WORKERS)
+        executor_pid = os.getpid()
+    return executor
+
+
+async def create_variants(user_id: int, file_path: str, data: bytes, content_type: str) -> dict[str, str]:
+    if not can_render(content_type):
+        return {}
+
+    try:
+        rendered = await asyncio.get_running_loop().run_in_executor(
+            get_executor(), render_variants, data, content_type
+        )
+    except Exception as e:
+        thumbnails_total.inc(content_type=content_type, outcome="error")
+        logger.warning(f"Could not render variants for {file_path}: {e}")
+        return {}
+
+    paths = {}
+    data_key = await user_keys.for_writing(user_id)
+    for variant, image in rendered.items():
+        encrypted_data = await asyncio.to_thread(encryption_manager.encrypt_file, image, data_key=data_key)
+        paths[variant] = await storage.save_variant(encrypted_data, file_path, variant)
+    thumbnails_total.inc(content_type=content_type, outcome="created")
+    return paths
+
+
+def schedule_variants(user_id: int, file_path: str, data: bytes, content_type: str):
+    # Ingest does not wait for thumbnails, a request that arrives first renders them itself.
+    if not can_render(content_type):
+        return
+    task = asyncio.create_task(create_variants(user_id, file_path, data, content_type))
+    pending_tasks.add(task)
+    task.add_done_callback(pending_tasks.discard)
@@ -0,0 +1,129 @@
+import argparse
+import asyncio
+import contextlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from cryptography.fernet import Fernet
+from dotenv import load_dotenv
+
+from database.database import init_db
+from database.database_worker import get_user_key, create_user_key, delete_users
+from files.encryption_manager import encryption_manager, uses_data_key, FileKey
+from files.storage_backend import storage
+from utils.metrics import registry
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+USER_DATA_KEYS = os.getenv("USER_DATA_KEYS", "true").lower() in ("1", "true", "yes")
+USER_KEY_CACHE_SIZE = int(os.getenv("USER_KEY_CACHE_SIZE", 10_000))
+USER_KEY_CACHE_TTL = float(os.getenv("USER_KEY_CACHE_TTL", 60))
+
+user_key_requests_total = registry.counter(
+    "pintag_user_key_requests_total", "User data key lookups", ("result",)
+)
+
+
+class UserKeyCache:
+    def __init__(self, max_entries: int = USER_KEY_CACHE_SIZE, ttl: float = USER_KEY_CACHE_TTL):
+        # Unwrapped keys stay in memory for at most ttl seconds, which bounds how long another process
+        # can still read a user's files after their key was shredded.
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries: OrderedDict[int, tuple[float, FileKey]] = OrderedDict()
+        self.lock = threading.Lock()
+
+        registry.gauge("pintag_user_key_cache_entries", "Unwrapped user data keys held in memory").callback = \
+            lambda: len(self.entries)
+
+
+    async def get(self, user_id: int, create: bool = False) -> FileKey | None:
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is not None and entry[0] > time.monotonic():
+                self.entries.move_to_end(user_id)
+                user_key_requests_total.inc(result="hit")
+                return entry[1]
+
+        row = await get_user_key(user_id)
+        if row is None:
+            if not create:
+                user_key_requests_total.inc(result="missing")
+                return None
+            row = await create_user_key(user_id, *encryption_manager.wrap_key(Fernet.generate_key()))
+            user_key_requests_total.inc(result="created")
+        else:
+            user_key_requests_total.inc(result="miss")
+
+        data_key = FileKey(encryption_manager.unwrap_key(*row))
+        with self.lock:
+            self.entries[user_id] = (time.monotonic() + self.ttl, data_key)
+            self.entries.move_to_end(user_id)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return data_key
+
+
+    async def for_writing(self, user_id: int) -> FileKey | None:
+        # None keeps new files on the master key, as before per-user keys existed.
+        return await self.get(user_id, create=True) if USER_DATA_KEYS else None
+
+
+    async def for_reading(self, user_id: int, encrypted_data: bytes) -> FileKey | None:
+        if not uses_data_key(encrypted_data):
+            return None
+        data_key = await self.get(user_id)
+        if data_key is None:
+            raise FileNotFoundError(f"The data key of user {user_id} was deleted")
+        return data_key
+
+
+    def evict(self, user_id: int):
+        with self.lock:
+            self.entries.pop(user_id, None)
+
+
+    async def delete_users(self, user_ids: list[int]) -> int:
+        # Rows and keys go first, a crash halfway leaves unreachable files instead of items without files.
+        # Files on a data key are shredded with it and never read here. Files written before per-user keys,
+        # with USER_DATA_KEYS off or not encrypted at all stay readable, so those are deleted.
+        file_paths = await delete_users(user_ids)
+        for user_id in user_ids:
+            self.evict(user_id)
+        deleted = 0
+        for file_path in file_paths:
+            with contextlib.suppress(FileNotFoundError):
+                await storage.delete_file(file_path)
+                deleted += 1
+        return deleted
+
+
+user_keys = UserKeyCache()
+
+
+async def run(user_ids: list[int]) -> dict:
+    await init_db()
+    deleted_files = await user_keys.delete_users(user_ids)
+    logger.info(f"Deleted {len(user_ids)} users and their data keys, {deleted_files} files not on a data key "
+                f"were deleted and the rest is unreadable now")
+    return {"deleted_users": len(user_ids), "deleted_files": deleted_files}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Delete users together with their data keys, which leaves their files unreadable"
+    )
+    parser.add_argument("user_ids", type=int, nargs="+", help="Telegram ids of the users to delete")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    print(asyncio.run(run(args.user_ids)))
+
+
+if __name__ == "__main__":
+    main()
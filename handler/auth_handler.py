@@ -7,6 +7,7 @@ from telegram.constants import ParseMode
 from database.database_worker import (
     create_user_connection, get_user_connections, update_connection_status
 )
+from utils.send_scheduler import PRIORITY_NOTIFICATION
 
 logger = logging.getLogger(__name__)
 
@@ -52,7 +53,8 @@ async def send_connection_request(user_id: int, connect_id: str, client_name: st
             chat_id=user_id,
             text=message,
             reply_markup=reply_markup,
-            parse_mode=ParseMode.HTML
+            parse_mode=ParseMode.HTML,
+            rate_limit_args=PRIORITY_NOTIFICATION
         )
 
     except Exception as e:
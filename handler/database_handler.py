@@ -1,7 +1,8 @@
+import asyncio
 import logging
 import os
+import time
 from datetime import datetime
-from pathlib import Path
 
 from sqlalchemy.exc import SQLAlchemyError
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
@@ -12,17 +13,31 @@ from database.database import Item
 from database.database_worker import get_all_user_boards, get_board_by_name, update_board_name, create_new_board, \
     get_all_items_by_board_id, get_item_by_title, get_all_items_by_keyword, remove_item_by_id, move_item, \
     get_all_user_board_count, get_all_user_item_count, get_item_stats, create_new_item, get_board_by_id, get_item_by_id, \
-    get_board_item_count
+    get_board_item_count, get_user_boards_page, get_board_items_page, create_new_items
 
 from database.database_worker import remove_board_by_id
+from files.blob_cache import read_file
 from files.encryption_manager import encryption_manager
-from files.file_manager import file_manager
+from files.file_manager import file_manager, content_hash
+from files.storage_backend import storage
+from files.thumbnailer import schedule_variants
+from files.user_keys import user_keys
+from utils.user_cache import keyboard_cache
+from utils.rate_limiter import upload_limiter, OverloadedError
 
 logger = logging.getLogger(__name__)
 GET_TITLE, SELECT_BOARD = range(2)
 
 ALL_FILE_TYPES = ['photo', 'document', 'video']
 
+ALBUM_WINDOW_SECONDS = float(os.getenv("ALBUM_WINDOW_SECONDS", 1.0))
+
+album_timers: dict[str, asyncio.Task] = {}
+
+SHOW_PAGE_SIZE = 20
+BOARD_PAGE_SIZE = 8
+MAX_LISTED_TITLE_LENGTH = 150
+
 def extract_content_info(message):
     content_type = 'text'
     data = None
@@ -48,23 +63,56 @@ def extract_content_info(message):
     return content_type, data, title
 
 
-async def send_board_selection(update: Update, context: CallbackContext) -> int | None:
-    try:
-        user_id = update.effective_user.id
+def page_navigation(prefix: str, rows: list, has_previous: bool, has_next: bool) -> list:
+    buttons = []
+    if has_previous:
+        buttons.append(InlineKeyboardButton("⬅️ Назад", callback_data=f"{prefix}:p:{rows[0].id}"))
+    if has_next:
+        buttons.append(InlineKeyboardButton("Вперёд ➡️", callback_data=f"{prefix}:n:{rows[-1].id}"))
+    return buttons
 
-        boards = await get_all_user_boards(user_id)
 
-        keyboard = []
+def parse_page_cursor(data: str) -> tuple[int | None, int | None]:
+    direction, cursor_id = data.rsplit(":", 2)[-2:]
+    return (int(cursor_id), None) if direction == "n" else (None, int(cursor_id))
+
+
+async def board_selection_markup(user_id: int, after_id: int = None, before_id: int = None) -> InlineKeyboardMarkup:
+    cache_key = ("board_selection", after_id, before_id)
+    reply_markup = keyboard_cache.get(user_id, cache_key)
+    if reply_markup is not None:
+        return reply_markup
+
+    boards, has_more = await get_user_boards_page(user_id, BOARD_PAGE_SIZE, after_id, before_id)
+    if not boards and (after_id or before_id):
+        return await board_selection_markup(user_id)
+
+    keyboard = []
+
+    for board in boards:
+        callback_data = f"board:{board.id}"
+        button_text = f"{board.emoji} {board.name}"
+        keyboard.append([InlineKeyboardButton(button_text, callback_data=callback_data)])
 
-        for board in boards:
-            callback_data = f"board:{board.id}"
-            button_text = f"{board.emoji} {board.name}"
-            keyboard.append([InlineKeyboardButton(button_text, callback_data=callback_data)])
+    has_previous = has_more if before_id is not None else after_id is not None
+    has_next = has_more if before_id is None else True
+    navigation = page_navigation("boards_page", boards, has_previous, has_next)
+    if navigation:
+        keyboard.append(navigation)
 
-        keyboard.append([InlineKeyboardButton("➕ Создать новую доску", callback_data="create_new_board")])
-        keyboard.append([InlineKeyboardButton("❌ Отмена добавления", callback_data="cancel_add_item")])
+    keyboard.append([InlineKeyboardButton("➕ Создать новую доску", callback_data="create_new_board")])
+    keyboard.append([InlineKeyboardButton("❌ Отмена добавления", callback_data="cancel_add_item")])
 
-        reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    keyboard_cache.set(user_id, cache_key, reply_markup)
+    return reply_markup
+
+
+async def send_board_selection(update: Update, context: CallbackContext) -> int | None:
+    try:
+        user_id = update.effective_user.id
+
+        reply_markup = await board_selection_markup(user_id)
 
         await context.bot.send_message(
             chat_id = user_id,
@@ -165,6 +213,32 @@ async def create_new_board_command(update: Update, context: CallbackContext) ->
         await update.message.reply_text("Ошибка базы данных при создании доски")
 
 
+async def render_board_page(user_id: int, board, after_id: int = None,
+                            before_id: int = None) -> tuple[str, InlineKeyboardMarkup | None]:
+    items, has_more = await get_board_items_page(user_id, board.id, SHOW_PAGE_SIZE, after_id, before_id)
+    if not items and (after_id or before_id):
+        return await render_board_page(user_id, board)
+
+    if not items:
+        return f"Доска <b>{board.emoji} {board.name}</b> пуста.", None
+
+    item_list = "\n".join(
+        [f"• {item.title[:MAX_LISTED_TITLE_LENGTH]}{'…' if len(item.title) > MAX_LISTED_TITLE_LENGTH else ''}"
+         for item in items]
+    )
+
+    message = (
+        f"📦 <b>Элементы в доске {board.emoji} {board.name}</b>:\n\n"
+        f"{item_list}\n\n"
+        f"Чтобы получить элемент, используй: /view название"
+    )
+
+    has_previous = has_more if before_id is not None else after_id is not None
+    has_next = has_more if before_id is None else True
+    navigation = page_navigation(f"show:{board.id}", items, has_previous, has_next)
+    return message, InlineKeyboardMarkup([navigation]) if navigation else None
+
+
 async def show_command(update: Update, context: CallbackContext) -> None:
     user_id = update.effective_user.id
 
@@ -181,28 +255,33 @@ async def show_command(update: Update, context: CallbackContext) -> None:
                                             parse_mode=ParseMode.HTML)
             return
 
-        items = await get_all_items_by_board_id(user_id, board.id)
+        message, reply_markup = await render_board_page(user_id, board)
+        await update.message.reply_text(message, parse_mode=ParseMode.HTML, reply_markup=reply_markup)
 
-        if not items:
-            await update.message.reply_text(f"Доска <b>{board.emoji} {board.name}</b> пуста.",
-                                            parse_mode=ParseMode.HTML)
-            return
+    except SQLAlchemyError as sqlex:
+        logger.error(f"SQLAlchemy Error on /show command: {sqlex}")
+        await update.message.reply_text("Произошла ошибка базы данных при просмотре доски.")
 
-        item_list = "\n".join(
-            [f"• {item.title}" for item in items]
-        )
 
-        message = (
-            f"📦 <b>Элементы в доске {board.emoji} {board.name}</b>:\n\n"
-            f"{item_list}\n\n"
-            f"Чтобы получить элемент, используй: /view название"
-            f"Чтобы получить элемент, используй: /view название"
-        )
-        await update.message.reply_text(message, parse_mode=ParseMode.HTML)
+async def inline_show_page(update: Update, context: CallbackContext) -> None:
+    query = update.callback_query
+    try:
+        await query.answer()
+
+        user_id = query.from_user.id
+        board_id = int(query.data.split(":")[1])
+        after_id, before_id = parse_page_cursor(query.data)
+
+        board = await get_board_by_id(user_id, board_id)
+        if not board:
+            await query.edit_message_text("❌ Доска не найдена.")
+            return
 
+        message, reply_markup = await render_board_page(user_id, board, after_id, before_id)
+        await query.edit_message_text(message, parse_mode=ParseMode.HTML, reply_markup=reply_markup)
     except SQLAlchemyError as sqlex:
-        logger.error(f"SQLAlchemy Error on /show command: {sqlex}")
-        await update.message.reply_text("Произошла ошибка базы данных при просмотре доски.")
+        logger.error(f"SQLAlchemy Error on /show page: {sqlex}")
+        await query.edit_message_text("Произошла ошибка базы данных при просмотре доски.")
 
 
 async def view_command(update: Update, context: CallbackContext) -> None:
@@ -260,7 +339,7 @@ async def remove_command(update: Update, context: CallbackContext) -> None:
 
         if item.content_type in ALL_FILE_TYPES and item.file_path:
             try:
-                file_manager.delete_file(item.file_path)
+                await storage.delete_file(item.file_path)
                 print(f"Removed file: {item.file_path}")
             except Exception as e:
                 logger.error(f"Error deleting file {item.file_path}: {e}")
@@ -301,7 +380,7 @@ async def remove_board_command(update: Update, context: CallbackContext) -> None
         for item in items:
             if item.content_type in ALL_FILE_TYPES and item.file_path:
                 try:
-                    file_manager.delete_file(item.file_path)
+                    await storage.delete_file(item.file_path)
                 except FileNotFoundError:
                     logger.warning(f"File not found: {item.file_path}")
                 except Exception as e:
@@ -403,6 +482,29 @@ async def stats_command(update: Update, context: CallbackContext) -> None:
         await update.message.reply_text("Ошибка базы данных при обработке статистики")
 
 
+def original_filename_for(message, content_type: str) -> str:
+    if content_type == 'document':
+        return message.document.file_name
+    file_extension = '.jpg' if content_type == 'photo' else '.mp4'
+    return f"{content_type}_{int(datetime.now().timestamp())}_{message.message_id}{file_extension}"
+
+
+async def download_and_store(context: CallbackContext, user_id: int, content_type: str, file_id: str,
+                             original_filename: str) -> tuple[str, str, int, bool]:
+    file = await context.bot.get_file(file_id)
+    file_data = bytes(await file.download_as_bytearray())
+
+    async with upload_limiter:
+        file_hash = await asyncio.to_thread(content_hash, file_data)
+        data_key = await user_keys.for_writing(user_id)
+        encrypted_data = await asyncio.to_thread(
+            encryption_manager.encrypt_file, file_data, content_type, original_filename, data_key
+        )
+        file_path = await storage.save_file(encrypted_data, user_id, content_type + 's', original_filename)
+    schedule_variants(user_id, file_path, file_data, content_type)
+    return file_path, file_hash, len(encrypted_data), data_key is not None
+
+
 async def add_item_conservation(update: Update, context: CallbackContext) -> int:
     message = update.message
     user_id = update.effective_user.id
@@ -413,26 +515,23 @@ async def add_item_conservation(update: Update, context: CallbackContext) -> int
         await update.message.reply_text("Отправь мне ссылку, файл или медиа-контент для сохранения.")
         return ConversationHandler.END
 
+    if message.media_group_id and content_type in ALL_FILE_TYPES:
+        context.user_data["temp_item"] = {"media_group_id": message.media_group_id, "parts": [], "files": None}
+        return await collect_album_part(update, context)
+
     file_path = None
+    file_hash = None
+    file_size = 0
+    data_key = False
     if content_type in ALL_FILE_TYPES:
         try:
-            file = await context.bot.get_file(data)
-            file_data = await file.download_as_bytearray()
-
-            if content_type == 'document':
-                original_filename = message.document.file_name
-            else:
-                file_extension = '.jpg' if content_type == 'photo' else '.mp4'
-                original_filename = f"{content_type}_{int(datetime.now().timestamp())}{file_extension}"
-
-            encrypted_data = encryption_manager.encrypt_file(bytes(file_data))
-            file_path = file_manager.save_file(
-                encrypted_data,
-                user_id,
-                content_type + 's',
-                original_filename,
-            )
+            file_path, file_hash, file_size, data_key = await download_and_store(context, user_id, content_type, data,
+                                                 original_filename_for(message, content_type))
 
+        except OverloadedError:
+            logger.warning(f"Upload rejected for user {user_id}: server is overloaded")
+            await update.message.reply_text("⏳ Сервер сейчас перегружен, попробуй отправить файл чуть позже.")
+            return ConversationHandler.END
         except Exception as e:
             logger.error(f"Error saving file: {e}")
             await update.message.reply_text("❌ Ошибка при сохранении файла")
@@ -443,8 +542,10 @@ async def add_item_conservation(update: Update, context: CallbackContext) -> int
         "content_type": content_type,
         "content_data": data,
         "file_path": file_path,
-        "file_size": file_manager.get_file_size(file_path) if file_path else 0,
+        "file_size": file_size,
+        "content_hash": file_hash,
         "encrypted": True if is_file and file_path else False,
+        "data_key": data_key,
         "telegram_message_id": message.message_id,
     }
 
@@ -456,9 +557,96 @@ async def add_item_conservation(update: Update, context: CallbackContext) -> int
     return GET_TITLE
 
 
+async def collect_album_part(update: Update, context: CallbackContext) -> int:
+    message = update.message
+    album = context.user_data.get("temp_item")
+
+    if not album or album.get("media_group_id") != message.media_group_id or album.get("closed"):
+        await message.reply_text("Сначала придумай название для предыдущего элемента или используй /cancel.")
+        return GET_TITLE
+
+    content_type, data, _ = extract_content_info(message)
+    album["parts"].append((content_type, data, original_filename_for(message, content_type)))
+    album["last_part_at"] = time.monotonic()
+
+    # Telegram delivers album parts as separate updates, so one task waits until they stop arriving.
+    if message.media_group_id not in album_timers:
+        album_timers[message.media_group_id] = context.application.create_task(
+            finish_album(context, update.effective_user.id, message.chat_id, album),
+            update=update,
+            name=f"album:{message.media_group_id}",
+        )
+    return GET_TITLE
+
+
+async def finish_album(context: CallbackContext, user_id: int, chat_id: int, album: dict):
+    while (delay := album["last_part_at"] + ALBUM_WINDOW_SECONDS - time.monotonic()) > 0:
+        await asyncio.sleep(delay)
+    album["closed"] = True
+    album_timers.pop(album["media_group_id"], None)
+    if context.user_data.get("temp_item") is not album:
+        return
+
+    results = await asyncio.gather(
+        *(download_and_store(context, user_id, content_type, file_id, filename)
+          for content_type, file_id, filename in album["parts"]),
+        return_exceptions=True,
+    )
+
+    files = []
+    for (content_type, file_id, _), result in zip(album["parts"], results):
+        if isinstance(result, Exception):
+            logger.error(f"Error saving album file for user {user_id}: {result}")
+            continue
+        file_path, file_hash, file_size, data_key = result
+        files.append({
+            "content_type": content_type,
+            "content_data": file_id,
+            "file_path": file_path,
+            "file_size": file_size,
+            "content_hash": file_hash,
+            "encrypted": True,
+            "data_key": data_key,
+        })
+
+    if context.user_data.get("temp_item") is not album:
+        for file in files:
+            await storage.delete_file(file["file_path"])
+        return
+
+    if not files:
+        context.user_data.pop("temp_item", None)
+        await context.bot.send_message(chat_id, "❌ Ошибка при сохранении альбома")
+        return
+
+    album["files"] = files
+    skipped = len(album["parts"]) - len(files)
+    await context.bot.send_message(
+        chat_id,
+        f"✅ Отлично, я получил альбом из {len(files)} файлов"
+        f"{f' ({skipped} не удалось сохранить)' if skipped else ''}.\n\n"
+        f"<b>Шаг 1 из 2:</b> Придумай общее название, элементы будут пронумерованы.",
+        parse_mode=ParseMode.HTML,
+    )
+
+
 async def get_title(update: Update, context: CallbackContext) -> int:
     user_response = update.message.text
 
+    if "temp_item" not in context.user_data:
+        await update.message.reply_text("❌ Ошибка: данные устарели. Начни заново.")
+        return ConversationHandler.END
+
+    album = context.user_data["temp_item"]
+    if "parts" in album and album["files"] is None:
+        if album["media_group_id"] not in album_timers:
+            # The bot restarted before the album was stored, only the list of parts survived.
+            context.user_data.pop("temp_item", None)
+            await update.message.reply_text("❌ Альбом не успел сохраниться. Отправь его ещё раз.")
+            return ConversationHandler.END
+        await update.message.reply_text("⏳ Я ещё сохраняю альбом, подожди пару секунд.")
+        return GET_TITLE
+
     if user_response.startswith("/"):
         await update.message.reply_text("Название не может быть командой. Попробуй еще раз или используй /cancel.")
         return GET_TITLE
@@ -473,6 +661,40 @@ async def get_title(update: Update, context: CallbackContext) -> int:
     return await send_board_selection(update, context)
 
 
+async def discard_temp_item(context: CallbackContext):
+    item_data = context.user_data.pop("temp_item", None) or {}
+    for file in item_data.get("files") or [item_data]:
+        if file.get("file_path"):
+            try:
+                await storage.delete_file(file["file_path"])
+            except Exception as e:
+                logger.error(f"Error deleting file {file['file_path']}: {e}")
+
+
+async def save_temp_item(user_id: int, board_id: int, item_data: dict) -> str:
+    if not item_data.get("files"):
+        await create_new_item(
+            user_id=user_id,
+            board_id=board_id,
+            title=item_data["title"],
+            content_type=item_data["content_type"],
+            content_data=item_data["content_data"],
+            file_path=item_data["file_path"],
+            file_size=item_data["file_size"],
+            encrypted=item_data["encrypted"],
+            content_hash=item_data.get("content_hash"),
+            # None for conversations saved before the column existed, their files count as legacy ones.
+            data_key=item_data.get("data_key"),
+        )
+        return f"элемент <b>'{item_data['title']}'</b>"
+
+    files = item_data["files"]
+    await create_new_items(user_id, board_id, [
+        {**file, "title": f"{item_data['title']} {index}"} for index, file in enumerate(files, start=1)
+    ])
+    return f"{len(files)} элементов <b>'{item_data['title']}'</b>"
+
+
 async def inline_board_selection(update: Update, context: CallbackContext) -> int:
     try:
         query = update.callback_query
@@ -487,9 +709,13 @@ async def inline_board_selection(update: Update, context: CallbackContext) -> in
                 message_id=query.message.message_id,
                 text="❌ Добавление элемента отменено."
             )
-            context.user_data.pop("temp_item", None)
+            await discard_temp_item(context)
             return ConversationHandler.END
 
+        elif action.startswith("boards_page:"):
+            after_id, before_id = parse_page_cursor(action)
+            await query.edit_message_reply_markup(await board_selection_markup(user_id, after_id, before_id))
+            return SELECT_BOARD
 
         elif action == "create_new_board":
             current_time = datetime.now().strftime("%Y-%m-%d-%H-%M-%S")
@@ -508,21 +734,12 @@ async def inline_board_selection(update: Update, context: CallbackContext) -> in
                 board_id = new_board.id
                 item_data = context.user_data["temp_item"]
 
-                await create_new_item(
-                    user_id=user_id,
-                    board_id=board_id,
-                    title=item_data["title"],
-                    content_type=item_data["content_type"],
-                    content_data=item_data["content_data"],
-                    file_path=item_data["file_path"],
-                    file_size=item_data["file_size"],
-                    encrypted=item_data["encrypted"],
-                )
+                saved = await save_temp_item(user_id, board_id, item_data)
 
                 await context.bot.edit_message_text(
                     chat_id=user_id,
                     message_id=query.message.message_id,
-                    text=f"✅ Создана новая доска <b>{board_emoji} {board_name}</b> и элемент <b>'{item_data['title']}'</b> сохранен в неё!",
+                    text=f"✅ Создана новая доска <b>{board_emoji} {board_name}</b> и {saved} сохранено в неё!",
                     parse_mode=ParseMode.HTML
                 )
             except SQLAlchemyError as sqlex:
@@ -557,15 +774,7 @@ async def inline_board_selection(update: Update, context: CallbackContext) -> in
             item_data = context.user_data["temp_item"]
 
             try:
-                new_item = await create_new_item(user_id=user_id,
-                    board_id=board_id,
-                    title=item_data["title"],
-                    content_type=item_data["content_type"],
-                    content_data=item_data["content_data"],
-                    file_path=item_data["file_path"],
-                    file_size=item_data["file_size"],
-                    encrypted=item_data["encrypted"],
-                )
+                saved = await save_temp_item(user_id, board_id, item_data)
 
                 board = await get_board_by_id(user_id, board_id)
                 board_name = board.name if board else "Неизвестная доска"
@@ -573,7 +782,7 @@ async def inline_board_selection(update: Update, context: CallbackContext) -> in
                 await context.bot.edit_message_text(
                     chat_id=user_id,
                     message_id=query.message.message_id,
-                    text=f"✅ Элемент <b>'{item_data['title']}'</b> успешно сохранен в доску <b>{board_name}</b>!",
+                    text=f"✅ Сохранено в доску <b>{board_name}</b>: {saved}!",
                     parse_mode=ParseMode.HTML
                 )
 
@@ -654,13 +863,10 @@ async def send_item_content(update: Update, context: CallbackContext, item: Item
                     except Exception as e:
                         logger.warning(f"File_id failed, trying local file: {e}")
 
-                if item.file_path and os.path.exists(item.file_path):
-                    file_data = file_manager.get_file(item.file_path)
-
-                    if getattr(item, 'encrypted', False):
-                        file_data = encryption_manager.decrypt_file(file_data)
+                if item.file_path and await storage.exists(item.file_path):
+                    file_data = await read_file(item.user_id, item.file_path, getattr(item, 'encrypted', False))
 
-                    filename = Path(item.file_path).name
+                    filename = file_manager.display_name(item.file_path)
 
                     if item.content_type == 'photo':
                         await context.bot.send_photo(chat_id, file_data, caption=caption,
@@ -737,7 +943,7 @@ async def inline_board_item(update: Update, context: CallbackContext) -> None:
             item_name = item.title
             if item.content_type in ALL_FILE_TYPES and item.file_path:
                 try:
-                    file_manager.delete_file(item.file_path)
+                    await storage.delete_file(item.file_path)
                     print(f"Removed file: {item.file_path}")
                 except Exception as e:
                     logger.error(f"Error deleting file {item.file_path}: {e}")
@@ -781,6 +987,6 @@ async def cancel_add_item(update: Update, context: CallbackContext) -> int:
         await update.message.reply_text("❌ Нет активного процесса добавления для отмены.")
         return ConversationHandler.END
 
-    context.user_data.pop("temp_item", None)
+    await discard_temp_item(context)
     await update.message.reply_text("❌ Добавление элемента отменено.")
     return ConversationHandler.END
\ No newline at end of file
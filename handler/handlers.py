@@ -5,7 +5,9 @@ from telegram import Update, ReplyKeyboardMarkup, KeyboardButton
 from telegram.constants import ParseMode
 from telegram.ext import CallbackContext
 
-from database.database import get_db, User, Board
+from database.database import get_db, User, Board, bump_data_version
+from utils.cache import boards_cache
+from utils.user_cache import keyboard_cache
 
 logger = logging.getLogger(__name__)
 
@@ -37,7 +39,10 @@ async def start_command(update: Update, context: CallbackContext) -> None:
                     emoji=board_emoji
                 )
                 db.add(default_board)
+                await bump_data_version(db, user_id)
                 await db.commit()
+                keyboard_cache.invalidate(user_id)
+                await boards_cache.invalidate(user_id)
                 await db.refresh(default_board)
 
                 logger.info(f"Created new user: {user_id}")
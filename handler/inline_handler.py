@@ -0,0 +1,104 @@
+import logging
+import os
+import re
+
+from dotenv import load_dotenv
+from sqlalchemy.exc import SQLAlchemyError
+from telegram import Update, InlineQueryResultArticle, InlineQueryResultCachedPhoto, \
+    InlineQueryResultCachedDocument, InlineQueryResultCachedVideo, InputTextMessageContent
+from telegram.error import BadRequest
+from telegram.ext import CallbackContext
+
+from database.database_worker import search_items_by_title, title_matches
+from utils.user_cache import search_cache, user_cache_requests
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+INLINE_PAGE_SIZE = 20
+INLINE_MAX_RESULTS = 200
+INLINE_CACHE_TIME = int(os.getenv("INLINE_CACHE_TIME", 10))
+
+
+async def find_inline_items(user_id: int, query: str) -> list:
+    query = " ".join(query.lower().split())
+    items = search_cache.get(user_id, query)
+    if items is not None:
+        return items
+
+    # While the user keeps typing, a complete result set for a shorter prefix already contains every match.
+    tokens = re.findall(r"\w+", query)
+    for length in range(len(query) - 1, 0, -1):
+        cached = search_cache.get(user_id, query[:length], record=False)
+        if cached is not None and len(cached) < INLINE_MAX_RESULTS:
+            items = [item for item in cached if title_matches(item.title, tokens)]
+            user_cache_requests.inc(cache=search_cache.name, result="prefix_hit")
+            search_cache.set(user_id, query, items)
+            return items
+
+    items = list(await search_items_by_title(user_id, query, INLINE_MAX_RESULTS))
+    search_cache.set(user_id, query, items)
+    return items
+
+
+def article_result(item) -> InlineQueryResultArticle:
+    if item.content_type == "link" and item.content_data:
+        return InlineQueryResultArticle(
+            id=str(item.id),
+            title=item.title,
+            description=item.content_data,
+            input_message_content=InputTextMessageContent(f"{item.title}\n{item.content_data}"),
+        )
+
+    return InlineQueryResultArticle(
+        id=str(item.id),
+        title=item.title,
+        description=item.content_type,
+        input_message_content=InputTextMessageContent(item.title),
+    )
+
+
+def inline_result(item):
+    # Media saved through the bot keeps Telegram's file_id in content_data, so nothing is re-uploaded.
+    file_id = item.content_data
+    if not file_id or " " in file_id:
+        return article_result(item)
+
+    if item.content_type == "photo":
+        return InlineQueryResultCachedPhoto(id=str(item.id), photo_file_id=file_id, title=item.title,
+                                            caption=item.title)
+    if item.content_type == "document":
+        return InlineQueryResultCachedDocument(id=str(item.id), document_file_id=file_id, title=item.title,
+                                               caption=item.title)
+    if item.content_type == "video":
+        return InlineQueryResultCachedVideo(id=str(item.id), video_file_id=file_id, title=item.title,
+                                            caption=item.title)
+    return article_result(item)
+
+
+async def inline_search(update: Update, context: CallbackContext) -> None:
+    query = update.inline_query
+    user_id = query.from_user.id
+
+    if not query.query.strip():
+        await query.answer([], cache_time=INLINE_CACHE_TIME, is_personal=True)
+        return
+
+    try:
+        items = await find_inline_items(user_id, query.query)
+    except SQLAlchemyError as sqlex:
+        logger.error(f"SQLAlchemy Error on inline query: {sqlex}")
+        return
+
+    offset = int(query.offset) if query.offset.isdigit() else 0
+    page = items[offset:offset + INLINE_PAGE_SIZE]
+    next_offset = str(offset + INLINE_PAGE_SIZE) if offset + INLINE_PAGE_SIZE < len(items) else ""
+
+    try:
+        await query.answer([inline_result(item) for item in page], cache_time=INLINE_CACHE_TIME,
+                           is_personal=True, next_offset=next_offset)
+    except BadRequest as e:
+        logger.warning(f"Inline answer with cached media rejected, sending articles only: {e}")
+        await query.answer([article_result(item) for item in page], cache_time=INLINE_CACHE_TIME,
+                           is_personal=True, next_offset=next_offset)
@@ -0,0 +1,42 @@
+import logging
+import time
+
+from telegram import Update
+from telegram.ext import CallbackContext, ApplicationHandlerStop, filters
+
+from utils.rate_limiter import bot_limiters
+
+logger = logging.getLogger(__name__)
+
+THROTTLE_NOTICE_INTERVAL = 30
+
+
+class ThrottledUserFilter(filters.UpdateFilter):
+    def filter(self, update: Update) -> bool:
+        if not update.effective_user:
+            return False
+
+        message = update.effective_message
+        is_media = bool(message and (message.photo or message.document or message.video))
+        limiter = bot_limiters["media" if is_media else "message"]
+
+        retry_after = limiter.hit(f"user:{update.effective_user.id}")
+        if retry_after:
+            logger.warning(f"User {update.effective_user.id} throttled for {retry_after:.1f}s")
+            return True
+        return False
+
+
+throttled_user = ThrottledUserFilter(name="ThrottledUserFilter")
+
+
+async def drop_throttled_update(update: Update, context: CallbackContext) -> None:
+    last_notice = context.user_data.get("throttle_notice_at", 0)
+
+    if update.effective_message and time.monotonic() - last_notice > THROTTLE_NOTICE_INTERVAL:
+        context.user_data["throttle_notice_at"] = time.monotonic()
+        await update.effective_message.reply_text(
+            "⏳ Слишком много сообщений. Подожди немного и попробуй снова."
+        )
+
+    raise ApplicationHandlerStop
@@ -1,17 +1,41 @@
 import argparse
 import logging
+import multiprocessing
 import os
+import queue
+import signal
+import socket
+import sys
+import time
 import uvicorn
 import asyncio
 from dotenv import load_dotenv
+from telegram import Bot, Update
+from telegram.ext import Updater
 
-from bot_core import build_bot_application, start_polling_bot
+import api.main
+from bot_core import build_bot_application, start_polling_bot, start_webhook_bot, stop_webhook_bot
 from api.main import app as fastapi_app
+from database.database import init_db, engine
+from files.pack_maintenance import start_maintenance
+from utils import shared_store, cache
+from utils.metrics import start_metrics_server
+from utils.rate_limiter import upload_limiter
+from utils.user_cache import keyboard_cache, search_cache
+from utils.sharding import UpdateRouter
 
 load_dotenv()
 TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+TELEGRAM_FILE_URL = os.getenv("TELEGRAM_FILE_URL")
+WEBHOOK_URL = os.getenv("TELEGRAM_WEBHOOK_URL")
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("TELEGRAM_WEBHOOK_MAX_CONNECTIONS", 40))
 API_HOST = os.getenv("API_HOST", "0.0.0.0")
 API_PORT = int(os.getenv("API_PORT", 8000))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 9100))
+WORKERS = int(os.getenv("WORKERS", os.cpu_count() or 1))
+SHARED_STORE_PATH = os.getenv("SHARED_STORE_PATH", "pintag_shared.db")
 
 logger = logging.getLogger()
 
@@ -35,7 +59,8 @@ async def run_both_services_async():
         logger.error("ERROR: TELEGRAM_BOT_TOKEN not found.")
         return
 
-    application = build_bot_application(TOKEN)
+    application = build_bot_application(TOKEN, TELEGRAM_API_URL, TELEGRAM_FILE_URL)
+    api.main.bot_application = application
 
     bot_task = asyncio.create_task(start_polling_bot(application))
     api_task = asyncio.create_task(start_api_server_async())
@@ -47,17 +72,193 @@ async def start_bot_only_async():
     if not TOKEN:
         raise ValueError("TELEGRAM_BOT_TOKEN not found.")
 
-    application = build_bot_application(TOKEN)
-    await start_polling_bot(application)
+    application = build_bot_application(TOKEN, TELEGRAM_API_URL, TELEGRAM_FILE_URL)
+    metrics_server = await start_metrics_server(METRICS_HOST, METRICS_PORT)
+    maintenance = start_maintenance()
+    try:
+        await start_polling_bot(application)
+    finally:
+        metrics_server.close()
+        if maintenance is not None:
+            maintenance.cancel()
+
+
+async def run_webhook_async():
+    if not TOKEN:
+        raise ValueError("TELEGRAM_BOT_TOKEN not found.")
+    if not WEBHOOK_URL or not api.main.WEBHOOK_SECRET:
+        raise ValueError("TELEGRAM_WEBHOOK_URL and TELEGRAM_WEBHOOK_SECRET are required for webhook mode.")
+
+    application = build_bot_application(TOKEN, TELEGRAM_API_URL, TELEGRAM_FILE_URL)
+    api.main.bot_application = application
+
+    await start_webhook_bot(
+        application,
+        WEBHOOK_URL.rstrip("/") + api.main.WEBHOOK_PATH,
+        api.main.WEBHOOK_SECRET,
+        WEBHOOK_MAX_CONNECTIONS,
+    )
+    try:
+        await start_api_server_async()
+    finally:
+        await stop_webhook_bot(application)
+
+
+async def prepare_workers():
+    # Tables and the encryption key are created once, before forking, so workers never race on them.
+    await init_db()
+    await engine.dispose()
+
+
+async def consume_routed_updates(application, updates):
+    while True:
+        try:
+            payload = await asyncio.to_thread(updates.get, True, 1)
+        except queue.Empty:
+            continue
+        await application.update_queue.put(Update.de_json(payload, application.bot))
+
+
+async def serve_worker(index: int, sock: socket.socket, queues: list):
+    application = None
+    consumer = None
+    if TOKEN:
+        application = build_bot_application(TOKEN, TELEGRAM_API_URL, TELEGRAM_FILE_URL, polling=False)
+        await application.initialize()
+        await application.start()
+        api.main.bot_application = application
+        api.main.update_router = UpdateRouter(queues)
+        consumer = asyncio.create_task(consume_routed_updates(application, queues[index]))
+
+    metrics_server = await start_metrics_server(METRICS_HOST, METRICS_PORT + index)
+    server = uvicorn.Server(uvicorn.Config(fastapi_app, log_level="info"))
+    try:
+        await server.serve(sockets=[sock])
+    finally:
+        metrics_server.close()
+        if consumer:
+            consumer.cancel()
+            await asyncio.gather(consumer, return_exceptions=True)
+        if application:
+            await stop_webhook_bot(application)
+
+
+def worker_main(index: int, sock: socket.socket, queues: list):
+    logger.info(f"Worker {index} started with pid {os.getpid()}")
+    try:
+        asyncio.run(serve_worker(index, sock, queues))
+    except KeyboardInterrupt:
+        pass
+
+
+def bare_bot() -> Bot:
+    # The master only fetches updates for the workers: no handlers, persistence or send scheduler.
+    kwargs = {}
+    if TELEGRAM_API_URL:
+        kwargs["base_url"] = TELEGRAM_API_URL
+    if TELEGRAM_FILE_URL:
+        kwargs["base_file_url"] = TELEGRAM_FILE_URL
+    return Bot(TOKEN, **kwargs)
+
+
+async def register_webhook():
+    async with bare_bot() as bot:
+        await bot.set_webhook(
+            url=WEBHOOK_URL.rstrip("/") + api.main.WEBHOOK_PATH,
+            secret_token=api.main.WEBHOOK_SECRET,
+            allowed_updates=Update.ALL_TYPES,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+        )
+
+
+async def poll_updates(queues: list):
+    router = UpdateRouter(queues)
+    updates = asyncio.Queue()
+    async with Updater(bare_bot(), updates) as updater:
+        await updater.start_polling(allowed_updates=Update.ALL_TYPES)
+        try:
+            while True:
+                update = await updates.get()
+                router(update.to_dict())
+        finally:
+            await updater.stop()
+
+
+def poller_main(queues: list):
+    logger.info(f"Update poller started with pid {os.getpid()}")
+    try:
+        asyncio.run(poll_updates(queues))
+    except KeyboardInterrupt:
+        pass
+
+
+def start_process(context, name: str, target, args: tuple):
+    process = context.Process(target=target, args=args, name=name)
+    process.start()
+    return process
+
+
+def supervise_processes(context, targets: dict, processes: dict):
+    # Runs in the master before any event loop exists, so a restarted child is forked from a clean process.
+    while True:
+        time.sleep(1)
+        for name, process in processes.items():
+            if not process.is_alive():
+                logger.warning(f"{name} exited with code {process.exitcode}, restarting")
+                processes[name] = start_process(context, name, *targets[name])
+
+
+def run_workers(count: int):
+    asyncio.run(prepare_workers())
+    shared_store.configure_store(SHARED_STORE_PATH)
+    upload_limiter.split(count)
+    if count > 1 and isinstance(cache.backend, cache.LocalCacheBackend):
+        # A write handled by one worker cannot invalidate another worker's memory, only Redis is shared.
+        logger.warning("CACHE_BACKEND=local is not shared between workers, database lookups will not be cached")
+        cache.configure_backend("local", max_entries=0)
+    if count > 1:
+        # Rendered keyboards and inline results live in process memory whatever the backend is, an edit
+        # handled by one worker would leave the other workers showing the old boards.
+        keyboard_cache.max_users = 0
+        search_cache.max_users = 0
+
+    sock = socket.create_server((API_HOST, API_PORT), backlog=2048)
+    sock.set_inheritable(True)
+
+    context = multiprocessing.get_context("fork")
+    queues = [context.Queue() for _ in range(count)]
+    targets = {f"pintag-worker-{index}": (worker_main, (index, sock, queues)) for index in range(count)}
+    if TOKEN and WEBHOOK_URL and api.main.WEBHOOK_SECRET:
+        asyncio.run(register_webhook())
+    elif TOKEN:
+        # Only the poller talks to getUpdates; workers receive updates through their queues.
+        targets["pintag-poller"] = (poller_main, (queues,))
+    processes = {name: start_process(context, name, *target) for name, target in targets.items()}
+    logger.info(f"Started {count} workers on http://{API_HOST}:{API_PORT}")
+
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        supervise_processes(context, targets, processes)
+    except (KeyboardInterrupt, SystemExit):
+        logger.info("\nShutting down workers...")
+    finally:
+        for process in processes.values():
+            if process.is_alive():
+                process.terminate()
+        for process in processes.values():
+            process.join(timeout=10)
+        sock.close()
 
 
 def main():
     parser = argparse.ArgumentParser(description="PinTag Bot and API Runner")
     parser.add_argument(
         "mode",
-        choices=["bot", "api", "both"],
-        help="Start only bot, only api or both services"
+        choices=["bot", "api", "both", "webhook", "workers"],
+        help="Start only bot, only api, both services, the API with the bot behind a webhook "
+             "or several API/bot worker processes"
     )
+    parser.add_argument("--workers", type=int, default=WORKERS, help="Worker processes for the 'workers' mode")
     args = parser.parse_args()
 
     if args.mode == "bot":
@@ -68,10 +269,6 @@ def main():
             logger.error(f"Error: {e}")
 
     elif args.mode == "api":
-        global bot_application
-        if TOKEN:
-            bot_application = build_bot_application(TOKEN)
-
         logger.info("Mode: Only FastAPI Server (Sync Uvicorn)")
         uvicorn.run(fastapi_app, host=API_HOST, port=API_PORT, log_level="info")
 
@@ -84,6 +281,19 @@ def main():
         except Exception as e:
             logger.error(f"An error occurred: {e}")
 
+    elif args.mode == "webhook":
+        logger.info("Mode: FastAPI Server with Telegram Webhook")
+        try:
+            asyncio.run(run_webhook_async())
+        except KeyboardInterrupt:
+            logger.info("\nShutting down services...")
+        except ValueError as e:
+            logger.error(f"Error: {e}")
+
+    elif args.mode == "workers":
+        logger.info(f"Mode: {args.workers} API/Bot workers sharded by user_id")
+        run_workers(args.workers)
+
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,93 @@
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+# The managers read their paths on import, so the tests never touch the real key, files or database.
+WORKDIR = Path(tempfile.mkdtemp(prefix="pintag-tests-"))
+os.environ.update({
+    "DATABASE_URL": f"sqlite+aiosqlite:///{WORKDIR / 'pintag_test.db'}",
+    "DATABASE_ECHO": "false",
+    "USERS_FILES_PATH": str(WORKDIR / "users_files"),
+    "ENCRYPTION_KEY_PATH": str(WORKDIR / "encryption.key"),
+    "STORAGE_BACKEND": "local",
+    "CACHE_BACKEND": "local",
+    "TELEGRAM_BOT_TOKEN": "",
+})
+# Tests of the limiters build their own, the shared ones must never get in the way of other tests.
+for route_class in ("READ", "WRITE", "UPLOAD", "CLIENT"):
+    os.environ[f"RATE_LIMIT_{route_class}"] = "1000000000/1"
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(WORKDIR, ignore_errors=True)
+
+
+@pytest.fixture
+def run():
+    # aiosqlite connections belong to the loop that opened them, every test loop closes its own.
+    from database.database import engine
+
+    def run(coroutine):
+        async def main():
+            try:
+                return await coroutine
+            finally:
+                await engine.dispose()
+
+        return asyncio.run(main())
+
+    return run
+
+
+@pytest.fixture
+def database(run):
+    from database.database import Base, engine, init_db
+    from files.user_keys import user_keys
+    from utils import cache
+    from utils.user_cache import keyboard_cache, search_cache
+
+    async def reset():
+        await init_db()
+        async with engine.begin() as connection:
+            for table in reversed(Base.metadata.sorted_tables):
+                await connection.execute(table.delete())
+
+    run(reset())
+    cache.configure_backend("local")
+    keyboard_cache.users.clear()
+    search_cache.users.clear()
+    # Unwrapped data keys would outlive the user_keys rows of the previous test.
+    user_keys.entries.clear()
+
+
+@pytest.fixture
+def add_user(database):
+    from database.database import AsyncSessionLocal, User, Board, UserConnection
+
+    async def add_user(user_id: int, token: str = None, boards: tuple[str, ...] = ("Неотсортированное",)):
+        async with AsyncSessionLocal() as db:
+            db.add(User(id=user_id, username=f"user{user_id}"))
+            for name in boards:
+                db.add(Board(user_id=user_id, name=name))
+            if token:
+                db.add(UserConnection(user_id=user_id, connect_id=token, client_name="tests", status="accepted"))
+            await db.commit()
+
+    return add_user
+
+
+@pytest.fixture
+def api_client(database):
+    httpx = pytest.importorskip("httpx")
+    from api.main import app
+
+    def api_client():
+        return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+
+    return api_client
@@ -0,0 +1,174 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from telegram import Update
+
+import handler.database_handler
+from database.database_worker import get_board_by_name, get_all_items_by_board_id
+from files.encryption_manager import encryption_manager
+from files.storage_backend import storage
+from files.user_keys import user_keys
+from handler.database_handler import add_item_conservation, collect_album_part, get_title, save_temp_item, GET_TITLE
+from utils.rate_limiter import upload_limiter
+
+
+class FakeBot:
+    def __init__(self, broken: set = ()):
+        self.broken = broken
+        self.sent = []
+
+
+    async def get_file(self, file_id: str):
+        if file_id in self.broken:
+            raise ConnectionError(f"cannot download {file_id}")
+
+        async def download_as_bytearray():
+            return bytearray(f"contents of {file_id}".encode())
+
+        return SimpleNamespace(download_as_bytearray=download_as_bytearray)
+
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append(text)
+
+
+def album_part(message_id: int, media_group_id: str, bot: FakeBot, user_id: int = 1) -> Update:
+    update = Update.de_json({
+        "update_id": message_id,
+        "message": {
+            "message_id": message_id, "date": 0, "media_group_id": media_group_id,
+            "chat": {"id": user_id, "type": "private"}, "from": {"id": user_id, "is_bot": False, "first_name": "T"},
+            "document": {"file_id": f"file{message_id}", "file_unique_id": f"u{message_id}",
+                         "file_name": f"part{message_id}.txt"},
+        },
+    }, None)
+    update.message.set_bot(bot)
+    return update
+
+
+def text_message(text: str, bot: FakeBot, user_id: int = 1) -> Update:
+    update = Update.de_json({
+        "update_id": 1000,
+        "message": {
+            "message_id": 1000, "date": 0, "text": text,
+            "chat": {"id": user_id, "type": "private"}, "from": {"id": user_id, "is_bot": False, "first_name": "T"},
+        },
+    }, None)
+    update.message.set_bot(bot)
+    return update
+
+
+@pytest.fixture
+def album_context(add_user, run, monkeypatch):
+    monkeypatch.setattr(handler.database_handler, "ALBUM_WINDOW_SECONDS", 0.05)
+    # The semaphore belongs to the first loop that waits on it, every test runs its own loop.
+    monkeypatch.setattr(upload_limiter, "semaphore", asyncio.Semaphore(upload_limiter.max_concurrent))
+    run(add_user(1))
+
+    def album_context(bot: FakeBot):
+        tasks = []
+
+        def create_task(coroutine, update=None, name=None):
+            tasks.append(asyncio.create_task(coroutine))
+            return tasks[-1]
+
+        return SimpleNamespace(bot=bot, application=SimpleNamespace(create_task=create_task, tasks=tasks), user_data={})
+
+    return album_context
+
+
+async def send_album(context, bot: FakeBot, parts: tuple[int, ...], media_group_id: str = "album") -> list:
+    # The first part starts the conversation, the rest arrive while it waits for the title.
+    states = [await add_item_conservation(album_part(parts[0], media_group_id, bot), context)]
+    for index in parts[1:]:
+        states.append(await collect_album_part(album_part(index, media_group_id, bot), context))
+    return states
+
+
+async def wait_for_album(context):
+    await asyncio.gather(*context.application.tasks)
+
+
+def test_album_parts_are_stored_as_one_batch(album_context, run):
+    bot = FakeBot()
+    context = album_context(bot)
+
+    async def scenario():
+        states = await send_album(context, bot, (1, 2, 3))
+        assert len(handler.database_handler.album_timers) == 1
+        await wait_for_album(context)
+
+        await get_title(text_message("Trip", bot), context)
+        board = await get_board_by_name(1, "Неотсортированное")
+        summary = await save_temp_item(1, board.id, context.user_data["temp_item"])
+        items = await get_all_items_by_board_id(1, board.id)
+        contents = []
+        for item in items:
+            encrypted_data = await storage.get(item.file_path)
+            data_key = await user_keys.for_reading(1, encrypted_data)
+            contents.append(encryption_manager.decrypt_file(encrypted_data, data_key))
+        return states, summary, items, contents
+
+    states, summary, items, contents = run(scenario())
+    assert states == [GET_TITLE] * 3
+    assert "альбом из 3 файлов" in bot.sent[0]
+    assert summary == "3 элементов <b>'Trip'</b>"
+    assert sorted(item.title for item in items) == ["Trip 1", "Trip 2", "Trip 3"]
+    assert sorted(contents) == [b"contents of file1", b"contents of file2", b"contents of file3"]
+
+
+def test_failed_parts_are_skipped_and_reported(album_context, run):
+    bot = FakeBot(broken={"file2"})
+    context = album_context(bot)
+
+    async def scenario():
+        await send_album(context, bot, (1, 2, 3))
+        await wait_for_album(context)
+
+    run(scenario())
+    assert "альбом из 2 файлов (1 не удалось сохранить)" in bot.sent[0]
+    assert len(context.user_data["temp_item"]["files"]) == 2
+
+
+def test_title_waits_until_the_album_is_stored(album_context, run):
+    bot = FakeBot()
+    context = album_context(bot)
+
+    async def scenario():
+        await send_album(context, bot, (1,))
+        state = await get_title(text_message("Too early", bot), context)
+        await wait_for_album(context)
+        return state
+
+    assert run(scenario()) == GET_TITLE
+    assert bot.sent[0] == "⏳ Я ещё сохраняю альбом, подожди пару секунд."
+
+
+def test_a_discarded_album_deletes_its_files(album_context, run, monkeypatch):
+    bot = FakeBot()
+    context = album_context(bot)
+    deleted = []
+
+    async def delete_file(file_path):
+        deleted.append(file_path)
+
+    monkeypatch.setattr(storage, "delete_file", delete_file)
+
+    async def scenario():
+        await send_album(context, bot, (1,))
+        album = context.user_data["temp_item"]
+        original = handler.database_handler.download_and_store
+
+        async def cancel_while_downloading(*args):
+            result = await original(*args)
+            context.user_data.pop("temp_item", None)
+            return result
+
+        monkeypatch.setattr(handler.database_handler, "download_and_store", cancel_while_downloading)
+        await wait_for_album(context)
+        return album
+
+    album = run(scenario())
+    assert album["files"] is None
+    assert len(deleted) == 1 and bot.sent == []
@@ -0,0 +1,72 @@
+import asyncio
+
+from files.blob_cache import BlobCache, blob_cache, read_file
+from files.encryption_manager import encryption_manager
+from files.storage_backend import storage
+
+
+def test_entries_are_served_to_their_owner_only():
+    cache = BlobCache()
+    cache.put(1, "1/documents/a.txt", b"a")
+
+    assert cache.get(1, "1/documents/a.txt") == b"a"
+    assert cache.get(2, "1/documents/a.txt") is None
+
+
+def test_entries_expire():
+    cache = BlobCache(ttl=-1)
+    cache.put(1, "1/documents/a.txt", b"a")
+
+    assert cache.get(1, "1/documents/a.txt") is None
+
+
+def test_large_files_are_not_cached():
+    cache = BlobCache(max_entry_bytes=4)
+    cache.put(1, "1/documents/big.txt", b"12345")
+
+    assert cache.entries == {} and cache.bytes == 0
+
+
+def test_a_user_over_their_share_evicts_their_own_files_first():
+    cache = BlobCache(max_bytes=100, max_user_bytes=10)
+    cache.put(2, "2/documents/other.txt", b"o" * 5)
+    for index in range(3):
+        cache.put(1, f"1/documents/{index}.txt", b"x" * 4)
+
+    assert list(cache.entries) == ["2/documents/other.txt", "1/documents/1.txt", "1/documents/2.txt"]
+    assert cache.user_bytes == {1: 8, 2: 5} and cache.bytes == 13
+
+
+def test_least_recently_used_files_go_first_when_full():
+    cache = BlobCache(max_bytes=10, max_user_bytes=10)
+    cache.put(1, "1/documents/a.txt", b"a" * 4)
+    cache.put(2, "2/documents/b.txt", b"b" * 4)
+    cache.get(1, "1/documents/a.txt")
+    cache.put(3, "3/documents/c.txt", b"c" * 4)
+
+    assert list(cache.entries) == ["1/documents/a.txt", "3/documents/c.txt"]
+    assert cache.user_bytes == {1: 4, 3: 4}
+
+
+def test_reads_are_cached_until_the_file_changes(monkeypatch):
+    reads = []
+    get = storage.get
+
+    async def counted_get(key):
+        reads.append(key)
+        return await get(key)
+
+    monkeypatch.setattr(storage, "get", counted_get)
+
+    async def scenario():
+        path = await storage.save_file(encryption_manager.encrypt_file(b"first", "document"), 1, "documents", "a.txt")
+        first = [await read_file(1, path) for _ in range(2)]
+        await storage.put(path, encryption_manager.encrypt_file(b"second", "document"))
+        second = await read_file(1, path)
+        await storage.delete_file(path)
+        return path, first, second
+
+    path, first, second = asyncio.run(scenario())
+    assert first == [b"first", b"first"] and second == b"second"
+    assert reads == [path, path]
+    assert path not in blob_cache.entries
@@ -0,0 +1,162 @@
+import asyncio
+import datetime
+import json
+import pickle
+
+import pytest
+
+from database.database import Board, Item
+from database.database_worker import get_board_by_name, create_new_items, move_item, update_board_name, \
+    create_new_board, get_all_items_by_board_id
+from utils import cache
+from utils.cache import Cache, LocalCacheBackend, RedisCacheBackend, MISSING, cached, dump_rows
+from utils.user_cache import search_cache
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+def redis_backend(server=None) -> RedisCacheBackend:
+    return RedisCacheBackend(client=fakeredis.FakeAsyncRedis(server=server or fakeredis.FakeServer()))
+
+
+@pytest.fixture(params=["local", "redis"])
+def make_backend(request):
+    # Built inside the test's event loop, the async client binds to the loop it first runs in.
+    return LocalCacheBackend if request.param == "local" else redis_backend
+
+
+def test_generation_bump_drops_entries(make_backend):
+    async def scenario():
+        backend = make_backend()
+        generation, value = await backend.get("items:1:generation", "items:1:all")
+        assert (generation, value) == (0, MISSING)
+
+        await backend.set("items:1:all", generation, ["item"], ttl=60)
+        assert await backend.get("items:1:generation", "items:1:all") == (0, ["item"])
+
+        await backend.bump("items:1:generation")
+        assert await backend.get("items:1:generation", "items:1:all") == (1, MISSING)
+
+    asyncio.run(scenario())
+
+
+def test_value_read_before_an_invalidation_is_not_stored_as_current(make_backend):
+    async def scenario():
+        backend = make_backend()
+        generation, _ = await backend.get("items:1:generation", "items:1:all")
+        await backend.bump("items:1:generation")
+        await backend.set("items:1:all", generation, ["stale"], ttl=60)
+
+        assert await backend.get("items:1:generation", "items:1:all") == (1, MISSING)
+
+    asyncio.run(scenario())
+
+
+def test_entries_expire(make_backend):
+    async def scenario():
+        backend = make_backend()
+        await backend.set("items:1:all", 0, ["item"], ttl=0.05)
+        await asyncio.sleep(0.1)
+
+        assert await backend.get("items:1:generation", "items:1:all") == (0, MISSING)
+
+    asyncio.run(scenario())
+
+
+def test_redis_backend_is_shared_between_processes():
+    server = fakeredis.FakeServer()
+    boards = Cache("boards")
+
+    async def scenario():
+        first, second = redis_backend(server), redis_backend(server)
+        calls = []
+
+        @cached(boards, lambda: "all", Board)
+        async def get_boards(user_id: int):
+            calls.append(user_id)
+            return [Board(id=user_id, user_id=user_id, name=f"board of {user_id}", emoji="📁")]
+
+        cache.backend = first
+        assert [board.name for board in await get_boards(1)] == [board.name for board in await get_boards(1)]
+        cache.backend = second
+        await boards.invalidate(1)
+        cache.backend = first
+        await get_boards(1)
+        return calls
+
+    backend = cache.backend
+    try:
+        assert asyncio.run(scenario()) == [1, 1]
+    finally:
+        cache.backend = backend
+
+
+def test_redis_outage_falls_back_to_the_database():
+    server = fakeredis.FakeServer()
+    server.connected = False
+
+    async def scenario():
+        backend = redis_backend(server)
+        assert await backend.get("items:1:generation", "items:1:all") == (None, MISSING)
+        await backend.set("items:1:all", None, ["item"], ttl=60)
+        await backend.bump("items:1:generation")
+
+    asyncio.run(scenario())
+
+
+def test_cached_rows_come_back_as_new_model_instances():
+    created_at = datetime.datetime(2026, 1, 2, 3, 4, 5)
+    item = Item(id=7, user_id=1, board_id=2, title="Заметка", content_type="text", encrypted=False,
+                created_at=created_at)
+
+    async def scenario():
+        backend = cache.backend
+        cache.backend = redis_backend()
+
+        @cached(Cache("items"), lambda: "id:7", Item)
+        async def get_item(user_id: int):
+            return item
+
+        try:
+            await get_item(1)
+            return await get_item(1)
+        finally:
+            cache.backend = backend
+
+    cached_item = asyncio.run(scenario())
+    assert cached_item is not item and isinstance(cached_item, Item)
+    assert dump_rows(cached_item) == dump_rows(item)
+    assert cached_item.created_at == created_at
+
+
+def test_redis_entries_are_json_and_pickles_are_ignored():
+    server = fakeredis.FakeServer()
+
+    async def scenario():
+        backend = redis_backend(server)
+        await backend.set("boards:1:all", 0, [{"id": 1, "name": "a"}], ttl=60)
+        raw = await backend.client.get(backend.prefix + "boards:1:all")
+        await backend.client.set(backend.prefix + "boards:1:all", pickle.dumps((0, ["old"])))
+        return raw, await backend.get("boards:1:generation", "boards:1:all")
+
+    raw, legacy = asyncio.run(scenario())
+    assert json.loads(raw) == [0, [{"id": 1, "name": "a"}]]
+    assert legacy == (0, MISSING)
+
+
+def test_moves_and_renames_drop_cached_searches(add_user, run):
+    async def scenario():
+        await add_user(1)
+        board = await get_board_by_name(1, "Неотсортированное")
+        other = await create_new_board(1, "Другая", "📁")
+        await create_new_items(1, board.id, [{"title": "x", "content_type": "text", "content_data": "x"}])
+        item, = await get_all_items_by_board_id(1, board.id)
+
+        search_cache.set(1, "x", ["cached"])
+        await move_item(1, item.id, other.id)
+        after_move = search_cache.get(1, "x")
+        search_cache.set(1, "x", ["cached"])
+        await update_board_name(1, other.id, "Переименованная")
+        return after_move, search_cache.get(1, "x")
+
+    assert run(scenario()) == (None, None)
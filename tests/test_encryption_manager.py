@@ -0,0 +1,142 @@
+import base64
+
+import pytest
+from cryptography.fernet import Fernet, InvalidToken
+
+from files.encryption_manager import (
+    EncryptionManager, FileKey, HEADER, HEADER_V1, MAGIC, FORMAT_VERSION, FLAG_ZLIB, FLAG_ZSTD, parse_header,
+    format_version_of, key_id_of, uses_data_key
+)
+
+
+@pytest.fixture
+def manager(tmp_path):
+    return EncryptionManager(str(tmp_path / "encryption.key"))
+
+
+@pytest.mark.parametrize("size", [0, 1, 15, 16, 17, 4096, 1024 * 1024 + 3])
+def test_file_key_tokens_are_fernet_tokens(size):
+    key = Fernet.generate_key()
+    payload = bytes(range(256)) * (size // 256) + bytes(size % 256)
+
+    raw = FileKey(key).encrypt_raw(payload)
+    assert Fernet(key).decrypt(base64.urlsafe_b64encode(raw)) == payload
+    assert FileKey(key).decrypt_raw(base64.urlsafe_b64decode(Fernet(key).encrypt(payload))) == payload
+
+
+def test_file_key_rejects_tampered_tokens():
+    file_key = FileKey(Fernet.generate_key())
+    token = bytearray(file_key.encrypt_raw(b"secret"))
+    token[-40] ^= 1
+
+    with pytest.raises(InvalidToken):
+        file_key.decrypt_raw(bytes(token))
+    with pytest.raises(InvalidToken):
+        FileKey(Fernet.generate_key()).decrypt_raw(file_key.encrypt_raw(b"secret"))
+
+
+def test_decrypts_legacy_base64_blobs(manager):
+    legacy = manager.keys[0].encrypt(b"written before the header")
+
+    assert parse_header(legacy) == (0, 0, 0)
+    assert manager.decrypt_file(legacy) == b"written before the header"
+    assert format_version_of(manager.reencrypt(legacy)) == FORMAT_VERSION
+
+
+def test_decrypts_v1_blobs(manager):
+    manager.rotate_key()
+    v1 = HEADER_V1.pack(MAGIC, 1, 0) + manager.keys[0].encrypt_raw(b"version 1")
+
+    assert parse_header(v1) == (HEADER_V1.size, 0, 0)
+    assert manager.decrypt_file(v1) == b"version 1"
+
+
+def test_blobs_round_trip(manager):
+    text = b"compressible text " * 1000
+    document = manager.encrypt_file(text, "document", "notes.txt")
+    photo = manager.encrypt_file(b"\xff\xd8 not compressed", "photo", "photo.jpg")
+
+    header_size, flags, _ = parse_header(document)
+    assert format_version_of(document) == FORMAT_VERSION
+    assert header_size == HEADER.size and flags & (FLAG_ZLIB | FLAG_ZSTD)
+    assert len(document) < len(text)
+    assert parse_header(photo) == (HEADER.size, 0, 0)
+    assert manager.decrypt_file(document) == text
+    assert manager.decrypt_file(photo) == b"\xff\xd8 not compressed"
+
+
+def rewrite_header(blob: bytes, version: int = FORMAT_VERSION, flags: int = None, key_id: int = None) -> bytes:
+    _, _, old_flags, old_key_id = HEADER.unpack_from(blob)
+    header = HEADER.pack(MAGIC, version, old_flags if flags is None else flags,
+                         old_key_id if key_id is None else key_id)
+    return header + blob[HEADER.size:]
+
+
+def test_tampered_headers_are_rejected(manager):
+    document = manager.encrypt_file(b"compressible text " * 1000, "document", "notes.txt")
+    _, flags, _ = parse_header(document)
+    manager.rotate_key()
+    rotated = manager.encrypt_file(b"plain")
+
+    # Clearing the compression flag would otherwise hand out the compressed payload as the file.
+    with pytest.raises(InvalidToken):
+        manager.decrypt_file(rewrite_header(document, flags=flags & ~(FLAG_ZLIB | FLAG_ZSTD)))
+    with pytest.raises(InvalidToken):
+        manager.decrypt_file(rewrite_header(rotated, flags=FLAG_ZLIB))
+    # Claiming the older format, whose HMAC skipped the header, does not help either.
+    with pytest.raises(InvalidToken):
+        manager.decrypt_file(rewrite_header(document, version=2, flags=0))
+
+
+def test_v2_blobs_stay_readable_and_are_upgraded(manager):
+    v2 = HEADER.pack(MAGIC, 2, 0, manager.active_key_id) + manager.fernet.encrypt_raw(b"version 2")
+
+    assert manager.decrypt_file(v2) == b"version 2"
+    upgraded = manager.reencrypt(v2)
+    assert format_version_of(upgraded) == FORMAT_VERSION
+    assert manager.decrypt_file(upgraded) == b"version 2"
+
+
+def test_rotation_keeps_old_blobs_readable(manager):
+    old = manager.encrypt_file(b"old key")
+    key_id = manager.rotate_key()
+    new = manager.encrypt_file(b"new key")
+
+    assert (key_id_of(old), key_id_of(new)) == (0, key_id)
+    assert manager.decrypt_file(old) == b"old key"
+    assert key_id_of(manager.reencrypt(old)) == key_id
+    assert manager.decrypt_file(manager.reencrypt(old)) == b"old key"
+
+
+def test_other_processes_pick_up_a_rotation(manager, monkeypatch):
+    other = EncryptionManager(str(manager.key_path))
+    key_id = manager.rotate_key()
+    rotated = manager.encrypt_file(b"new key")
+
+    assert other.decrypt_file(rotated) == b"new key"
+    monkeypatch.setattr("files.encryption_manager.KEY_RELOAD_INTERVAL", 0)
+    assert key_id_of(other.encrypt_file(b"written by the other process")) == key_id
+
+
+def test_data_key_round_trip(manager):
+    data_key = Fernet.generate_key()
+    key_id, wrapped = manager.wrap_key(data_key)
+    file_key = FileKey(manager.unwrap_key(key_id, wrapped))
+
+    encrypted = manager.encrypt_file(b"user file", "photo", "photo.jpg", file_key)
+
+    assert manager.unwrap_key(key_id, wrapped) == data_key
+    assert uses_data_key(encrypted) and key_id_of(encrypted) == 0
+    assert manager.decrypt_file(encrypted, file_key) == b"user file"
+    with pytest.raises(ValueError):
+        manager.decrypt_file(encrypted)
+    with pytest.raises(InvalidToken):
+        manager.decrypt_file(encrypted, FileKey(Fernet.generate_key()))
+
+
+def test_reencrypt_moves_master_key_blobs_to_a_data_key(manager):
+    file_key = FileKey(Fernet.generate_key())
+    moved = manager.reencrypt(manager.encrypt_file(b"before per-user keys"), new_data_key=file_key)
+
+    assert uses_data_key(moved)
+    assert manager.decrypt_file(moved, file_key) == b"before per-user keys"
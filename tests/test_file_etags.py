@@ -0,0 +1,98 @@
+import asyncio
+import hashlib
+from datetime import timezone
+from email.utils import format_datetime, parsedate_to_datetime
+
+import pytest
+
+import api.main
+from database.database_worker import get_board_by_name, get_item_by_id, set_item_content_hash
+from utils.rate_limiter import upload_limiter
+
+HEADERS = {"X-Auth-Token": "valid"}
+CONTENT = b"the same bytes every time"
+
+
+@pytest.fixture
+def uploaded(add_user, api_client, run, monkeypatch):
+    # The semaphore belongs to the first loop that waits on it, every test runs its own loop.
+    monkeypatch.setattr(upload_limiter, "semaphore", asyncio.Semaphore(upload_limiter.max_concurrent))
+
+    async def upload():
+        await add_user(1, token="valid")
+        await add_user(2, token="other")
+        board = await get_board_by_name(1, "Неотсортированное")
+        async with api_client() as client:
+            response = await client.post(
+                "/users/1/items/upload", headers=HEADERS,
+                data={"board_id": str(board.id), "title": "Файл", "content_type": "document"},
+                files={"file": ("notes.txt", CONTENT)},
+            )
+        item = await get_item_by_id(1, response.json()["item_id"])
+        return f"/files/1/{item.file_path}", item
+
+    return run(upload())
+
+
+async def fetch(api_client, path: str, headers: dict = None, token: str = "valid"):
+    async with api_client() as client:
+        return await client.get(path, headers={"X-Auth-Token": token, **(headers or {})})
+
+
+def test_files_carry_validators(uploaded, api_client, run):
+    path, item = uploaded
+    response = run(fetch(api_client, path))
+
+    assert response.content == CONTENT
+    assert response.headers["ETag"] == f'"{hashlib.sha256(CONTENT).hexdigest()}"'
+    assert response.headers["Cache-Control"] == "private, no-cache"
+    assert parsedate_to_datetime(response.headers["Last-Modified"]).replace(tzinfo=None) \
+        == item.created_at.replace(microsecond=0)
+
+
+def test_versioned_urls_are_immutable(uploaded, api_client, run):
+    path, item = uploaded
+
+    assert run(fetch(api_client, f"{path}?v={item.content_hash}")).headers["Cache-Control"] \
+        == f"private, max-age={api.main.IMMUTABLE_MAX_AGE}, immutable"
+    assert run(fetch(api_client, f"{path}?v=stale")).headers["Cache-Control"] == "private, no-cache"
+
+
+@pytest.mark.parametrize("conditional", ["If-None-Match", "If-Modified-Since"])
+def test_revalidation_answers_without_reading_the_file(uploaded, api_client, run, monkeypatch, conditional):
+    path, item = uploaded
+    first = run(fetch(api_client, path))
+
+    async def read_file(*args, **kwargs):
+        raise AssertionError("a 304 must not read or decrypt the file")
+
+    monkeypatch.setattr(api.main, "read_file", read_file)
+    validator = first.headers["ETag"] if conditional == "If-None-Match" else first.headers["Last-Modified"]
+    response = run(fetch(api_client, path, {conditional: validator}))
+
+    assert response.status_code == 304
+    assert response.headers["ETag"] == first.headers["ETag"]
+
+
+def test_a_changed_validator_gets_the_file(uploaded, api_client, run):
+    path, item = uploaded
+    stale = format_datetime(item.created_at.replace(year=item.created_at.year - 1, tzinfo=timezone.utc), usegmt=True)
+
+    assert run(fetch(api_client, path, {"If-None-Match": '"stale"'})).status_code == 200
+    # If-None-Match wins over If-Modified-Since when both are sent.
+    assert run(fetch(api_client, path, {"If-None-Match": '"stale"', "If-Modified-Since": stale})).content == CONTENT
+
+
+def test_other_users_files_are_not_found(uploaded, api_client, run):
+    path, _ = uploaded
+
+    assert run(fetch(api_client, path.replace("/files/1/", "/files/2/"), token="other")).status_code == 404
+
+
+def test_files_without_a_hash_get_one_on_first_download(uploaded, api_client, run):
+    path, item = uploaded
+    run(set_item_content_hash(1, item.id, None))
+
+    response = run(fetch(api_client, path))
+    assert response.headers["ETag"] == f'"{hashlib.sha256(CONTENT).hexdigest()}"'
+    assert run(get_item_by_id(1, item.id)).content_hash == hashlib.sha256(CONTENT).hexdigest()
@@ -0,0 +1,100 @@
+import pytest
+
+import database.database_worker
+import handler.inline_handler
+from database.database_worker import get_board_by_name, create_new_items, search_items_by_title
+from handler.inline_handler import find_inline_items
+from utils.user_cache import UserCache, search_cache
+
+TITLES = ["Notebook setup", "My notes", "Ноутбук и заметки", "Note-taking apps", "Booking notes", "Cooking"]
+
+
+@pytest.fixture
+def items(add_user, run):
+    async def setup():
+        await add_user(1)
+        await add_user(2)
+        for user_id in (1, 2):
+            board = await get_board_by_name(user_id, "Неотсортированное")
+            await create_new_items(user_id, board.id, [
+                {"title": title, "content_type": "text", "content_data": title} for title in TITLES
+            ])
+
+    run(setup())
+
+
+async def titles(user_id: int, query: str) -> list[str]:
+    return sorted(item.title for item in await search_items_by_title(user_id, query, 50))
+
+
+@pytest.mark.parametrize("fts", [True, False])
+def test_tokens_match_word_prefixes(items, run, monkeypatch, fts):
+    monkeypatch.setattr(database.database_worker, "fts_search_available", fts)
+
+    async def search():
+        return [await titles(1, query) for query in ("note", "ook", "taking note", "ноут", "notes my")]
+
+    assert run(search()) == [
+        ["Booking notes", "My notes", "Note-taking apps", "Notebook setup"],
+        [],
+        ["Note-taking apps"],
+        ["Ноутбук и заметки"],
+        ["My notes"],
+    ]
+
+
+def test_fallback_respects_the_limit(items, run, monkeypatch):
+    monkeypatch.setattr(database.database_worker, "fts_search_available", False)
+
+    assert len(run(search_items_by_title(1, "note", 2))) == 2
+
+
+def test_longer_queries_reuse_a_shorter_complete_result(items, run, monkeypatch):
+    queries = []
+
+    async def search(user_id, query, limit):
+        queries.append(query)
+        return await search_items_by_title(user_id, query, limit)
+
+    monkeypatch.setattr(handler.inline_handler, "search_items_by_title", search)
+
+    async def typing():
+        return [sorted(item.title for item in await find_inline_items(1, query)) for query in ("n", "no", "note", "notes")]
+
+    results = run(typing())
+    assert queries == ["n"]
+    assert results[2] == ["Booking notes", "My notes", "Note-taking apps", "Notebook setup"]
+    assert results[3] == ["Booking notes", "My notes"]
+
+
+def test_writes_invalidate_cached_searches(items, run):
+    async def scenario():
+        before = await find_inline_items(1, "cook")
+        board = await get_board_by_name(1, "Неотсортированное")
+        await create_new_items(1, board.id, [{"title": "Cookbook", "content_type": "text", "content_data": "x"}])
+        return before, await find_inline_items(1, "cook")
+
+    before, after = run(scenario())
+    assert [item.title for item in before] == ["Cooking"]
+    assert sorted(item.title for item in after) == ["Cookbook", "Cooking"]
+    assert search_cache.get(2, "cook") is None
+
+
+def test_entries_per_user_are_capped():
+    cache = UserCache("test", max_users=2, max_entries=3)
+    for key in ("a", "b", "c"):
+        cache.set(1, key, key)
+    cache.get(1, "a")
+    cache.set(1, "d", "d")
+
+    assert list(cache.users[1]) == ["c", "a", "d"]
+
+
+def test_least_recent_user_is_evicted():
+    cache = UserCache("test", max_users=2)
+    for user_id in (1, 2):
+        cache.set(user_id, "key", user_id)
+    cache.get(1, "key")
+    cache.set(3, "key", 3)
+
+    assert list(cache.users) == [1, 3]
@@ -0,0 +1,83 @@
+import json
+import logging
+
+import pytest
+from sqlalchemy import text
+
+from database import instrumentation
+from database.database import engine
+from database.instrumentation import track_queries, assert_max_queries, TooManyQueriesError, params_shape
+
+
+async def execute(*statements: str):
+    async with engine.connect() as connection:
+        for statement in statements:
+            await connection.execute(text(statement))
+
+
+def test_params_shape_hides_values():
+    assert params_shape((1, "secret", None)) == "(int, str, NoneType)"
+    assert params_shape({"user_id": 1}) == "{user_id: int}"
+    assert params_shape([(1, "a"), (2, "b")]) == "2x(int, str)"
+
+
+def test_repeated_statements_are_reported(run, caplog):
+    async def scenario():
+        with track_queries("test:n_plus_one") as tracker:
+            await execute(*["SELECT 1"] * (instrumentation.N_PLUS_ONE_THRESHOLD + 1), "SELECT 2")
+        return tracker
+
+    with caplog.at_level(logging.WARNING, logger=instrumentation.logger.name):
+        tracker = run(scenario())
+
+    assert tracker.total == instrumentation.N_PLUS_ONE_THRESHOLD + 2
+    assert tracker.repeated_statements() == [("SELECT 1", instrumentation.N_PLUS_ONE_THRESHOLD + 1)]
+    events = [json.loads(record.message) for record in caplog.records if record.message.startswith("{")]
+    assert [(event["event"], event["statement"]) for event in events] == [("repeated_statement", "SELECT 1")]
+
+
+def test_slow_queries_are_logged_with_their_caller(run, caplog, monkeypatch):
+    monkeypatch.setattr(instrumentation, "SLOW_QUERY_MS", 0)
+
+    async def scenario():
+        with track_queries("test:slow"):
+            await execute("SELECT 42")
+
+    with caplog.at_level(logging.WARNING, logger="pintag.slow_queries"):
+        run(scenario())
+
+    event = json.loads(caplog.records[-1].message)
+    assert (event["event"], event["caller"], event["statement"]) == ("slow_query", "test:slow", "SELECT 42")
+
+
+def test_budget_counts_statements_of_nested_trackers(run):
+    async def scenario():
+        with assert_max_queries(2):
+            with track_queries("api:GET /nested"):
+                await execute("SELECT 1", "SELECT 2", "SELECT 3")
+
+    with pytest.raises(TooManyQueriesError, match="executed 3 statements, expected at most 2"):
+        run(scenario())
+
+
+def test_budget_fails_the_test_not_the_request(add_user, api_client, run):
+    async def scenario():
+        await add_user(1, token="valid")
+        responses = []
+        async with api_client() as client:
+            with pytest.raises(TooManyQueriesError):
+                with assert_max_queries(1):
+                    responses.append(await client.get("/users/1/stats", headers={"X-Auth-Token": "valid"}))
+        return responses[0]
+
+    assert run(scenario()).status_code == 200
+
+
+def test_request_passes_within_its_budget(add_user, api_client, run):
+    async def scenario():
+        await add_user(1, token="valid")
+        async with api_client() as client:
+            with assert_max_queries(20):
+                return await client.get("/users/1/stats", headers={"X-Auth-Token": "valid"})
+
+    assert run(scenario()).status_code == 200
@@ -0,0 +1,74 @@
+import pytest
+
+from database.database_worker import get_board_by_name, create_new_items, get_user_key
+from files.encryption_manager import encryption_manager, HEADER, MAGIC, FORMAT_VERSION, format_version_of, \
+    key_id_of, uses_data_key
+from files.file_manager import file_manager
+from files.key_rotation import reencrypt_all
+from files.storage_backend import storage
+from files.user_keys import user_keys
+
+
+async def read(path: str) -> bytes:
+    encrypted_data = await storage.get(path)
+    return encryption_manager.decrypt_file(encrypted_data, await user_keys.for_reading(1, encrypted_data))
+
+
+@pytest.fixture
+def stored_files(add_user, run):
+    async def setup():
+        await add_user(1)
+        board = await get_board_by_name(1, "Неотсортированное")
+        data_key = await user_keys.for_writing(1)
+        blobs = {
+            "master.txt": encryption_manager.encrypt_file(b"on the master key"),
+            "v2.txt": HEADER.pack(MAGIC, 2, 0, encryption_manager.active_key_id)
+                      + encryption_manager.fernet.encrypt_raw(b"version 2"),
+            "current.txt": encryption_manager.encrypt_file(b"on the data key", data_key=data_key),
+        }
+        paths = {}
+        for name, blob in blobs.items():
+            paths[name] = file_manager.save_file(blob, 1, "documents", name)
+        paths["missing.txt"] = str(file_manager.base_path / "1" / "documents" / "missing.txt")
+        await create_new_items(1, board.id, [
+            {"title": name, "content_type": "document", "file_path": path, "encrypted": True}
+            for name, path in paths.items()
+        ])
+        return paths
+
+    return run(setup())
+
+
+def test_reencrypt_moves_every_blob_to_the_users_data_key(stored_files, run):
+    master_key_id = encryption_manager.rotate_key()
+
+    async def scenario():
+        state = await reencrypt_all(max_mb_per_s=0, max_cpu=1, restart=True)
+        blobs = {name: await storage.get(path) for name, path in stored_files.items() if name != "missing.txt"}
+        contents = {name: await read(path) for name, path in stored_files.items() if name != "missing.txt"}
+        return state, blobs, contents, await get_user_key(1)
+
+    state, blobs, contents, user_key = run(scenario())
+
+    assert (state["rewrapped"], state["reencrypted"], state["current"], state["missing"]) == (1, 2, 1, 1)
+    assert state["done"] and user_key[0] == master_key_id
+    assert all(uses_data_key(blob) and format_version_of(blob) == FORMAT_VERSION for blob in blobs.values())
+    assert contents == {"master.txt": b"on the master key", "v2.txt": b"version 2", "current.txt": b"on the data key"}
+
+    assert run(reencrypt_all(max_mb_per_s=0, max_cpu=1)) == state
+
+
+def test_without_data_keys_blobs_move_to_the_active_master_key(stored_files, run, monkeypatch):
+    monkeypatch.setattr("files.key_rotation.USER_DATA_KEYS", False)
+    monkeypatch.setattr("files.user_keys.USER_DATA_KEYS", False)
+    key_id = encryption_manager.rotate_key()
+
+    async def scenario():
+        state = await reencrypt_all(max_mb_per_s=0, max_cpu=1, restart=True)
+        return state, await storage.get(stored_files["master.txt"]), await storage.get(stored_files["v2.txt"])
+
+    state, master, v2 = run(scenario())
+
+    assert (state["reencrypted"], state["current"], state["missing"]) == (2, 1, 1)
+    assert key_id_of(master) == key_id and not uses_data_key(master)
+    assert format_version_of(v2) == FORMAT_VERSION and encryption_manager.decrypt_file(v2) == b"version 2"
@@ -0,0 +1,81 @@
+import pytest
+from sqlalchemy.exc import OperationalError
+
+import files.layout_migration
+from database.database_worker import get_board_by_name, create_new_items, get_all_items_by_board_id
+from files.file_manager import file_manager
+from files.layout_migration import migrate_layout
+
+
+def test_same_names_get_separate_sharded_files():
+    first = file_manager.save_file(b"first", 1, "documents", "report.pdf")
+    second = file_manager.save_file(b"second", 1, "documents", "report.pdf")
+
+    assert first != second
+    assert file_manager.is_sharded(first) and file_manager.is_sharded(second)
+    assert file_manager.display_name(first) == file_manager.display_name(second) == "report.pdf"
+    assert (file_manager.get_file(first), file_manager.get_file(second)) == (b"first", b"second")
+
+
+@pytest.fixture
+def flat_files(add_user, run):
+    folder = file_manager.base_path / "1" / "documents"
+    folder.mkdir(parents=True, exist_ok=True)
+    report = folder / "report.pdf"
+    report.write_bytes(b"report")
+    (folder / "report.pdf.thumb.jpg").write_bytes(b"thumbnail")
+    notes = folder / "notes.txt"
+    notes.write_bytes(b"notes")
+
+    async def setup():
+        await add_user(1)
+        board = await get_board_by_name(1, "Неотсортированное")
+        # Two items saved under the same name shared one file in the flat layout.
+        await create_new_items(1, board.id, [
+            {"title": title, "content_type": "document", "file_path": str(path), "encrypted": False}
+            for title, path in [("a", report), ("b", report), ("c", notes), ("d", folder / "missing.txt")]
+        ])
+        return board
+
+    board = run(setup())
+    return board, report, notes
+
+
+def items_by_title(run, board) -> dict:
+    return {item.title: item.file_path for item in run(get_all_items_by_board_id(1, board.id))}
+
+
+def test_files_move_into_the_sharded_layout(flat_files, run):
+    board, report, notes = flat_files
+
+    stats = run(migrate_layout(remove_delay=0))
+    paths = items_by_title(run, board)
+
+    assert stats == {"moved": 3, "skipped": 0, "missing": 1, "removed": 2}
+    assert paths["a"] == paths["b"] and file_manager.is_sharded(paths["a"])
+    assert file_manager.get_file(paths["a"]) == b"report"
+    assert file_manager.get_file(file_manager.variant_path(paths["a"], "thumb")) == b"thumbnail"
+    assert file_manager.get_file(paths["c"]) == b"notes"
+    assert paths["d"].endswith("missing.txt") and not file_manager.is_sharded(paths["d"])
+    assert not report.exists() and not notes.exists()
+    assert not report.with_name("report.pdf.thumb.jpg").exists()
+
+    assert run(migrate_layout(remove_delay=0)) == {"moved": 0, "skipped": 3, "missing": 1, "removed": 0}
+
+
+def test_a_failed_commit_keeps_the_old_files(flat_files, run, monkeypatch):
+    board, report, notes = flat_files
+    before = items_by_title(run, board)
+
+    async def set_item_file_paths(file_paths):
+        raise OperationalError("UPDATE", {}, Exception("database is locked"))
+
+    monkeypatch.setattr(files.layout_migration, "set_item_file_paths", set_item_file_paths)
+    with pytest.raises(OperationalError):
+        run(migrate_layout(remove_delay=0))
+
+    assert items_by_title(run, board) == before
+    assert report.read_bytes() == b"report" and notes.read_bytes() == b"notes"
+    assert sorted(path.name for path in report.parent.iterdir() if path.is_file()) == [
+        "notes.txt", "report.pdf", "report.pdf.thumb.jpg"
+    ]
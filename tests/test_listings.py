@@ -0,0 +1,85 @@
+import pytest
+
+from database.database_worker import get_board_by_name, create_new_items
+from database.instrumentation import track_queries
+
+HEADERS = {"X-Auth-Token": "valid"}
+
+
+async def add_items(user_id: int, board_name: str, count: int):
+    board = await get_board_by_name(user_id, board_name)
+    await create_new_items(user_id, board.id, [
+        {"title": f"{board_name} {index}", "content_type": "text", "content_data": "x"} for index in range(count)
+    ])
+
+
+async def get(client, path: str, **headers):
+    with track_queries("test") as tracker:
+        response = await client.get(path, headers={**HEADERS, **headers})
+    return response, tracker.total
+
+
+@pytest.mark.parametrize("board_count", [2, 6])
+def test_boards_are_counted_in_one_query(add_user, api_client, run, board_count):
+    names = [f"Доска {index}" for index in range(board_count)]
+
+    async def scenario():
+        await add_user(1, token="valid", boards=names)
+        await add_items(1, names[0], 3)
+        await add_items(1, names[-1], 1)
+        async with api_client() as client:
+            return await get(client, "/users/1/boards")
+
+    response, queries = run(scenario())
+    counts = {board["name"]: board["item_count"] for board in response.json()}
+    assert counts == {name: 3 if name == names[0] else 1 if name == names[-1] else 0 for name in names}
+    assert queries <= 5
+
+
+@pytest.mark.parametrize("path", ["/users/1/boards", "/users/1/search?q=note", "/users/1/stats"])
+def test_unchanged_listings_are_not_modified(add_user, api_client, run, path):
+    async def scenario():
+        await add_user(1, token="valid")
+        async with api_client() as client:
+            first, full_queries = await get(client, path)
+            second, revalidation_queries = await get(client, path, **{"If-None-Match": first.headers["ETag"]})
+            return first, second, full_queries, revalidation_queries
+
+    first, second, full_queries, revalidation_queries = run(scenario())
+    assert first.status_code == 200 and first.headers["ETag"].startswith('W/"1.')
+    assert first.headers["Cache-Control"] == "private, no-cache"
+    assert second.status_code == 304 and second.content == b""
+    assert second.headers["ETag"] == first.headers["ETag"]
+    assert revalidation_queries < full_queries
+
+
+def test_writes_change_the_etag(add_user, api_client, run):
+    async def scenario():
+        await add_user(1, token="valid")
+        await add_user(2, token="other")
+        async with api_client() as client:
+            first, _ = await get(client, "/users/1/boards")
+            await add_items(2, "Неотсортированное", 1)
+            unrelated, _ = await get(client, "/users/1/boards", **{"If-None-Match": first.headers["ETag"]})
+            await add_items(1, "Неотсортированное", 1)
+            changed, _ = await get(client, "/users/1/boards", **{"If-None-Match": first.headers["ETag"]})
+            return first, unrelated, changed
+
+    first, unrelated, changed = run(scenario())
+    assert unrelated.status_code == 304
+    assert changed.status_code == 200 and changed.headers["ETag"] != first.headers["ETag"]
+    assert changed.json()[0]["item_count"] == 1
+
+
+def test_weak_comparison_and_tag_lists(add_user, api_client, run):
+    async def scenario():
+        await add_user(1, token="valid")
+        async with api_client() as client:
+            first, _ = await get(client, "/users/1/boards")
+            strong = first.headers["ETag"].removeprefix("W/")
+            listed, _ = await get(client, "/users/1/boards", **{"If-None-Match": f'"other", {strong}'})
+            star, _ = await get(client, "/users/1/boards", **{"If-None-Match": "*"})
+            return listed, star
+
+    listed, star = run(scenario())
+    assert listed.status_code == star.status_code == 304
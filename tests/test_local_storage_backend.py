@@ -0,0 +1,59 @@
+import asyncio
+import os
+from pathlib import Path
+
+import pytest
+
+from files.file_manager import FileManager
+from files.storage_backend import LocalStorageBackend
+
+
+@pytest.fixture
+def local(tmp_path):
+    return LocalStorageBackend(FileManager(tmp_path / "users_files"))
+
+
+async def chunks(*parts: bytes, fail: bool = False):
+    for part in parts:
+        yield part
+    if fail:
+        raise ConnectionError("upload interrupted")
+
+
+def test_stream_replaces_the_file_in_one_step(local):
+    key = str(local.manager.base_path / "1" / "videos" / "a.mp4")
+    changed = []
+    local.manager.change_listeners.append(changed.append)
+
+    async def scenario():
+        await local.put(key, b"old contents")
+        await local.put_stream(key, chunks(b"new ", b"contents"))
+
+    asyncio.run(scenario())
+    assert Path(key).read_bytes() == b"new contents"
+    assert os.listdir(Path(key).parent) == ["a.mp4"]
+    assert changed == [key, key]
+
+
+def test_failed_stream_keeps_the_old_file(local):
+    key = str(local.manager.base_path / "1" / "videos" / "a.mp4")
+
+    async def scenario():
+        await local.put(key, b"old contents")
+        with pytest.raises(ConnectionError):
+            await local.put_stream(key, chunks(b"partial", fail=True))
+
+    asyncio.run(scenario())
+    assert Path(key).read_bytes() == b"old contents"
+    assert os.listdir(Path(key).parent) == ["a.mp4"]
+
+
+def test_stream_hides_the_packed_copy(local):
+    key = local.manager.save_file(b"old contents", 1, "videos", "a.mp4")
+    os.utime(key, (0, 0))
+    with local.manager.packs.writer():
+        local.manager.archive_cold_files(max_blob_bytes=1024, min_age_seconds=60)
+
+    asyncio.run(local.put_stream(key, chunks(b"new contents")))
+    assert asyncio.run(local.get(key)) == b"new contents"
+    assert local.manager.packs.locate(key) is None
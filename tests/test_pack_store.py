@@ -0,0 +1,113 @@
+import os
+from pathlib import Path
+
+import pytest
+
+from files.file_manager import FileManager
+from files.pack_store import PackStore
+
+
+@pytest.fixture
+def manager(tmp_path):
+    return FileManager(tmp_path / "users_files")
+
+
+def make_cold(*paths: str):
+    for path in paths:
+        os.utime(path, (0, 0))
+
+
+def archive(manager: FileManager) -> int:
+    with manager.packs.writer():
+        return manager.archive_cold_files(max_blob_bytes=1024, min_age_seconds=60)
+
+
+def test_archive_moves_small_cold_files_into_packs(manager):
+    cold = manager.save_file(b"cold file", 1, "photos", "cold.jpg")
+    thumb = manager.save_variant(b"thumbnail", cold, "thumb")
+    large = manager.save_file(b"x" * 2048, 1, "photos", "large.jpg")
+    fresh = manager.save_file(b"fresh file", 1, "photos", "fresh.jpg")
+    make_cold(cold, thumb, large)
+
+    assert archive(manager) == 2
+    assert not os.path.exists(cold) and not os.path.exists(thumb)
+    assert os.path.exists(large) and os.path.exists(fresh)
+    assert manager.get_file(cold) == b"cold file"
+    assert manager.get_range(cold, 5, 4) == b"file"
+    assert manager.get_file_size(cold) == len(b"cold file")
+    assert manager.variant_paths(cold) == [thumb]
+
+
+def test_delete_removes_packed_files(manager):
+    path = manager.save_file(b"packed", 1, "documents", "a.txt")
+    thumb = manager.save_variant(b"thumbnail", path, "thumb")
+    make_cold(path, thumb)
+    archive(manager)
+
+    manager.delete_file(path)
+
+    assert not manager.exists(path) and not manager.exists(thumb)
+    with pytest.raises(FileNotFoundError):
+        manager.get_file(path)
+    with pytest.raises(FileNotFoundError):
+        manager.remove(path)
+
+
+def test_overwrite_hides_the_packed_copy(manager):
+    path = manager.save_file(b"old contents", 1, "photos", "a.jpg")
+    make_cold(path)
+    archive(manager)
+
+    manager.write_file(Path(path), b"new contents")
+    assert manager.get_file(path) == b"new contents"
+
+    manager.remove(path)
+    assert not manager.exists(path)
+
+
+def test_compact_rewrites_mostly_dead_packs(tmp_path):
+    packs = PackStore(tmp_path / "packs", max_pack_bytes=64)
+    with packs.writer():
+        for index in range(8):
+            packs.append([(f"blob-{index}", bytes([index]) * 40)])
+    pack_ids = {packs.locate(f"blob-{index}")[0] for index in range(8)}
+    for index in range(7):
+        if index % 3:
+            packs.discard(f"blob-{index}")
+
+    with packs.writer():
+        stats = packs.compact(min_live_ratio=0.9)
+
+    assert stats["packs"] > 0 and stats["reclaimed_bytes"] > 0
+    for index in (0, 3, 6, 7):
+        assert packs.read(f"blob-{index}") == bytes([index]) * 40
+    for index in (1, 2, 4, 5):
+        assert packs.read(f"blob-{index}") is None
+    removed = {pack_id for pack_id in pack_ids if not packs.pack_file(pack_id).exists()}
+    assert len(removed) == stats["packs"]
+
+
+def test_files_deleted_while_archiving_leave_no_index_entry(manager, monkeypatch):
+    gone = manager.save_file(b"deleted before the flush", 1, "documents", "gone.txt")
+    raced = manager.save_file(b"deleted before the remove", 1, "documents", "raced.txt")
+    make_cold(gone, raced)
+    append = manager.packs.append
+    remove = os.remove
+
+    def deleting_append(blobs):
+        append(blobs)
+        remove(gone)
+
+    def racing_remove(path):
+        # Somebody else deletes the file between the re-stat and our remove.
+        remove(path)
+        if path == raced:
+            remove(path)
+
+    monkeypatch.setattr(manager.packs, "append", deleting_append)
+    monkeypatch.setattr(os, "remove", racing_remove)
+    archive(manager)
+    monkeypatch.undo()
+
+    assert not manager.exists(gone) and not manager.exists(raced)
+    assert manager.packs.locate(gone) is None and manager.packs.locate(raced) is None
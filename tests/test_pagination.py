@@ -0,0 +1,98 @@
+import pytest
+from sqlalchemy import select
+
+from database.database import AsyncSessionLocal, Item
+from database.database_worker import get_board_by_name, create_new_items, get_board_items_page, \
+    get_user_boards_page, remove_item_by_id
+from handler.database_handler import render_board_page, board_selection_markup, parse_page_cursor
+
+# Repeated titles make the id the only tie-breaker between neighbours.
+TITLES = ["b", "a", "c", "a", "b", "d", "a", "c"]
+
+
+@pytest.fixture
+def board(add_user, run):
+    async def setup():
+        await add_user(1)
+        board = await get_board_by_name(1, "Неотсортированное")
+        await create_new_items(1, board.id, [
+            {"title": title, "content_type": "text", "content_data": title} for title in TITLES
+        ])
+        async with AsyncSessionLocal() as db:
+            items = (await db.execute(select(Item.id, Item.title))).all()
+        return board, sorted(items, key=lambda item: (item.title, item.id))
+
+    return run(setup())
+
+
+def test_pages_walk_forward_and_back_without_gaps(board, run):
+    board, expected = board
+
+    async def walk():
+        forward, after_id, has_more = [], None, True
+        while has_more:
+            items, has_more = await get_board_items_page(1, board.id, 3, after_id=after_id)
+            forward.append([item.id for item in items])
+            after_id = items[-1].id
+
+        backward, before_id, has_more = [], forward[-1][0], True
+        while has_more:
+            items, has_more = await get_board_items_page(1, board.id, 3, before_id=before_id)
+            backward.append([item.id for item in items])
+            before_id = items[0].id
+        return forward, backward
+
+    forward, backward = run(walk())
+    ids = [item.id for item in expected]
+    assert forward == [ids[0:3], ids[3:6], ids[6:8]]
+    assert backward == [ids[3:6], ids[0:3]]
+
+
+def test_show_navigation_carries_the_edge_ids(board, run, monkeypatch):
+    board, expected = board
+    monkeypatch.setattr("handler.database_handler.SHOW_PAGE_SIZE", 3)
+
+    async def pages():
+        _, first = await render_board_page(1, board)
+        after_id, before_id = parse_page_cursor(first.inline_keyboard[0][0].callback_data)
+        message, second = await render_board_page(1, board, after_id, before_id)
+        return first, message, second
+
+    first, message, second = run(pages())
+    assert [button.callback_data for button in first.inline_keyboard[0]] == [f"show:{board.id}:n:{expected[2].id}"]
+    assert [button.callback_data for button in second.inline_keyboard[0]] == [
+        f"show:{board.id}:p:{expected[3].id}", f"show:{board.id}:n:{expected[5].id}"
+    ]
+    assert message.count("• ") == 3
+
+
+def test_stale_cursor_falls_back_to_the_first_page(board, run, monkeypatch):
+    board, expected = board
+    monkeypatch.setattr("handler.database_handler.SHOW_PAGE_SIZE", 3)
+
+    async def page_after_deleted_item():
+        await remove_item_by_id(1, expected[2].id)
+        return await render_board_page(1, board, after_id=expected[2].id)
+
+    message, markup = run(page_after_deleted_item())
+    assert message.splitlines()[2:5] == [f"• {item.title}" for item in (expected[0], expected[1], expected[3])]
+    assert markup.inline_keyboard[0][0].callback_data == f"show:{board.id}:n:{expected[3].id}"
+
+
+def test_board_selection_pages(add_user, run, monkeypatch):
+    monkeypatch.setattr("handler.database_handler.BOARD_PAGE_SIZE", 2)
+
+    async def pages():
+        await add_user(1, boards=("d", "a", "c", "b", "e"))
+        first = await board_selection_markup(1)
+        boards, _ = await get_user_boards_page(1, 2)
+        second = await board_selection_markup(1, after_id=boards[-1].id)
+        return first, second
+
+    def names(markup):
+        return [row[0].text.split(" ", 1)[1] for row in markup.inline_keyboard[:2]]
+
+    first, second = run(pages())
+    assert names(first) == ["a", "b"]
+    assert names(second) == ["c", "d"]
+    assert [button.text for button in second.inline_keyboard[2]] == ["⬅️ Назад", "Вперёд ➡️"]
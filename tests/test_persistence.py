@@ -0,0 +1,104 @@
+import asyncio
+
+from sqlalchemy import select
+from sqlalchemy.exc import OperationalError
+
+from database.database import AsyncSessionLocal, BotState
+from database.persistence import DatabasePersistence
+
+
+async def rows() -> dict:
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(select(BotState.namespace, BotState.key, BotState.data))
+        return {(namespace, key): data for namespace, key, data in result.all()}
+
+
+def test_state_survives_a_restart(database, run):
+    async def scenario():
+        persistence = DatabasePersistence()
+        await asyncio.gather(
+            persistence.update_user_data(1, {"temp_item": {"title": "Заметка"}}),
+            persistence.update_conversation("add_item", (1, 1), 2),
+        )
+        await persistence.flush()
+
+        restarted = DatabasePersistence()
+        return await restarted.get_user_data(), await restarted.get_conversations("add_item")
+
+    user_data, conversations = run(scenario())
+    assert user_data == {1: {"temp_item": {"title": "Заметка"}}}
+    assert conversations == {(1, 1): 2}
+
+
+def test_one_run_is_written_as_one_batch(database, run, monkeypatch):
+    async def scenario():
+        persistence = DatabasePersistence()
+        batches = []
+        write_batch = persistence.write_batch
+
+        async def counted():
+            batches.append(dict(persistence.pending))
+            await write_batch()
+
+        monkeypatch.setattr(persistence, "write_batch", counted)
+        await asyncio.gather(*(persistence.update_user_data(user_id, {"n": user_id}) for user_id in range(5)))
+        return batches
+
+    batches = run(scenario())
+    assert len(batches) == 1 and len(batches[0]) == 5
+    assert len(run(rows())) == 5
+
+
+def test_unchanged_and_empty_state(database, run):
+    async def scenario():
+        persistence = DatabasePersistence()
+        await persistence.update_user_data(1, {"a": 1})
+        await persistence.update_user_data(2, {"b": 2})
+
+        restarted = DatabasePersistence()
+        await restarted.get_user_data()
+        await restarted.queue("user_data", "1", '{"a": 1}')
+        skipped = dict(restarted.pending)
+        await restarted.update_user_data(2, {})
+        return skipped, await rows()
+
+    skipped, stored = run(scenario())
+    assert skipped == {}
+    assert stored == {("user_data", "1"): '{"a": 1}'}
+
+
+def test_failed_batches_are_retried(database, run, monkeypatch):
+    failures = []
+
+    class FailingOnce:
+        def __init__(self):
+            self.session = AsyncSessionLocal()
+
+        async def __aenter__(self):
+            db = await self.session.__aenter__()
+            if not failures:
+                failures.append(1)
+
+                async def commit():
+                    raise OperationalError("INSERT", {}, Exception("database is locked"))
+
+                db.commit = commit
+            return db
+
+        async def __aexit__(self, *exc_info):
+            return await self.session.__aexit__(*exc_info)
+
+    monkeypatch.setattr("database.persistence.AsyncSessionLocal", FailingOnce)
+
+    async def scenario():
+        persistence = DatabasePersistence(flush_interval_ms=10)
+        await persistence.update_user_data(1, {"a": 1})
+        pending_after_failure = dict(persistence.pending)
+        await persistence.update_user_data(2, {"b": 2})
+        while persistence.retry_task is not None or persistence.pending:
+            await asyncio.sleep(0.01)
+        return pending_after_failure, await rows()
+
+    pending_after_failure, stored = run(scenario())
+    assert pending_after_failure == {("user_data", "1"): '{"a": 1}'}
+    assert stored == {("user_data", "1"): '{"a": 1}', ("user_data", "2"): '{"b": 2}'}
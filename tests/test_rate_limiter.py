@@ -0,0 +1,107 @@
+import asyncio
+import datetime
+
+import pytest
+from telegram import Chat, Message, Update, User
+
+from handler.throttle_handler import throttled_user
+from utils.rate_limiter import RateLimiter, ConcurrencyLimiter, OverloadedError, route_limiters, bot_limiters
+
+
+def test_bucket_allows_bursts_up_to_capacity():
+    limiter = RateLimiter("test", 3, 60, shared=False)
+
+    assert [limiter.hit("user:1") for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert limiter.hit("user:1") == pytest.approx(20, rel=0.01)
+    assert limiter.hit("user:2") == 0.0
+
+
+def test_buckets_are_capped_at_max_keys():
+    limiter = RateLimiter("test", 1, 60, max_keys=3, shared=False)
+    for index in range(10):
+        limiter.hit(f"user:{index}")
+    limiter.hit("user:8")
+    limiter.hit("user:10")
+
+    assert list(limiter.buckets) == ["user:9", "user:8", "user:10"]
+
+
+def test_concurrency_limiter_rejects_beyond_the_queue():
+    async def scenario():
+        limiter = ConcurrencyLimiter(max_concurrent=1, max_queue=1, queue_timeout=0.05)
+        async with limiter:
+            waiting = asyncio.create_task(limiter.__aenter__())
+            await asyncio.sleep(0)
+            with pytest.raises(OverloadedError):
+                await limiter.__aenter__()
+            with pytest.raises(OverloadedError):
+                await waiting
+        assert (limiter.in_flight, limiter.waiting) == (0, 0)
+
+    asyncio.run(scenario())
+
+
+def test_concurrency_limiter_split_divides_the_slots():
+    limiter = ConcurrencyLimiter(max_concurrent=8, max_queue=32, queue_timeout=1)
+    limiter.split(4)
+
+    assert (limiter.max_concurrent, limiter.max_queue) == (2, 8)
+
+
+@pytest.fixture
+def read_limit(monkeypatch):
+    limiter = route_limiters["read"]
+    monkeypatch.setattr(limiter, "capacity", 2)
+    monkeypatch.setattr(limiter, "rate", 2 / 60)
+    monkeypatch.setattr(limiter, "buckets", type(limiter.buckets)())
+    return limiter
+
+
+def test_invalid_tokens_do_not_spend_the_users_bucket(read_limit, add_user, api_client, run):
+    async def scenario():
+        await add_user(1, token="valid")
+        async with api_client() as client:
+            for _ in range(5):
+                response = await client.get("/users/1/stats", headers={"X-Auth-Token": "forged"})
+                assert response.status_code == 401
+            statuses = [
+                (await client.get("/users/1/stats", headers={"X-Auth-Token": "valid"})).status_code
+                for _ in range(3)
+            ]
+        return statuses
+
+    statuses = run(scenario())
+    assert statuses == [200, 200, 429]
+    assert set(read_limit.buckets) == {"token:valid", "user:1"}
+
+
+def test_limited_response_carries_retry_after(read_limit, add_user, api_client, run):
+    async def scenario():
+        await add_user(1, token="valid")
+        async with api_client() as client:
+            for _ in range(2):
+                await client.get("/users/1/stats", headers={"X-Auth-Token": "valid"})
+            return await client.get("/users/1/stats", headers={"X-Auth-Token": "valid"})
+
+    response = run(scenario())
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) == 30
+
+
+def message_update(user_id: int, **kwargs) -> Update:
+    message = Message(
+        message_id=1, date=datetime.datetime.now(datetime.timezone.utc), chat=Chat(id=user_id, type="private"),
+        from_user=User(id=user_id, first_name="Test", is_bot=False), **kwargs
+    )
+    return Update(update_id=1, message=message)
+
+
+def test_bot_filter_throttles_per_user(monkeypatch):
+    limiter = bot_limiters["message"]
+    monkeypatch.setattr(limiter, "capacity", 2)
+    monkeypatch.setattr(limiter, "buckets", type(limiter.buckets)())
+
+    results = [throttled_user.filter(message_update(7, text="hi")) for _ in range(3)]
+
+    assert results == [False, False, True]
+    assert throttled_user.filter(message_update(8, text="hi")) is False
@@ -0,0 +1,171 @@
+import asyncio
+import datetime
+import time
+
+import pytest
+from telegram.error import RetryAfter
+from telegram.ext import Application
+
+import api.main
+from utils.send_scheduler import SendScheduler, PRIORITY_INTERACTIVE, PRIORITY_NOTIFICATION
+
+
+def scheduler(**kwargs) -> SendScheduler:
+    kwargs.setdefault("overall_rate", "1000/1")
+    kwargs.setdefault("private_chat_rate", "1000/1")
+    kwargs.setdefault("max_retries", 2)
+    return SendScheduler(**kwargs)
+
+
+async def send(limiter: SendScheduler, callback, endpoint: str = "sendMessage", chat_id=1, priority=None):
+    return await limiter.process_request(callback, (), {}, endpoint, {"chat_id": chat_id}, priority)
+
+
+def test_unlimited_endpoints_pass_straight_through():
+    async def scenario():
+        limiter = scheduler(overall_rate="1/60")
+        await limiter.initialize()
+        calls = []
+
+        async def callback():
+            calls.append(time.monotonic())
+            return True
+
+        results = [await send(limiter, callback, endpoint="getFile") for _ in range(5)]
+        return results, calls
+
+    results, calls = asyncio.run(scenario())
+    assert results == [True] * 5 and len(calls) == 5
+
+
+def test_chat_limit_spaces_messages_to_one_chat():
+    async def scenario():
+        limiter = scheduler(private_chat_rate="2/0.1")
+        await limiter.initialize()
+        sent = []
+
+        async def callback(chat_id):
+            sent.append((chat_id, time.monotonic()))
+
+        started_at = time.monotonic()
+        await asyncio.gather(*(send(limiter, lambda: callback(1)) for _ in range(4)),
+                             send(limiter, lambda: callback(2), chat_id=2))
+        return started_at, sent
+
+    started_at, sent = asyncio.run(scenario())
+    first_chat = [at - started_at for chat_id, at in sent if chat_id == 1]
+    other_chat = [at - started_at for chat_id, at in sent if chat_id == 2]
+    assert first_chat[-1] >= 0.09
+    assert other_chat[0] < 0.05
+
+
+def test_interactive_replies_overtake_queued_notifications():
+    async def scenario():
+        limiter = scheduler(overall_rate="1/0.02")
+        await limiter.initialize()
+        order = []
+
+        async def callback(name):
+            order.append(name)
+
+        await send(limiter, lambda: callback("first"))
+        notifications = [
+            asyncio.create_task(send(limiter, lambda index=index: callback(f"notification {index}"),
+                                     chat_id=10 + index, priority=PRIORITY_NOTIFICATION))
+            for index in range(3)
+        ]
+        await asyncio.sleep(0)
+        reply = asyncio.create_task(send(limiter, lambda: callback("reply"), chat_id=99, priority=PRIORITY_INTERACTIVE))
+        await asyncio.gather(*notifications, reply)
+        return order
+
+    order = asyncio.run(scenario())
+    assert order[:2] == ["first", "reply"]
+
+
+def test_retry_after_blocks_the_chat_and_retries():
+    async def scenario():
+        limiter = scheduler()
+        await limiter.initialize()
+        attempts = []
+
+        async def callback():
+            attempts.append(time.monotonic())
+            if len(attempts) == 1:
+                raise RetryAfter(datetime.timedelta(seconds=0))
+            return "sent"
+
+        return await send(limiter, callback), attempts, limiter
+
+    result, attempts, limiter = asyncio.run(scenario())
+    assert result == "sent"
+    assert attempts[1] - attempts[0] >= 0.09
+    assert limiter.blocked_until == 0.0
+
+
+def test_gives_up_after_max_retries():
+    async def scenario():
+        limiter = scheduler(max_retries=1)
+        await limiter.initialize()
+        attempts = []
+
+        async def callback():
+            attempts.append(1)
+            raise RetryAfter(datetime.timedelta(seconds=0))
+
+        with pytest.raises(RetryAfter):
+            await send(limiter, callback, chat_id=None)
+        return attempts
+
+    assert len(asyncio.run(scenario())) == 2
+
+
+@pytest.fixture
+def notifications(monkeypatch):
+    initialized = []
+    sent = []
+
+    async def initialize(self):
+        await asyncio.sleep(0.01)
+        initialized.append(self)
+
+    async def send_connection_request(user_id, connect_id, client_name, application):
+        sent.append((user_id, connect_id, application))
+
+    monkeypatch.setattr(Application, "initialize", initialize)
+    monkeypatch.setattr(api.main, "send_connection_request", send_connection_request)
+    monkeypatch.setattr(api.main, "TOKEN", "123:test")
+    monkeypatch.setattr(api.main, "bot_application", None)
+    monkeypatch.setattr(api.main, "notifier", None)
+    return initialized, sent
+
+
+def test_startup_does_not_contact_telegram(notifications):
+    initialized, _ = notifications
+
+    async def scenario():
+        async with api.main.lifespan(api.main.app):
+            pass
+
+    asyncio.run(scenario())
+    assert initialized == []
+
+
+def test_notification_bot_is_initialized_once_on_first_use(notifications):
+    initialized, sent = notifications
+
+    async def scenario():
+        await asyncio.gather(*(api.main.notify_connection_request(1, f"code{index}", "tests") for index in range(3)))
+
+    asyncio.run(scenario())
+    assert len(initialized) == 1
+    assert [application for _, _, application in sent] == [initialized[0]] * 3
+
+
+def test_a_runner_owned_bot_is_used_as_is(notifications, monkeypatch):
+    initialized, sent = notifications
+    owned = object()
+    monkeypatch.setattr(api.main, "bot_application", owned)
+
+    asyncio.run(api.main.notify_connection_request(1, "code", "tests"))
+    assert initialized == [] and sent == [(1, "code", owned)]
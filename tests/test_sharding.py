@@ -0,0 +1,91 @@
+import logging
+import multiprocessing
+import queue
+import sys
+
+import pytest
+
+import run
+from utils.sharding import HashRing, UpdateRouter
+
+
+def message(update_id: int, user_id: int) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": 0, "text": "hi",
+            "chat": {"id": user_id, "type": "private"}, "from": {"id": user_id, "is_bot": False, "first_name": "Test"},
+        },
+    }
+
+
+def test_ring_spreads_keys_over_all_nodes():
+    ring = HashRing(4)
+    counts = [0] * 4
+    for user_id in range(4000):
+        counts[ring.node_for(user_id)] += 1
+
+    assert all(700 < count < 1300 for count in counts)
+
+
+def test_adding_a_node_moves_only_its_share_of_keys():
+    before, after = HashRing(4), HashRing(5)
+    moved = [user_id for user_id in range(5000) if before.node_for(user_id) != after.node_for(user_id)]
+
+    assert all(after.node_for(user_id) == 4 for user_id in moved)
+    assert len(moved) < 5000 * 0.3
+
+
+def test_router_keeps_a_users_updates_on_one_worker():
+    queues = [queue.SimpleQueue() for _ in range(3)]
+    router = UpdateRouter(queues)
+    callback = {
+        "update_id": 100,
+        "callback_query": {
+            "id": "1", "chat_instance": "1", "data": "x",
+            "from": {"id": 42, "is_bot": False, "first_name": "Test"},
+        },
+    }
+    for update_id in range(5):
+        router(message(update_id, 42))
+    router(callback)
+
+    worker = router.ring.node_for(42)
+    assert queues[worker].qsize() == 6
+    assert [queues[worker].get_nowait()["update_id"] for _ in range(6)] == [0, 1, 2, 3, 4, 100]
+
+
+def test_updates_without_a_user_are_spread_by_update_id():
+    router = UpdateRouter([queue.SimpleQueue() for _ in range(3)])
+
+    assert router.worker_for({"update_id": 7}) == router.ring.node_for(7)
+
+
+def test_supervisor_restarts_exited_processes(monkeypatch, caplog):
+    context = multiprocessing.get_context("fork")
+    targets = {"pintag-test": (sys.exit, (3,))}
+    processes = {name: run.start_process(context, name, *target) for name, target in targets.items()}
+    first = processes["pintag-test"]
+    sleeps = []
+
+    def sleep(seconds):
+        for process in processes.values():
+            process.join()
+        sleeps.append(seconds)
+        if len(sleeps) > 1:
+            raise KeyboardInterrupt
+
+    monkeypatch.setattr(run.time, "sleep", sleep)
+    with caplog.at_level(logging.WARNING), pytest.raises(KeyboardInterrupt):
+        run.supervise_processes(context, targets, processes)
+
+    assert processes["pintag-test"] is not first
+    assert processes["pintag-test"].exitcode == 3
+    assert "pintag-test exited with code 3, restarting" in caplog.text
+
+
+def test_master_bot_uses_the_configured_api(monkeypatch):
+    monkeypatch.setattr(run, "TOKEN", "123:test")
+    monkeypatch.setattr(run, "TELEGRAM_API_URL", "http://telegram.local/bot")
+
+    assert run.bare_bot().base_url == "http://telegram.local/bot123:test"
@@ -0,0 +1,80 @@
+import asyncio
+
+import pytest
+
+from files.storage_backend import StorageBackend, S3StorageBackend
+
+moto = pytest.importorskip("moto")
+pytest.importorskip("boto3")
+
+BUCKET = "pintag-test"
+MB = 1024 * 1024
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    with moto.mock_aws():
+        backend = S3StorageBackend(bucket=BUCKET, endpoint_url=None, region="us-east-1",
+                                   multipart_threshold=6 * MB, multipart_chunk=5 * MB)
+        backend.connection().create_bucket(Bucket=BUCKET)
+        yield backend
+
+
+def test_storage_backend_is_abstract():
+    with pytest.raises(TypeError):
+        StorageBackend()
+
+
+def test_put_get_delete(s3):
+    async def scenario():
+        key = await s3.save_file(b"file contents", 1, "documents", "a.txt")
+        await s3.save_variant(b"thumbnail", key, "thumb")
+
+        assert await s3.get(key) == b"file contents"
+        assert (await s3.stat(key))[0] == len(b"file contents")
+        assert await s3.variant_paths(key) == [key + ".thumb.jpg"]
+
+        await s3.delete_file(key)
+        assert await s3.stat(key) is None
+        assert await s3.list_keys(key) == []
+        with pytest.raises(FileNotFoundError):
+            await s3.get(key)
+
+    asyncio.run(scenario())
+
+
+def test_large_files_use_multipart_uploads(s3):
+    data = bytes(range(256)) * (11 * MB // 256)
+
+    async def scenario():
+        await s3.put("users_files/1/videos/big.mp4", data)
+        assert await s3.get("users_files/1/videos/big.mp4") == data
+
+    asyncio.run(scenario())
+    etag = s3.connection().head_object(Bucket=BUCKET, Key="users_files/1/videos/big.mp4")["ETag"]
+    assert etag.strip('"').endswith("-3")
+
+
+def test_failed_stream_aborts_the_upload(s3):
+    async def chunks():
+        yield b"x" * 6 * MB
+        raise ConnectionError("client went away")
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(s3.put_stream("users_files/1/videos/partial.mp4", chunks()))
+
+    assert not s3.connection().list_multipart_uploads(Bucket=BUCKET).get("Uploads")
+    assert asyncio.run(s3.stat("users_files/1/videos/partial.mp4")) is None
+
+
+def test_ranges_and_streams(s3):
+    data = bytes(range(256)) * 64
+
+    async def scenario():
+        await s3.put("users_files/1/photos/a.jpg", data)
+        assert await s3.get_range("users_files/1/photos/a.jpg", 100, 50) == data[100:150]
+        assert b"".join([chunk async for chunk in s3.stream("users_files/1/photos/a.jpg", 4096)]) == data
+
+    asyncio.run(scenario())
@@ -0,0 +1,79 @@
+import asyncio
+import datetime
+
+from telegram import Chat, Message, Update, User
+
+from utils.update_processor import PerUserUpdateProcessor
+
+
+def update(update_id: int, user_id: int) -> Update:
+    message = Message(
+        message_id=update_id, date=datetime.datetime.now(datetime.timezone.utc),
+        chat=Chat(id=user_id, type="private"), from_user=User(id=user_id, first_name="Test", is_bot=False),
+        text=str(update_id),
+    )
+    return Update(update_id=update_id, message=message)
+
+
+async def handle(log: list, name, delay: float):
+    log.append(("start", name))
+    await asyncio.sleep(delay)
+    log.append(("end", name))
+
+
+def test_updates_of_one_user_run_in_order():
+    async def scenario():
+        processor = PerUserUpdateProcessor(8)
+        log = []
+        # The first update is the slowest, a later one must still wait for it.
+        await asyncio.gather(*(
+            processor.process_update(update(index, 1), handle(log, index, delay))
+            for index, delay in enumerate([0.03, 0.0, 0.01])
+        ))
+        return log, processor
+
+    log, processor = asyncio.run(scenario())
+    assert log == [("start", 0), ("end", 0), ("start", 1), ("end", 1), ("start", 2), ("end", 2)]
+    assert processor.user_locks == {} and processor.user_pending == {}
+
+
+def test_different_users_run_concurrently():
+    async def scenario():
+        processor = PerUserUpdateProcessor(8)
+        log = []
+        await asyncio.gather(*(
+            processor.process_update(update(user_id, user_id), handle(log, user_id, 0.02)) for user_id in (1, 2, 3)
+        ))
+        return log
+
+    log = asyncio.run(scenario())
+    assert [event for event, _ in log[:3]] == ["start"] * 3
+
+
+def test_slots_bound_concurrency_across_users():
+    async def scenario():
+        processor = PerUserUpdateProcessor(2)
+        peak = 0
+
+        async def tracked():
+            nonlocal peak
+            peak = max(peak, processor.in_flight)
+            await asyncio.sleep(0.01)
+
+        await asyncio.gather(*(processor.process_update(update(user_id, user_id), tracked()) for user_id in range(6)))
+        return peak, processor.in_flight
+
+    assert asyncio.run(scenario()) == (2, 0)
+
+
+def test_flooding_user_holds_one_slot():
+    async def scenario():
+        processor = PerUserUpdateProcessor(2)
+        log = []
+        flood = [processor.process_update(update(index, 1), handle(log, ("flood", index), 0.01)) for index in range(5)]
+        other = processor.process_update(update(100, 2), handle(log, "other", 0))
+        await asyncio.gather(*flood, other)
+        return log
+
+    log = asyncio.run(scenario())
+    assert log.index(("end", "other")) < log.index(("end", ("flood", 1)))
@@ -0,0 +1,113 @@
+import asyncio
+
+import pytest
+
+from database.database_worker import get_board_by_name, get_item_by_id, create_new_item, get_user_key
+from files.encryption_manager import encryption_manager, uses_data_key
+from files.key_rotation import reencrypt_all
+from files.storage_backend import storage
+from files.user_keys import user_keys
+from utils.rate_limiter import upload_limiter
+
+
+async def upload(api_client, title: str) -> int:
+    board = await get_board_by_name(1, "Неотсортированное")
+    async with api_client() as client:
+        response = await client.post(
+            "/users/1/items/upload", headers={"X-Auth-Token": "valid"},
+            data={"board_id": str(board.id), "title": title, "content_type": "document"},
+            files={"file": ("notes.txt", b"user file")},
+        )
+    return response.json()["item_id"]
+
+
+@pytest.fixture
+def uploads(add_user, api_client, monkeypatch):
+    # The semaphore belongs to the first loop that waits on it, every test runs its own loop.
+    monkeypatch.setattr(upload_limiter, "semaphore", asyncio.Semaphore(upload_limiter.max_concurrent))
+
+    async def uploads(*titles: str) -> list:
+        await add_user(1, token="valid")
+        return [await get_item_by_id(1, await upload(api_client, title)) for title in titles]
+
+    return uploads
+
+
+def test_uploads_are_on_the_users_data_key(uploads, run):
+    async def scenario():
+        item, = await uploads("Файл")
+        encrypted_data = await storage.get(item.file_path)
+        return item, encrypted_data, encryption_manager.decrypt_file(
+            encrypted_data, await user_keys.for_reading(1, encrypted_data)
+        )
+
+    item, encrypted_data, contents = run(scenario())
+
+    assert item.data_key and uses_data_key(encrypted_data)
+    assert contents == b"user file"
+
+
+def test_without_data_keys_uploads_are_on_the_master_key(uploads, run, monkeypatch):
+    monkeypatch.setattr("files.user_keys.USER_DATA_KEYS", False)
+
+    async def scenario():
+        item, = await uploads("Файл")
+        return item, await storage.get(item.file_path)
+
+    item, encrypted_data = run(scenario())
+
+    assert item.data_key is False and not uses_data_key(encrypted_data)
+    assert encryption_manager.decrypt_file(encrypted_data) == b"user file"
+
+
+def test_reencrypt_marks_files_moved_to_a_data_key(uploads, run, monkeypatch):
+    monkeypatch.setattr("files.user_keys.USER_DATA_KEYS", False)
+    item, = run(uploads("Файл"))
+    monkeypatch.setattr("files.user_keys.USER_DATA_KEYS", True)
+
+    async def scenario():
+        await reencrypt_all(max_mb_per_s=0, max_cpu=1, restart=True)
+        return await get_item_by_id(1, item.id), await storage.get(item.file_path)
+
+    moved, encrypted_data = run(scenario())
+
+    assert moved.data_key and uses_data_key(encrypted_data)
+
+
+def test_delete_users_shreds_keys_and_deletes_readable_files(uploads, add_user, run, monkeypatch):
+    async def setup():
+        data_key_item, = await uploads("Файл")
+        board = await get_board_by_name(1, "Неотсортированное")
+        # Written before per-user keys: encrypted with the master key and no data_key flag on the row.
+        legacy_path = await storage.save_file(encryption_manager.encrypt_file(b"legacy"), 1, "documents", "a.txt")
+        legacy_thumb = await storage.save_variant(encryption_manager.encrypt_file(b"thumb"), legacy_path, "thumb")
+        await create_new_item(1, board.id, "legacy", "document", None, legacy_path, 0, True, data_key=None)
+        plain_path = await storage.save_file(b"not encrypted", 1, "documents", "b.txt")
+        await create_new_item(1, board.id, "plain", "document", None, plain_path, 0, False)
+        await add_user(2, boards=("Неотсортированное",))
+        other_path = await storage.save_file(encryption_manager.encrypt_file(b"other"), 2, "documents", "c.txt")
+        other_board = await get_board_by_name(2, "Неотсортированное")
+        await create_new_item(2, other_board.id, "other", "document", None, other_path, 0, True, data_key=None)
+        return data_key_item.file_path, legacy_path, legacy_thumb, plain_path, other_path
+
+    data_key_path, legacy_path, legacy_thumb, plain_path, other_path = run(setup())
+    reads = []
+    monkeypatch.setattr(storage, "get_range", lambda *args: reads.append(args))
+    monkeypatch.setattr(storage, "get", lambda *args: reads.append(args))
+
+    deleted = run(user_keys.delete_users([1]))
+    monkeypatch.undo()
+
+    async def check():
+        return (
+            {path: await storage.exists(path) for path in (data_key_path, legacy_path, legacy_thumb, plain_path)},
+            await get_user_key(1), await storage.exists(other_path), await get_board_by_name(2, "Неотсортированное")
+        )
+
+    exists, user_key, other_exists, other_board = run(check())
+    assert deleted == 2 and reads == []
+    assert exists == {data_key_path: True, legacy_path: False, legacy_thumb: False, plain_path: False}
+    assert user_key is None
+    assert other_exists and other_board is not None
+    with pytest.raises(FileNotFoundError):
+        run(user_keys.for_reading(1, run(storage.get(data_key_path))))
@@ -0,0 +1,72 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from telegram import Bot
+
+import api.main
+
+UPDATE = {
+    "update_id": 10,
+    "message": {
+        "message_id": 1, "date": 0, "text": "/start",
+        "chat": {"id": 5, "type": "private"}, "from": {"id": 5, "is_bot": False, "first_name": "Test"},
+    },
+}
+
+
+@pytest.fixture
+def webhook(monkeypatch, api_client):
+    monkeypatch.setattr(api.main, "WEBHOOK_SECRET", "s3cret")
+
+    async def post(secret: str = None):
+        headers = {"X-Telegram-Bot-Api-Secret-Token": secret} if secret else {}
+        async with api_client() as client:
+            return await client.post(api.main.WEBHOOK_PATH, json=UPDATE, headers=headers)
+
+    return post
+
+
+@pytest.mark.parametrize("secret", [None, "wrong", "s3cret-but-longer"])
+def test_rejects_requests_without_the_secret(webhook, run, monkeypatch, secret):
+    routed = []
+    monkeypatch.setattr(api.main, "update_router", routed.append)
+
+    assert run(webhook(secret)).status_code == 403
+    assert routed == []
+
+
+def test_rejects_everything_when_no_secret_is_configured(webhook, run, monkeypatch):
+    monkeypatch.setattr(api.main, "WEBHOOK_SECRET", None)
+    monkeypatch.setattr(api.main, "update_router", [].append)
+
+    assert run(webhook("s3cret")).status_code == 403
+
+
+def test_routes_updates_to_workers(webhook, run, monkeypatch):
+    routed = []
+    monkeypatch.setattr(api.main, "update_router", routed.append)
+
+    assert run(webhook("s3cret")).json() == {"ok": True}
+    assert routed == [UPDATE]
+
+
+def test_queues_updates_for_the_running_bot(webhook, run, monkeypatch):
+    monkeypatch.setattr(api.main, "update_router", None)
+
+    async def scenario():
+        application = SimpleNamespace(running=True, bot=Bot("123:test"), update_queue=asyncio.Queue())
+        monkeypatch.setattr(api.main, "bot_application", application)
+        response = await webhook("s3cret")
+        return response, application.update_queue.get_nowait()
+
+    response, update = run(scenario())
+    assert response.status_code == 200
+    assert (update.update_id, update.effective_user.id, update.message.text) == (10, 5, "/start")
+
+
+def test_unavailable_while_the_bot_is_stopped(webhook, run, monkeypatch):
+    monkeypatch.setattr(api.main, "update_router", None)
+    monkeypatch.setattr(api.main, "bot_application", None)
+
+    assert run(webhook("s3cret")).status_code == 503
@@ -0,0 +1,206 @@
+import datetime
+import functools
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+from sqlalchemy import inspect, DateTime
+
+from utils.metrics import registry
+
+try:
+    import redis.asyncio as redis
+except ImportError:
+    redis = None
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "local").lower()
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0")
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", 100_000))
+CACHE_TTL = float(os.getenv("CACHE_TTL", 300))
+
+MISSING = object()
+
+cache_requests_total = registry.counter(
+    "pintag_cache_requests_total", "Shared cache lookups in front of the database", ("namespace", "result")
+)
+cache_invalidations_total = registry.counter(
+    "pintag_cache_invalidations_total", "Shared cache invalidations triggered by writes", ("namespace",)
+)
+
+
+def dump_rows(value):
+    # Only plain column values are cached, a shared cache must never hand out objects it did not build itself.
+    if value is None:
+        return None
+    if isinstance(value, (list, tuple)):
+        return [dump_rows(row) for row in value]
+
+    columns = {}
+    for attribute in inspect(value).mapper.column_attrs:
+        column_value = getattr(value, attribute.key)
+        columns[attribute.key] = column_value.isoformat() if isinstance(column_value, datetime.datetime) \
+            else column_value
+    return columns
+
+
+def load_rows(model, value):
+    if value is None:
+        return None
+    if isinstance(value, list):
+        return [load_rows(model, row) for row in value]
+
+    columns = dict(value)
+    for attribute in inspect(model).column_attrs:
+        if isinstance(attribute.columns[0].type, DateTime) and columns.get(attribute.key) is not None:
+            columns[attribute.key] = datetime.datetime.fromisoformat(columns[attribute.key])
+    return model(**columns)
+
+
+class LocalCacheBackend:
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.entries: OrderedDict[str, tuple[float, int, object]] = OrderedDict()
+        self.generations: dict[str, int] = {}
+
+
+    async def get(self, generation_key: str, key: str) -> tuple[int, object]:
+        generation = self.generations.get(generation_key, 0)
+        entry = self.entries.get(key)
+        if entry is None or entry[0] < time.monotonic() or entry[1] != generation:
+            return generation, MISSING
+
+        self.entries.move_to_end(key)
+        return generation, entry[2]
+
+
+    async def set(self, key: str, generation: int, value, ttl: float):
+        self.entries[key] = (time.monotonic() + ttl, generation, value)
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+
+    async def bump(self, generation_key: str):
+        self.generations[generation_key] = self.generations.get(generation_key, 0) + 1
+
+
+class RedisCacheBackend:
+    def __init__(self, url: str = CACHE_REDIS_URL, prefix: str = "pintag:cache:", client=None):
+        if client is None and redis is None:
+            raise RuntimeError("CACHE_BACKEND=redis requires the 'redis' package")
+        self.url = url
+        self.prefix = prefix
+        self.client = client
+        self.pid = os.getpid() if client is not None else None
+
+
+    def connection(self):
+        # Connection pools must not cross a fork, so every worker process opens its own.
+        if self.pid != os.getpid():
+            self.client = redis.from_url(self.url)
+            self.pid = os.getpid()
+        return self.client
+
+
+    async def get(self, generation_key: str, key: str) -> tuple[int, object]:
+        # The generation is read in the same round trip, so a value written before an invalidation never wins.
+        try:
+            raw_generation, raw_value = await self.connection().mget(self.prefix + generation_key, self.prefix + key)
+        except (redis.RedisError, OSError) as e:
+            logger.warning(f"Cache backend unavailable, reading from the database: {e}")
+            return None, MISSING
+
+        generation = int(raw_generation or 0)
+        if raw_value is None:
+            return generation, MISSING
+        try:
+            stored_generation, value = json.loads(raw_value)
+        except ValueError:
+            return generation, MISSING
+        return generation, value if stored_generation == generation else MISSING
+
+
+    async def set(self, key: str, generation: int, value, ttl: float):
+        if generation is None:
+            return
+        try:
+            await self.connection().set(self.prefix + key, json.dumps([generation, value]), px=int(ttl * 1000))
+        except (redis.RedisError, OSError) as e:
+            logger.warning(f"Failed to store cache entry {key}: {e}")
+
+
+    async def bump(self, generation_key: str):
+        try:
+            await self.connection().incr(self.prefix + generation_key)
+        except (redis.RedisError, OSError) as e:
+            logger.error(f"Failed to invalidate cache {generation_key}: {e}")
+
+
+class Cache:
+    def __init__(self, namespace: str, ttl: float = CACHE_TTL):
+        self.namespace = namespace
+        self.ttl = ttl
+
+
+    def generation_key(self, user_id: int) -> str:
+        return f"{self.namespace}:{user_id}:generation"
+
+
+    async def lookup(self, user_id: int, key: str) -> tuple[int, object]:
+        generation, value = await backend.get(
+            self.generation_key(user_id), f"{self.namespace}:{user_id}:{key}"
+        )
+        cache_requests_total.inc(namespace=self.namespace, result="miss" if value is MISSING else "hit")
+        return generation, value
+
+
+    async def store(self, user_id: int, key: str, generation: int, value):
+        await backend.set(f"{self.namespace}:{user_id}:{key}", generation, value, self.ttl)
+
+
+    async def invalidate(self, user_id: int):
+        # Every entry of the user carries the generation it was read under, so one increment drops them all.
+        cache_invalidations_total.inc(namespace=self.namespace)
+        await backend.bump(self.generation_key(user_id))
+
+
+def cached(cache: Cache, key_func, model):
+    # Every hit builds new detached model instances, callers never share an object through the cache.
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(user_id: int, *args, **kwargs):
+            key = key_func(*args, **kwargs)
+            generation, value = await cache.lookup(user_id, key)
+            if value is not MISSING:
+                return load_rows(model, value)
+
+            value = await func(user_id, *args, **kwargs)
+            await cache.store(user_id, key, generation, dump_rows(value))
+            return value
+
+        return wrapper
+
+    return decorator
+
+
+def configure_backend(name: str = CACHE_BACKEND, **kwargs):
+    global backend
+    if name == "redis":
+        backend = RedisCacheBackend(**kwargs)
+        logger.info(f"Shared cache stored in Redis at {backend.url}")
+    else:
+        backend = LocalCacheBackend(**kwargs)
+    return backend
+
+
+backend = configure_backend()
+
+boards_cache = Cache("boards")
+items_cache = Cache("items")
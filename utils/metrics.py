@@ -0,0 +1,284 @@
+import asyncio
+import functools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def escape_label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(label_names: tuple, label_values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{escape_label_value(value)}"' for name, value in zip(label_names, label_values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, label_names: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.lock = threading.Lock()
+
+
+    def label_values(self, labels: dict) -> tuple:
+        return tuple(labels.get(name, "") for name in self.label_names)
+
+
+    def header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, label_names: tuple = ()):
+        super().__init__(name, documentation, label_names)
+        self.values: dict[tuple, float] = {}
+
+
+    def inc(self, amount: float = 1, **labels):
+        key = self.label_values(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+    def render(self) -> list[str]:
+        with self.lock:
+            values = list(self.values.items())
+        return self.header() + [
+            f"{self.name}{format_labels(self.label_names, key)} {value}" for key, value in values
+        ]
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, label_names: tuple = (), callback=None):
+        super().__init__(name, documentation, label_names)
+        self.values: dict[tuple, float] = {}
+        self.callback = callback
+
+
+    def set(self, value: float, **labels):
+        with self.lock:
+            self.values[self.label_values(labels)] = value
+
+
+    def inc(self, amount: float = 1, **labels):
+        key = self.label_values(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+    def render(self) -> list[str]:
+        if self.callback:
+            try:
+                self.set(self.callback())
+            except Exception as e:
+                logger.warning(f"Gauge callback {self.name} failed: {e}")
+
+        with self.lock:
+            values = list(self.values.items())
+        return self.header() + [
+            f"{self.name}{format_labels(self.label_names, key)} {value}" for key, value in values
+        ]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, label_names: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+        self.series: dict[tuple, list] = {}
+
+
+    def observe(self, value: float, **labels):
+        key = self.label_values(labels)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [[0] * len(self.buckets), 0.0, 0]
+
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+
+    @contextmanager
+    def time(self, **labels):
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started_at, **labels)
+
+
+    def render(self) -> list[str]:
+        lines = self.header()
+        with self.lock:
+            series = [(key, list(counts), total, count) for key, (counts, total, count) in self.series.items()]
+
+        for key, counts, total, count in series:
+            labels = format_labels(self.label_names, key)
+            for bound, bucket_count in zip(self.buckets, counts):
+                bucket_labels = format_labels(self.label_names, key, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{bucket_labels} {bucket_count}")
+            inf_labels = format_labels(self.label_names, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{inf_labels} {count}")
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics: dict[str, Metric] = {}
+
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self.metrics:
+            return self.metrics[metric.name]
+        self.metrics[metric.name] = metric
+        return metric
+
+
+    def counter(self, name: str, documentation: str, label_names: tuple = ()) -> Counter:
+        return self.register(Counter(name, documentation, label_names))
+
+
+    def gauge(self, name: str, documentation: str, label_names: tuple = (), callback=None) -> Gauge:
+        return self.register(Gauge(name, documentation, label_names, callback))
+
+
+    def histogram(self, name: str, documentation: str, label_names: tuple = (),
+                  buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, label_names, buckets))
+
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+http_request_duration = registry.histogram(
+    "pintag_http_request_duration_seconds", "API request latency by route", ("method", "route", "status")
+)
+bot_handler_duration = registry.histogram(
+    "pintag_bot_handler_duration_seconds", "Telegram bot handler latency", ("handler", "outcome")
+)
+db_query_duration = registry.histogram(
+    "pintag_db_query_duration_seconds", "Latency of database_worker functions", ("function", "outcome")
+)
+crypto_bytes = registry.counter(
+    "pintag_crypto_bytes_total", "Bytes processed by EncryptionManager", ("operation",)
+)
+crypto_seconds = registry.counter(
+    "pintag_crypto_seconds_total", "Seconds spent in EncryptionManager", ("operation",)
+)
+crypto_throughput = registry.gauge(
+    "pintag_crypto_throughput_bytes_per_second", "Average EncryptionManager throughput", ("operation",)
+)
+file_io_bytes = registry.counter(
+    "pintag_file_io_bytes_total", "Bytes read or written by FileManager", ("operation",)
+)
+
+
+def timed_query(func):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        started_at = time.perf_counter()
+        outcome = "ok"
+        try:
+            return await func(*args, **kwargs)
+        except Exception:
+            outcome = "error"
+            raise
+        finally:
+            db_query_duration.observe(time.perf_counter() - started_at, function=func.__name__, outcome=outcome)
+
+    return wrapper
+
+
+def timed_handler(callback, name: str = None):
+    handler_name = name or getattr(callback, "__name__", repr(callback))
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        started_at = time.perf_counter()
+        outcome = "ok"
+        try:
+            return await callback(update, context)
+        except Exception:
+            outcome = "error"
+            raise
+        finally:
+            bot_handler_duration.observe(time.perf_counter() - started_at, handler=handler_name, outcome=outcome)
+
+    return wrapper
+
+
+@contextmanager
+def timed_crypto(operation: str, size: int):
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        crypto_seconds.inc(time.perf_counter() - started_at, operation=operation)
+        crypto_bytes.inc(size, operation=operation)
+
+        total_seconds = crypto_seconds.values.get((operation,), 0)
+        if total_seconds:
+            crypto_throughput.set(crypto_bytes.values.get((operation,), 0) / total_seconds, operation=operation)
+
+
+async def handle_metrics_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        request_line = await reader.readline()
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+
+        parts = request_line.decode(errors="replace").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+            status, body, content_type = "200 OK", registry.render().encode(), CONTENT_TYPE
+        else:
+            status, body, content_type = "404 Not Found", b"Not Found\n", "text/plain"
+
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except Exception as e:
+        logger.warning(f"Metrics request failed: {e}")
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(host: str, port: int) -> asyncio.AbstractServer:
+    server = await asyncio.start_server(handle_metrics_connection, host, port)
+    logger.info(f"Metrics available on http://{host}:{port}/metrics")
+    return server
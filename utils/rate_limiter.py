@@ -0,0 +1,168 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+from utils import shared_store
+from utils.metrics import registry
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+def parse_rate(value: str, default: str) -> tuple[int, float]:
+    try:
+        requests, seconds = (value or default).split("/")
+        return int(requests), float(seconds)
+    except ValueError:
+        logger.warning(f"Invalid rate limit '{value}', falling back to '{default}'")
+        requests, seconds = default.split("/")
+        return int(requests), float(seconds)
+
+
+class OverloadedError(Exception):
+    def __init__(self, retry_after: float):
+        super().__init__(f"Server is overloaded, retry after {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated_at")
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+
+    def consume(self, cost: float = 1) -> float:
+        self.refill()
+
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+
+        return (cost - self.tokens) / self.rate
+
+
+    def reserve(self, cost: float = 1) -> float:
+        # Takes the tokens even when they are not there yet and returns how long to wait for them,
+        # so concurrent callers are scheduled one after another without polling.
+        self.refill()
+        self.tokens -= cost
+        return max(0.0, -self.tokens / self.rate)
+
+
+    def block(self, seconds: float):
+        self.refill()
+        self.tokens = min(self.tokens, -seconds * self.rate)
+
+
+class RateLimiter:
+    def __init__(self, name: str, requests: int, seconds: float, max_keys: int = 100_000, shared: bool = True):
+        self.name = name
+        self.rate = requests / seconds
+        self.capacity = requests
+        self.max_keys = max_keys
+        self.shared = shared
+        self.buckets: OrderedDict[str, TokenBucket] = OrderedDict()
+
+
+    def hit(self, key: str, cost: float = 1) -> float:
+        if self.shared and shared_store.store is not None:
+            return shared_store.store.take_token(f"{self.name}:{key}", self.rate, self.capacity, cost)
+
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            # The least recently limited keys go first, a dropped bucket only starts full again.
+            while len(self.buckets) >= self.max_keys:
+                self.buckets.popitem(last=False)
+            bucket = self.buckets[key] = TokenBucket(self.rate, self.capacity)
+        else:
+            self.buckets.move_to_end(key)
+
+        return bucket.consume(cost)
+
+
+    async def take(self, key: str, cost: float = 1) -> float:
+        # The shared store waits on a file lock other processes hold, that must not stall the event loop.
+        if self.shared and shared_store.store is not None:
+            return await asyncio.to_thread(
+                shared_store.store.take_token, f"{self.name}:{key}", self.rate, self.capacity, cost
+            )
+        return self.hit(key, cost)
+
+
+class ConcurrencyLimiter:
+    def __init__(self, max_concurrent: int, max_queue: int, queue_timeout: float):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.semaphore = asyncio.Semaphore(max_concurrent)
+        self.in_flight = 0
+        self.waiting = 0
+
+
+    def split(self, processes: int):
+        # Called before forking workers: each process gets its share, so the limits stay global.
+        self.max_concurrent = max(1, self.max_concurrent // processes)
+        self.max_queue = max(1, self.max_queue // processes)
+        self.semaphore = asyncio.Semaphore(self.max_concurrent)
+
+
+    async def __aenter__(self):
+        if self.semaphore.locked() and self.waiting >= self.max_queue:
+            raise OverloadedError(self.queue_timeout)
+
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self.semaphore.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise OverloadedError(self.queue_timeout)
+        finally:
+            self.waiting -= 1
+
+        self.in_flight += 1
+        return self
+
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.in_flight -= 1
+        self.semaphore.release()
+
+
+route_limiters = {
+    "read": RateLimiter("api.read", *parse_rate(os.getenv("RATE_LIMIT_READ"), "120/60")),
+    "write": RateLimiter("api.write", *parse_rate(os.getenv("RATE_LIMIT_WRITE"), "30/60")),
+    "upload": RateLimiter("api.upload", *parse_rate(os.getenv("RATE_LIMIT_UPLOAD"), "10/60")),
+    # Per client address, checked before the token is: bounds what unauthenticated requests can cost.
+    "client": RateLimiter("api.client", *parse_rate(os.getenv("RATE_LIMIT_CLIENT"), "600/60")),
+}
+
+# Bot updates are routed to workers by user_id, so per-user buckets never need to be shared.
+bot_limiters = {
+    "message": RateLimiter("bot.message", *parse_rate(os.getenv("BOT_RATE_LIMIT_MESSAGE"), "30/60"), shared=False),
+    "media": RateLimiter("bot.media", *parse_rate(os.getenv("BOT_RATE_LIMIT_MEDIA"), "20/60"), shared=False),
+}
+
+upload_limiter = ConcurrencyLimiter(
+    max_concurrent=int(os.getenv("UPLOAD_MAX_CONCURRENT", os.cpu_count() or 4)),
+    max_queue=int(os.getenv("UPLOAD_MAX_QUEUE", 32)),
+    queue_timeout=float(os.getenv("UPLOAD_QUEUE_TIMEOUT", 10)),
+)
+
+registry.gauge("pintag_upload_queue_depth", "Uploads waiting for an encryption slot",
+               callback=lambda: upload_limiter.waiting)
+registry.gauge("pintag_upload_in_flight", "Uploads currently being encrypted and stored",
+               callback=lambda: upload_limiter.in_flight)
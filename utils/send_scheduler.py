@@ -0,0 +1,173 @@
+import asyncio
+import datetime
+import heapq
+import itertools
+import logging
+import os
+import time
+
+from dotenv import load_dotenv
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from utils.metrics import registry
+from utils.rate_limiter import TokenBucket, parse_rate
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_NOTIFICATION = 10
+
+LIMITED_ENDPOINT_PREFIXES = ("send", "edit", "copy", "forward")
+
+send_wait_seconds = registry.histogram(
+    "pintag_telegram_send_wait_seconds", "Time outbound messages waited for Telegram flood limits", ("priority",),
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+)
+send_requests_total = registry.counter(
+    "pintag_telegram_send_requests_total", "Rate limited Bot API requests", ("endpoint", "outcome")
+)
+retry_after_total = registry.counter(
+    "pintag_telegram_retry_after_total", "429 RetryAfter responses received from Telegram", ("scope",)
+)
+
+
+def retry_after_seconds(exc: RetryAfter) -> float:
+    # An int before PTB 22.2, a timedelta when PTB_TIMEDELTA is set on newer versions.
+    retry_after = exc.retry_after
+    return retry_after.total_seconds() if isinstance(retry_after, datetime.timedelta) else float(retry_after)
+
+
+class SendScheduler(BaseRateLimiter[int]):
+    def __init__(self, overall_rate: str = None, private_chat_rate: str = None, group_chat_rate: str = None,
+                 max_retries: int = None, max_chats: int = 10_000):
+        self.overall = TokenBucket(*self.bucket_args(overall_rate or os.getenv("TELEGRAM_SEND_RATE"), "30/1"))
+        self.private_chat_rate = self.bucket_args(
+            private_chat_rate or os.getenv("TELEGRAM_SEND_RATE_PRIVATE_CHAT"), "5/5"
+        )
+        self.group_chat_rate = self.bucket_args(
+            group_chat_rate or os.getenv("TELEGRAM_SEND_RATE_GROUP_CHAT"), "20/60"
+        )
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv("TELEGRAM_SEND_MAX_RETRIES", 3))
+        self.max_chats = max_chats
+        self.chats: dict[int, TokenBucket] = {}
+        self.blocked_until = 0.0
+        self.waiting: list[tuple[int, int]] = []
+        self.chat_waiting = 0
+        self.sequence = itertools.count()
+        self.condition = None
+
+        registry.gauge("pintag_telegram_send_queue_depth", "Outbound messages waiting for the global limit").callback = \
+            lambda: len(self.waiting)
+        registry.gauge("pintag_telegram_send_chat_queue_depth",
+                       "Outbound messages waiting for their chat limit").callback = lambda: self.chat_waiting
+
+
+    @staticmethod
+    def bucket_args(value: str, default: str) -> tuple[float, int]:
+        requests, seconds = parse_rate(value, default)
+        return requests / seconds, requests
+
+
+    async def initialize(self) -> None:
+        self.condition = asyncio.Condition()
+
+
+    async def shutdown(self) -> None:
+        pass
+
+
+    def chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self.chats.get(chat_id)
+        if bucket is None:
+            if len(self.chats) >= self.max_chats:
+                now = time.monotonic()
+                self.chats = {
+                    key: bucket for key, bucket in self.chats.items()
+                    if bucket.tokens < bucket.capacity - (now - bucket.updated_at) * bucket.rate
+                }
+            rate, capacity = self.group_chat_rate if chat_id < 0 else self.private_chat_rate
+            bucket = self.chats[chat_id] = TokenBucket(rate, capacity)
+        return bucket
+
+
+    async def wait_for_chat(self, chat_id: int):
+        delay = self.chat_bucket(chat_id).reserve()
+        if delay:
+            self.chat_waiting += 1
+            try:
+                await asyncio.sleep(delay)
+            finally:
+                self.chat_waiting -= 1
+
+
+    async def wait_for_overall(self, priority: int):
+        # A heap keeps interactive replies ahead of notifications when the global limit is the bottleneck.
+        ticket = (priority, next(self.sequence))
+        async with self.condition:
+            heapq.heappush(self.waiting, ticket)
+            self.condition.notify_all()
+            try:
+                while True:
+                    if self.waiting[0] != ticket:
+                        await self.condition.wait()
+                        continue
+
+                    delay = max(self.blocked_until - time.monotonic(), 0.0) or self.overall.consume()
+                    if not delay:
+                        heapq.heappop(self.waiting)
+                        self.condition.notify_all()
+                        return
+                    try:
+                        await asyncio.wait_for(self.condition.wait(), timeout=delay)
+                    except asyncio.TimeoutError:
+                        pass
+            except BaseException:
+                if ticket in self.waiting:
+                    self.waiting.remove(ticket)
+                    heapq.heapify(self.waiting)
+                    self.condition.notify_all()
+                raise
+
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        if not endpoint.startswith(LIMITED_ENDPOINT_PREFIXES):
+            return await callback(*args, **kwargs)
+
+        priority = PRIORITY_INTERACTIVE if rate_limit_args is None else rate_limit_args
+        chat_id = data.get("chat_id")
+        if isinstance(chat_id, str):
+            chat_id = int(chat_id) if chat_id.lstrip("-").isdigit() else None
+
+        for attempt in range(self.max_retries + 1):
+            started_at = time.perf_counter()
+            if chat_id is not None:
+                await self.wait_for_chat(chat_id)
+            await self.wait_for_overall(priority)
+            send_wait_seconds.observe(time.perf_counter() - started_at, priority=str(priority))
+
+            try:
+                result = await callback(*args, **kwargs)
+            except RetryAfter as exc:
+                retry_after = retry_after_seconds(exc) + 0.1
+                if chat_id is not None:
+                    retry_after_total.inc(scope="chat")
+                    self.chat_bucket(chat_id).block(retry_after)
+                else:
+                    retry_after_total.inc(scope="global")
+                    self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+
+                if attempt == self.max_retries:
+                    send_requests_total.inc(endpoint=endpoint, outcome="dropped")
+                    raise
+                logger.warning(f"Flood limit on {endpoint} for chat {chat_id}, retrying in {retry_after:.1f}s")
+                send_requests_total.inc(endpoint=endpoint, outcome="retried")
+                continue
+            except Exception:
+                send_requests_total.inc(endpoint=endpoint, outcome="error")
+                raise
+
+            send_requests_total.inc(endpoint=endpoint, outcome="sent")
+            return result
@@ -0,0 +1,52 @@
+import bisect
+import hashlib
+import logging
+
+from telegram import Update
+
+from utils.metrics import registry
+from utils.update_processor import PerUserUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+HASH_RING_REPLICAS = 128
+
+routed_updates_total = registry.counter(
+    "pintag_worker_routed_updates_total", "Bot updates routed to a worker process", ("worker",)
+)
+
+
+class HashRing:
+    def __init__(self, nodes: int, replicas: int = HASH_RING_REPLICAS):
+        points = sorted(
+            (self.hash(f"worker-{node}:{replica}"), node) for node in range(nodes) for replica in range(replicas)
+        )
+        self.hashes = [point for point, _ in points]
+        self.nodes = [node for _, node in points]
+
+
+    @staticmethod
+    def hash(value: str) -> int:
+        return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+    def node_for(self, key) -> int:
+        index = bisect.bisect(self.hashes, self.hash(str(key))) % len(self.hashes)
+        return self.nodes[index]
+
+
+class UpdateRouter:
+    def __init__(self, queues: list):
+        self.queues = queues
+        self.ring = HashRing(len(queues))
+
+
+    def worker_for(self, payload: dict) -> int:
+        key = PerUserUpdateProcessor.ordering_key(Update.de_json(payload, None))
+        return self.ring.node_for(key if key is not None else payload.get("update_id"))
+
+
+    def __call__(self, payload: dict):
+        worker = self.worker_for(payload)
+        self.queues[worker].put(payload)
+        routed_updates_total.inc(worker=str(worker))
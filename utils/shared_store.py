@@ -0,0 +1,84 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+PRUNE_EVERY = 1000
+
+
+class SQLiteStore:
+    def __init__(self, path: str):
+        self.path = path
+        self.local = threading.local()
+        self.operations = 0
+
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        # Connections must not cross a fork, so every process (and thread) opens its own.
+        if getattr(self.local, "pid", None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS token_buckets ("
+                "key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL, full_at REAL NOT NULL)"
+            )
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+        return self.local.connection
+
+
+    def take_token(self, key: str, rate: float, capacity: int, cost: float = 1) -> float:
+        connection = self.connection
+        now = time.time()
+
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute(
+                "SELECT tokens, updated_at FROM token_buckets WHERE key = ?", (key,)
+            ).fetchone()
+            tokens = capacity if row is None else min(capacity, row[0] + (now - row[1]) * rate)
+
+            retry_after = 0.0
+            if tokens >= cost:
+                tokens -= cost
+            else:
+                retry_after = (cost - tokens) / rate
+
+            connection.execute(
+                "INSERT INTO token_buckets (key, tokens, updated_at, full_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at, "
+                "full_at = excluded.full_at",
+                (key, tokens, now, now + (capacity - tokens) / rate),
+            )
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+        self.operations += 1
+        if self.operations % PRUNE_EVERY == 0:
+            self.prune()
+        return retry_after
+
+
+    def prune(self):
+        # A bucket that has refilled completely is the same as a missing one.
+        deleted = self.connection.execute("DELETE FROM token_buckets WHERE full_at < ?", (time.time(),)).rowcount
+        if deleted:
+            logger.debug(f"Pruned {deleted} idle token buckets")
+
+
+store = None
+
+
+def configure_store(path: str = None):
+    global store
+    store = SQLiteStore(path) if path else None
+    if store:
+        logger.info(f"Shared rate limit state stored in {path}")
+    return store
@@ -0,0 +1,76 @@
+import asyncio
+import logging
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from utils.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    def __init__(self, max_concurrent_updates: int, max_pending_updates: int = 1024):
+        # The base semaphore only bounds pending updates. Worker slots are taken after the
+        # per-user lock, so one flooding user holds a single slot instead of all of them.
+        super().__init__(max(max_concurrent_updates, max_pending_updates))
+        self.concurrency_limit = max_concurrent_updates
+        self.slots = asyncio.Semaphore(max_concurrent_updates)
+        self.user_locks: dict[int, asyncio.Lock] = {}
+        self.user_pending: dict[int, int] = {}
+        self.in_flight = 0
+
+        registry.gauge("pintag_bot_updates_in_flight", "Bot updates currently being handled").callback = \
+            lambda: self.in_flight
+        registry.gauge("pintag_bot_updates_pending", "Bot updates waiting for their user or a free slot").callback = \
+            lambda: self.current_concurrent_updates - self.in_flight
+        registry.gauge("pintag_bot_active_users", "Users with updates pending or in flight").callback = \
+            lambda: len(self.user_locks)
+
+
+    @staticmethod
+    def ordering_key(update: object):
+        if isinstance(update, Update):
+            if update.effective_user:
+                return update.effective_user.id
+            if update.effective_chat:
+                return update.effective_chat.id
+        return None
+
+
+    async def run_with_slot(self, coroutine):
+        async with self.slots:
+            self.in_flight += 1
+            try:
+                await coroutine
+            finally:
+                self.in_flight -= 1
+
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        key = self.ordering_key(update)
+        if key is None:
+            await self.run_with_slot(coroutine)
+            return
+
+        lock = self.user_locks.get(key)
+        if lock is None:
+            lock = self.user_locks[key] = asyncio.Lock()
+        self.user_pending[key] = self.user_pending.get(key, 0) + 1
+
+        try:
+            async with lock:
+                await self.run_with_slot(coroutine)
+        finally:
+            self.user_pending[key] -= 1
+            if not self.user_pending[key]:
+                del self.user_pending[key]
+                del self.user_locks[key]
+
+
+    async def initialize(self) -> None:
+        pass
+
+
+    async def shutdown(self) -> None:
+        pass
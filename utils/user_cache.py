@@ -0,0 +1,74 @@
+import os
+import time
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+from utils.metrics import registry
+
+load_dotenv()
+
+user_cache_requests = registry.counter(
+    "pintag_user_cache_requests_total", "Per-user cache lookups", ("cache", "result")
+)
+
+
+class UserCache:
+    def __init__(self, name: str, max_users: int = 10_000, ttl: float = 300, max_entries: int = 64):
+        self.name = name
+        self.max_users = max_users
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.users: OrderedDict[int, OrderedDict] = OrderedDict()
+
+
+    def get(self, user_id: int, key, record: bool = True):
+        entries = self.users.get(user_id)
+        entry = entries.get(key) if entries else None
+
+        if entry is None or time.monotonic() - entry[0] > self.ttl:
+            if record:
+                user_cache_requests.inc(cache=self.name, result="miss")
+            return None
+
+        self.users.move_to_end(user_id)
+        entries.move_to_end(key)
+        if record:
+            user_cache_requests.inc(cache=self.name, result="hit")
+        return entry[1]
+
+
+    def set(self, user_id: int, key, markup):
+        if self.max_users <= 0:
+            return
+        entries = self.users.get(user_id)
+        if entries is None:
+            entries = self.users[user_id] = OrderedDict()
+            if len(self.users) > self.max_users:
+                self.users.popitem(last=False)
+
+        self.users.move_to_end(user_id)
+        entries[key] = (time.monotonic(), markup)
+        entries.move_to_end(key)
+        # Every keystroke of an inline query is a key, one user must not grow without bound between evictions.
+        while len(entries) > self.max_entries:
+            entries.popitem(last=False)
+
+
+    def invalidate(self, user_id: int):
+        self.users.pop(user_id, None)
+
+
+keyboard_cache = UserCache(
+    "keyboard",
+    max_users=int(os.getenv("KEYBOARD_CACHE_USERS", 10_000)),
+    ttl=float(os.getenv("KEYBOARD_CACHE_TTL", 300)),
+    max_entries=int(os.getenv("KEYBOARD_CACHE_ENTRIES", 64)),
+)
+
+search_cache = UserCache(
+    "inline_search",
+    max_users=int(os.getenv("SEARCH_CACHE_USERS", 10_000)),
+    ttl=float(os.getenv("SEARCH_CACHE_TTL", 30)),
+    max_entries=int(os.getenv("SEARCH_CACHE_ENTRIES", 64)),
+)